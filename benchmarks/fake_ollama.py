@@ -0,0 +1,192 @@
+"""
+模擬 Ollama HTTP API 的本機伺服器，回傳可重現的假向量與假回答，供基準測試離線使用。
+
+支援：/api/embed、/api/embeddings、/api/generate、/api/chat、/api/tags、/api/show
+"""
+
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import numpy as np
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """以文字雜湊為亂數種子產生單位向量；相同文字必得相同向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def fake_answer_tokens(prompt: str, n_tokens: int) -> List[str]:
+    """由 prompt 內容挑選字詞組成固定長度的回答"""
+    words = prompt.split() or ["answer"]
+    seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little")
+    rng = np.random.default_rng(seed)
+    return [words[i] + " " for i in rng.integers(0, len(words), n_tokens)]
+
+
+class FakeOllamaServer:
+    """在背景執行緒啟動的假 Ollama 伺服器"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dim: int = 1024,
+                 embed_latency_ms: float = 0.0, token_latency_ms: float = 0.0,
+                 prefill_ms_per_1k_chars: float = 0.0, answer_tokens: int = 64):
+        self.dim = dim
+        self.embed_latency = embed_latency_ms / 1000
+        self.token_latency = token_latency_ms / 1000
+        self.prefill_per_char = prefill_ms_per_1k_chars / 1000 / 1000
+        self.answer_tokens = answer_tokens
+        self.requests = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 與 Ollama（Go net/http）相同關閉 Nagle，keep-alive 連線上才不會因 delayed ACK 多等約 40ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _read_json(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _send_json(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, lines):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for line in lines:
+                    data = (json.dumps(line) + "\n").encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                server.requests += 1
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "fake", "model": "fake"}]})
+                elif self.path in ("/", "/api/version"):
+                    self._send_json({"version": "0.0.0-fake"})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                server.requests += 1
+                body = self._read_json()
+                model = body.get("model", "fake")
+
+                if self.path == "/api/embed":
+                    inputs = body.get("input", [])
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    time.sleep(server.embed_latency * len(inputs))
+                    self._send_json({"model": model, "embeddings": [fake_embedding(t, server.dim) for t in inputs]})
+
+                elif self.path == "/api/embeddings":
+                    time.sleep(server.embed_latency)
+                    self._send_json({"embedding": fake_embedding(body.get("prompt", ""), server.dim)})
+
+                elif self.path in ("/api/generate", "/api/chat"):
+                    if self.path == "/api/chat":
+                        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+                    else:
+                        prompt = body.get("prompt", "")
+                    self._generate(model, prompt, stream=body.get("stream", True), chat=self.path == "/api/chat")
+
+                elif self.path == "/api/show":
+                    self._send_json({"modelfile": "", "parameters": "", "template": "", "details": {}})
+
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def _generate(self, model: str, prompt: str, stream: bool, chat: bool):
+                # 模擬 prefill：prompt 越長，首個 token 越晚出現
+                time.sleep(server.prefill_per_char * len(prompt))
+                tokens = fake_answer_tokens(prompt, server.answer_tokens)
+
+                def message(text, done):
+                    payload = {
+                        "model": model,
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "done": done,
+                    }
+                    if chat:
+                        payload["message"] = {"role": "assistant", "content": text}
+                    else:
+                        payload["response"] = text
+                    if done:
+                        payload.update({"done_reason": "stop", "prompt_eval_count": len(prompt) // 4,
+                                        "eval_count": len(tokens)})
+                    return payload
+
+                if not stream:
+                    time.sleep(server.token_latency * len(tokens))
+                    self._send_json(message("".join(tokens), True))
+                    return
+
+                def lines():
+                    for token in tokens:
+                        time.sleep(server.token_latency)
+                        yield message(token, False)
+                    yield message("", True)
+
+                self._send_stream(lines())
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="啟動假的 Ollama 伺服器")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeOllamaServer(port=args.port, dim=args.dim, embed_latency_ms=args.embed_latency_ms,
+                            token_latency_ms=args.token_latency_ms).start()
+    print(f"Fake Ollama 伺服器啟動：{fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,97 @@
+"""
+啟動匯入時間檢查：在乾淨的子行程中量測各模組的匯入耗時，並確認重量級套件沒有在匯入時被載入。
+超過時間預算或提前載入重量級套件時以非零結束碼結束，可放在 CI 中防止啟動變慢。
+
+python -m benchmarks.import_time --runs 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 模組 -> 匯入時間預算（秒）；frontend.app 另含 gradio 本身的匯入成本
+BUDGETS = {
+    "modules.splitter": 0.5,
+    "modules.embedder": 0.5,
+    "modules.retriever": 0.5,
+    "modules.reranker": 0.5,
+    "modules.qa_chain": 0.5,
+    "modules.query_transformer": 0.5,
+    "modules.bulk_ingest": 0.8,
+    "frontend.app": 5.0,
+}
+
+# 只應在第一次使用（或背景暖機）時才載入的套件
+HEAVY_MODULES = (
+    "torch", "transformers", "nltk", "unstructured", "chromadb",
+    "langchain_core", "langchain_community", "langchain_ollama", "rank_bm25",
+)
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def measure(module: str) -> dict:
+    """在新的直譯器中匯入模組一次，回傳耗時與已載入的重量級套件"""
+    code = _PROBE.format(root=ROOT, module=module, heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+        return {"error": error}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(runs: int) -> dict:
+    report = {}
+    for module, budget in BUDGETS.items():
+        samples = [measure(module) for _ in range(runs)]
+        errors = [s["error"] for s in samples if "error" in s]
+        if errors:
+            report[module] = {"budget_s": budget, "error": errors[0]}
+            continue
+        report[module] = {
+            "budget_s": budget,
+            "median_s": median(s["seconds"] for s in samples),
+            "heavy": samples[0]["heavy"],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="檢查模組匯入時間與延遲載入")
+    parser.add_argument("--runs", type=int, default=3, help="每個模組量測次數（取中位數）")
+    parser.add_argument("--output", help="結果 JSON 路徑")
+    args = parser.parse_args()
+
+    report = run(args.runs)
+    failed = False
+    print(f"{'module':<28}{'median s':>10}{'budget s':>10}  status")
+    for module, r in report.items():
+        if "error" in r:
+            # 缺少選用相依套件（例如未安裝 gradio）時跳過，不視為失敗
+            print(f"{module:<28}{'-':>10}{r['budget_s']:>10.2f}  略過（{r['error']}）")
+            continue
+        problems = []
+        if r["median_s"] > r["budget_s"]:
+            problems.append("超過預算")
+        if r["heavy"]:
+            problems.append("提前載入 " + ", ".join(r["heavy"]))
+        failed = failed or bool(problems)
+        print(f"{module:<28}{r['median_s']:>10.3f}{r['budget_s']:>10.2f}  {'；'.join(problems) or 'OK'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,180 @@
+"""
+量化向量儲存的佔用與召回率報告：對合成的有標註查詢集（每個查詢由某個 chunk 加雜訊產生，該 chunk 即為正解），
+比較三種存放方式的實際硬碟佔用、相對 float32 精確搜尋的 recall@k、正解命中率與查詢延遲：
+  chroma：只用 Chroma（float32 向量、內容與 HNSW；recall 為 HNSW 的實際結果）
+  chroma+mmap：Chroma 之外另存向量矩陣與 sidecar（Config.VECTOR_BACKEND = "mmap"；重算距離時讀 Chroma 的原始向量）
+  dense：只存向量矩陣、sidecar 與量化時的 float32 副本，不寫入 Chroma（Config.DENSE_INDEX_PRIMARY）
+
+python -m benchmarks.quantization --docs 20 --chunks-per-doc 300 --queries 200 --k 20 --rescore 100
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from benchmarks.shard_scaling import synthetic_corpus
+
+WORDS = "model attention layer encoder decoder training dataset accuracy retrieval query passage token".split()
+
+
+def synthetic_text(chars: int, rng) -> str:
+    """長度約 chars 字元的合成 chunk 內容（sidecar 與 Chroma 各存一份）"""
+    words = rng.choice(WORDS, size=max(1, chars // 8))
+    return " ".join(words)[:chars]
+
+
+def dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def labeled_queries(vectors: np.ndarray, n: int, noise: float, rng) -> tuple:
+    """由隨機 chunk 加雜訊產生查詢，回傳 (查詢矩陣, 正解列號)"""
+    targets = rng.integers(len(vectors), size=n)
+    q = vectors[targets] + noise * rng.standard_normal((n, vectors.shape[1])).astype(np.float32) / np.sqrt(vectors.shape[1])
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q.astype(np.float32), targets
+
+
+def evaluate(rows_for, queries: np.ndarray, targets: np.ndarray, truth: list, k: int) -> dict:
+    """rows_for(q) 回傳查詢的前 k 個列號"""
+    started = time.perf_counter()
+    recalls, hits = [], []
+    for q, target, exact in zip(queries, targets, truth):
+        rows = rows_for(q)[:k]
+        recalls.append(len(set(rows) & exact) / k)
+        hits.append(target in rows)
+    elapsed = time.perf_counter() - started
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        f"label_hit@{k}": float(np.mean(hits)),
+        "query_ms": elapsed / len(queries) * 1000,
+    }
+
+
+def dense_rows(index, k: int, rescore: int):
+    def rows_for(q):
+        rows = [row for row, _ in index.search([q], max(k, rescore))[0]]
+        if rescore:
+            # 以原始 float32 向量重算距離（chroma+mmap 由 Chroma 取出、dense 由 float32 副本讀取，數值相同）
+            d = np.sum((index.float32_rows(rows) - q) ** 2, axis=1)
+            rows = [rows[i] for i in np.argsort(d, kind="stable")]
+        return rows
+    return rows_for
+
+
+def chroma_rows(collection, filename: str, k: int):
+    def rows_for(q):
+        result = collection.query(query_embeddings=[q.tolist()], n_results=k, where={"filename": filename},
+                                  include=["distances"])
+        return [int(i.rsplit("::", 1)[1]) for i in result["ids"][0]]
+    return rows_for
+
+
+def run(args) -> dict:
+    from modules.dense_index import full_precision_path, index_paths, save_dense_index
+    from modules.vector_shards import open_document_shard
+
+    def file_bytes(filename: str) -> dict:
+        vector_path, sidecar_path = index_paths(filename)
+        full_path = full_precision_path(filename)
+        return {
+            "vector_bytes": os.path.getsize(vector_path),
+            "full_bytes": os.path.getsize(full_path) if os.path.exists(full_path) else 0,
+            "sidecar_bytes": os.path.getsize(sidecar_path),
+        }
+
+    rng = np.random.default_rng(args.seed)
+    docs = list(synthetic_corpus(args.docs, args.chunks_per_doc, args.dim, seed=args.seed))
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        Config.DENSE_INDEX_DIR = os.path.join(workdir, "dense")
+        Config.VECTOR_CHUNK_DB = os.path.join(workdir, "chunks")
+        for filename, _, full in docs:
+            ids = [f"{filename}::{i}" for i in range(len(full))]
+            documents = [synthetic_text(args.chunk_chars, rng) for _ in ids]
+            metadatas = [{"filename": filename, "page": 1} for _ in ids]
+            collection = open_document_shard(filename)._collection
+            collection.add(ids=ids, embeddings=full.tolist(), documents=documents, metadatas=metadatas)
+            queries, targets = labeled_queries(full, max(1, args.queries // len(docs)), args.noise, rng)
+            exact = np.argsort(
+                np.sum(queries ** 2, axis=1, keepdims=True) - 2 * queries @ full.T + np.sum(full ** 2, axis=1), axis=1
+            )[:, :args.k]
+            truth = [set(row.tolist()) for row in exact]
+
+            results.append({"layout": "chroma", "dtype": "float32", "rescore": 0,
+                            **evaluate(chroma_rows(collection, filename, args.k), queries, targets, truth, args.k)})
+            for dtype in ("float32", "float16", "int8"):
+                # chroma+mmap：矩陣只是副本；dense：矩陣是唯一的向量，量化時附 float32 副本
+                save_dense_index(filename, ids, documents, metadatas, full, dtype=dtype)
+                copy_sizes = file_bytes(filename)
+                index = save_dense_index(filename, ids, documents, metadatas, full, dtype=dtype, full_precision=True)
+                dense_sizes = file_bytes(filename)
+                for rescore in ([0] if dtype == "float32" else sorted({0, args.rescore})):
+                    metrics = evaluate(dense_rows(index, args.k, rescore), queries, targets, truth, args.k)
+                    results.append({"layout": "chroma+mmap", "dtype": dtype, "rescore": rescore, **copy_sizes, **metrics})
+                    results.append({"layout": "dense", "dtype": dtype, "rescore": rescore, **dense_sizes, **metrics})
+        chroma_bytes = dir_bytes(Config.VECTOR_CHUNK_DB)
+
+    # 彙總各文件
+    summary = {}
+    for entry in results:
+        summary.setdefault((entry["layout"], entry["dtype"], entry["rescore"]), []).append(entry)
+    byte_keys = ("vector_bytes", "full_bytes", "sidecar_bytes")
+    rows = []
+    for (layout, dtype, rescore), entries in summary.items():
+        sizes = {key: sum(e.get(key, 0) for e in entries) for key in byte_keys}
+        chroma = chroma_bytes if layout != "dense" else 0
+        total = chroma + sum(sizes.values())
+        rows.append({
+            "layout": layout,
+            "dtype": dtype,
+            "rescore": rescore,
+            "vector_mb": (sizes["vector_bytes"] + sizes["full_bytes"]) / 1024 / 1024,   # 矩陣（含 float32 副本）
+            "sidecar_mb": sizes["sidecar_bytes"] / 1024 / 1024,
+            "chroma_mb": chroma / 1024 / 1024,
+            "total_mb": total / 1024 / 1024,
+            "total_vs_chroma": total / chroma_bytes - 1,             # 相對只用 Chroma 時的總佔用變化
+            **{key: float(np.mean([e[key] for e in entries])) for key in entries[0]
+               if key not in ("layout", "dtype", "rescore") + byte_keys},
+        })
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "parameters": vars(args),
+        "results": rows,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="量化向量儲存：記憶體節省 vs recall@k")
+    parser.add_argument("--docs", type=int, default=20, help="合成文件數")
+    parser.add_argument("--chunks-per-doc", type=int, default=300, help="每份文件的 chunk 數")
+    parser.add_argument("--dim", type=int, default=1024, help="向量維度（bge-m3 為 1024）")
+    parser.add_argument("--chunk-chars", type=int, default=1500, help="每個 chunk 的內容字元數（Chroma 與 sidecar 各存一份）")
+    parser.add_argument("--queries", type=int, default=200, help="有標註的查詢總數")
+    parser.add_argument("--noise", type=float, default=0.8, help="查詢相對正解 chunk 的雜訊強度")
+    parser.add_argument("--k", type=int, default=Config.VECTOR_TOP_K, help="recall@k 的 k")
+    parser.add_argument("--rescore", type=int, default=Config.DENSE_RESCORE_TOP, help="以原始向量重算距離的候選數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="quantization_results.json", help="結果 JSON 路徑")
+    args = parser.parse_args()
+
+    report = run(args)
+    k = args.k
+    print(f"{'layout':<13}{'dtype':<9}{'rescore':>8}{'matrix MB':>11}{'sidecar MB':>12}{'chroma MB':>11}{'total MB':>10}"
+          f"{'vs chroma':>11}{f'recall@{k}':>12}{f'label@{k}':>11}{'ms/query':>10}")
+    for r in report["results"]:
+        print(f"{r['layout']:<13}{r['dtype']:<9}{r['rescore']:>8}{r['vector_mb']:>11.2f}{r['sidecar_mb']:>12.2f}"
+              f"{r['chroma_mb']:>11.2f}{r['total_mb']:>10.2f}{r['total_vs_chroma']:>+11.0%}"
+              f"{r[f'recall@{k}']:>12.4f}{r[f'label_hit@{k}']:>11.4f}{r['query_ms']:>10.3f}")
+    print("\nmatrix MB 含 dense 量化格式的 float32 副本；chroma 列的 recall 為 HNSW 近似搜尋的實際結果")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {args.output}")
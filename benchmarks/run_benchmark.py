@@ -0,0 +1,255 @@
+"""
+端到端 RAG 基準測試：以假的 Ollama 伺服器與合成 PDF 離線量測各階段延遲、吞吐量與記憶體峰值。
+
+python -m benchmarks.run_benchmark --docs 3 --pages 20 --queries 30 --output bench_results.json
+python -m benchmarks.run_benchmark --baseline bench_results.json   # 與先前結果比較
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from benchmarks.fake_ollama import FakeOllamaServer
+from benchmarks.synthetic_pdf import synthetic_queries, write_pdf
+
+STAGES = (
+    "parse", "split", "embed", "store",
+    "query_embed", "vector_search", "bm25", "fusion", "rerank", "retrieve", "generate_ttft", "generate",
+)
+
+# 由檢索函數內的 metrics span 取得的查詢階段
+QUERY_SPANS = ("query_embed", "vector_search", "bm25", "fusion", "rerank")
+
+
+class StageTimer:
+    """記錄各階段每次執行的耗時（毫秒）"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    @contextmanager
+    def time(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[stage].append((time.perf_counter() - started) * 1000)
+
+    def summary(self) -> dict:
+        report = {}
+        for stage in [s for s in STAGES if s in self.samples] + [s for s in self.samples if s not in STAGES]:
+            values = np.asarray(self.samples[stage])
+            report[stage] = {
+                "count": int(values.size),
+                "total_ms": float(values.sum()),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p90_ms": float(np.percentile(values, 90)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "max_ms": float(values.max()),
+            }
+        return report
+
+
+class FakeReranker:
+    """以查詢與段落的詞彙重疊計分的 Reranker 替身（不需下載模型）"""
+
+    backend = "fake"
+
+    def score(self, pairs, keys=None):
+        scores = []
+        for query, passage in pairs:
+            q = set(query.lower().split())
+            p = passage.lower().split()
+            scores.append(sum(1 for w in p if w in q) / (len(p) + 1))
+        return np.asarray(scores, dtype=np.float32)
+
+
+def configure(workdir: str, ollama_url: str):
+    """將所有資料路徑導向暫存資料夾，並改用假的 Ollama 伺服器"""
+    Config.OLLAMA_HOST = ollama_url
+    Config.PDF_DIR = os.path.join(workdir, "pdfs")
+    Config.VECTOR_DIR = os.path.join(workdir, "vectors")
+    Config.VECTOR_CHUNK_DB = os.path.join(Config.VECTOR_DIR, "chunks")
+    Config.VECTOR_QUESTION_DB = os.path.join(Config.VECTOR_DIR, "questions")
+    Config.SPARSE_INDEX_DIR = os.path.join(Config.VECTOR_DIR, "sparse")
+    Config.DENSE_INDEX_DIR = os.path.join(Config.VECTOR_DIR, "dense")
+    Config.EMBEDDING_CACHE_PATH = os.path.join(Config.VECTOR_DIR, "embedding_cache.sqlite3")
+    Config.NEAR_DUP_INDEX_PATH = os.path.join(Config.VECTOR_DIR, "near_dup.sqlite3")
+    Config.CHUNK_STORE_DIR = os.path.join(workdir, "chunks")
+    # 量測完整檢索路徑，不使用查詢快取；各階段耗時取自 metrics span
+    Config.QUERY_CACHE_ENABLED = False
+    Config.METRICS_ENABLED = True
+    os.makedirs(Config.PDF_DIR, exist_ok=True)
+
+
+def rss_mb() -> float:
+    """目前為止的常駐記憶體峰值（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run(args) -> dict:
+    timer = StageTimer()
+    memory = {}
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as workdir, FakeOllamaServer(
+        dim=args.dim,
+        embed_latency_ms=args.embed_latency_ms,
+        token_latency_ms=args.token_latency_ms,
+        prefill_ms_per_1k_chars=args.prefill_ms_per_1k_chars,
+        answer_tokens=args.answer_tokens,
+    ) as server:
+        configure(workdir, server.url)
+        Config.VECTOR_BACKEND = args.vector_backend
+        cwd = os.getcwd()
+        os.chdir(workdir)
+
+        # 需在設定路徑後才匯入，讓模組預設值指向暫存資料夾
+        from modules import embedder, qa_chain, reranker, retriever, splitter
+        from modules.metrics import capture_spans
+
+        if args.reranker == "fake":
+            reranker.set_reranker(FakeReranker())
+
+        try:
+            # ---------------- Ingest ----------------
+            filenames = []
+            chunk_total = 0
+            ingest_started = time.perf_counter()
+            for d in range(args.docs):
+                pdf_path = write_pdf(os.path.join(Config.PDF_DIR, f"synthetic_{d}.pdf"), args.pages, seed=d)
+                filenames.append(os.path.basename(pdf_path))
+
+                with timer.time("parse"):
+                    elements = splitter.load_elements(pdf_path)
+                with timer.time("split"):
+                    chunks = splitter.split_elements(elements)
+                chunk_total += len(chunks)
+
+                # embed：實際呼叫 embedding 服務（快取為空，全部未命中）
+                emb = embedder.get_embedder()
+                texts = [c["content"] for c in chunks]
+                for start in range(0, len(texts), Config.EMBED_BATCH_SIZE):
+                    with timer.time("embed"):
+                        emb.embed_documents(texts[start:start + Config.EMBED_BATCH_SIZE])
+
+                # store：向量由快取提供，量測寫入 Chroma 與建立索引的成本
+                with timer.time("store"):
+                    embedder.store_vectors(chunks, collection_name="chunks", pdf_path=pdf_path)
+            ingest_seconds = time.perf_counter() - ingest_started
+            memory["after_ingest_peak_rss_mb"] = rss_mb()
+
+            # ---------------- Query ----------------
+            queries = synthetic_queries(args.queries)
+            query_started = time.perf_counter()
+            for n, query in enumerate(queries):
+                # 經由對外的檢索入口，各階段耗時由其 span 取得
+                with capture_spans() as spans, timer.time("retrieve"):
+                    docs = retriever.hybrid_search_scored(query, filenames[n % len(filenames)])
+                for stage in QUERY_SPANS:
+                    if stage in spans:
+                        timer.samples[stage].append(spans[stage] * 1000)
+
+                started = time.perf_counter()
+                first = None
+                for _ in qa_chain.generate_answer_stream(query, docs):
+                    if first is None:
+                        first = time.perf_counter()
+                end = time.perf_counter()
+                timer.samples["generate_ttft"].append(((first or end) - started) * 1000)
+                timer.samples["generate"].append((end - started) * 1000)
+            query_seconds = time.perf_counter() - query_started
+            memory["peak_rss_mb"] = rss_mb()
+        finally:
+            os.chdir(cwd)
+
+    if args.tracemalloc:
+        memory["python_heap_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    stages = timer.summary()
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "parameters": vars(args) | {
+            "chunk_size": Config.CHUNK_SIZE,
+            "vector_top_k": Config.VECTOR_TOP_K,
+            "mid_top_m": Config.MID_TOP_M,
+            "final_top_m": Config.FINAL_TOP_M,
+        },
+        "stages": stages,
+        "throughput": {
+            "chunks": chunk_total,
+            "ingest_docs_per_sec": args.docs / ingest_seconds,
+            "ingest_chunks_per_sec": chunk_total / ingest_seconds,
+            "pages_per_sec": args.docs * args.pages / ingest_seconds,
+            "queries_per_sec": args.queries / query_seconds if args.queries else 0.0,
+        },
+        "memory": memory,
+    }
+
+
+def print_report(result: dict, baseline: dict = None):
+    print(f"\n{'stage':<15}{'count':>7}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}" + ("  vs baseline p50" if baseline else ""))
+    for stage, s in result["stages"].items():
+        line = f"{stage:<15}{s['count']:>7}{s['p50_ms']:>11.2f}{s['p90_ms']:>11.2f}{s['p99_ms']:>11.2f}"
+        base = (baseline or {}).get("stages", {}).get(stage)
+        if base and base["p50_ms"] > 0:
+            line += f"  {(s['p50_ms'] / base['p50_ms'] - 1) * 100:+.1f}%"
+        print(line)
+    print()
+    for key, value in {**result["throughput"], **result["memory"]}.items():
+        print(f"{key:<28}{value:.2f}" if isinstance(value, float) else f"{key:<28}{value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="端到端 RAG 基準測試（離線）")
+    parser.add_argument("--docs", type=int, default=2, help="合成 PDF 份數")
+    parser.add_argument("--pages", type=int, default=10, help="每份 PDF 頁數")
+    parser.add_argument("--queries", type=int, default=20, help="查詢次數")
+    parser.add_argument("--dim", type=int, default=1024, help="假向量維度（bge-m3 為 1024）")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="假 embedding 每段文字的延遲")
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="假 LLM 每個 token 的延遲")
+    parser.add_argument("--prefill-ms-per-1k-chars", type=float, default=0.0, help="假 LLM 每千字元 prompt 的 prefill 延遲")
+    parser.add_argument("--answer-tokens", type=int, default=64, help="假 LLM 回答的 token 數")
+    parser.add_argument("--reranker", choices=["fake", "model"], default="fake",
+                        help="fake：詞彙重疊替身；model：Config.RERANKER_BACKEND 設定的實際模型")
+    parser.add_argument("--vector-backend", choices=["chroma", "mmap"], default=Config.VECTOR_BACKEND,
+                        help="單一文件查詢的向量檢索方式")
+    parser.add_argument("--tracemalloc", action="store_true", help="額外記錄 Python heap 峰值（會拖慢執行）")
+    parser.add_argument("--output", default="bench_results.json", help="結果 JSON 路徑")
+    parser.add_argument("--baseline", help="先前的結果 JSON，用於比較 p50 變化")
+    args = parser.parse_args()
+
+    output, baseline_path = args.output, args.baseline
+    result = run(args)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\n結果已寫入 {output}")
@@ -0,0 +1,111 @@
+"""
+向量檢索延遲與語料規模的關係：以合成向量（不需 Ollama）逐步填入向量庫，
+在每個規模量測單一文件查詢與跨文件查詢的延遲，比較不同分片數。
+
+python -m benchmarks.shard_scaling --sizes 2000 10000 50000 --shards 1 4 8 --output shard_results.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+
+def synthetic_corpus(n_docs: int, chunks_per_doc: int, dim: int, seed: int = 0):
+    """每份文件一個中心向量，chunk 為中心加雜訊後正規化；依文件逐份產生"""
+    rng = np.random.default_rng(seed)
+    for d in range(n_docs):
+        center = rng.standard_normal(dim)
+        vectors = center + 0.8 * rng.standard_normal((chunks_per_doc, dim))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield f"paper_{d:05d}.pdf", center, vectors.astype(np.float32)
+
+
+def percentiles(samples) -> dict:
+    values = np.asarray(samples) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p90_ms": float(np.percentile(values, 90))}
+
+
+def run_shards(shards: int, args) -> list:
+    from modules import retriever
+    from modules.vector_shards import open_document_shard
+
+    Config.VECTOR_SHARDS = shards
+    rng = np.random.default_rng(1)
+    sizes = sorted(args.sizes)
+    centers = {}
+    total = 0
+    rows = []
+
+    for filename, center, vectors in synthetic_corpus(sizes[-1] // args.chunks_per_doc, args.chunks_per_doc, args.dim):
+        open_document_shard(filename)._collection.add(
+            ids=[f"{filename}::{i}" for i in range(len(vectors))],
+            embeddings=vectors.tolist(),
+            documents=[f"{filename} chunk {i}" for i in range(len(vectors))],
+            metadatas=[{"filename": filename} for _ in range(len(vectors))],
+        )
+        centers[filename] = center
+        total += len(vectors)
+        if total not in sizes:
+            continue
+
+        # 查詢向量：隨機文件的中心加雜訊
+        names = list(centers)
+        per_doc, cross = [], []
+        for _ in range(args.queries):
+            filename_q = names[rng.integers(len(names))]
+            q = centers[filename_q] + 0.8 * rng.standard_normal(args.dim)
+            q = (q / np.linalg.norm(q)).astype(np.float32).tolist()
+
+            started = time.perf_counter()
+            retriever._vector_search(open_document_shard(filename_q), [q], filename_q)
+            per_doc.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            retriever._vector_search_all_shards([q])
+            cross.append(time.perf_counter() - started)
+
+        row = {"chunks": total, "docs": len(names), "shards": shards,
+               "per_document": percentiles(per_doc), "cross_document": percentiles(cross)}
+        rows.append(row)
+        print(f"{total:>9}{shards:>8}{row['per_document']['p50_ms']:>14.2f}{row['per_document']['p90_ms']:>14.2f}"
+              f"{row['cross_document']['p50_ms']:>14.2f}{row['cross_document']['p90_ms']:>14.2f}", flush=True)
+    return rows
+
+
+def run(args) -> dict:
+    print(f"{'chunks':>9}{'shards':>8}{'doc p50 ms':>14}{'doc p90 ms':>14}{'all p50 ms':>14}{'all p90 ms':>14}")
+    results = []
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as workdir:
+            Config.VECTOR_CHUNK_DB = os.path.join(workdir, "chunks")
+            results.extend(run_shards(shards, args))
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "parameters": vars(args) | {"vector_top_k": Config.VECTOR_TOP_K},
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="向量檢索延遲 vs 語料規模（合成向量）")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 10000, 30000], help="量測的 chunk 總數（需為 chunks-per-doc 的倍數）")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4, 8], help="比較的分片數")
+    parser.add_argument("--chunks-per-doc", type=int, default=100, help="每份文件的 chunk 數")
+    parser.add_argument("--dim", type=int, default=1024, help="向量維度（bge-m3 為 1024）")
+    parser.add_argument("--queries", type=int, default=50, help="每個規模的查詢次數")
+    parser.add_argument("--output", default="shard_results.json", help="結果 JSON 路徑")
+    args = parser.parse_args()
+
+    result = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {args.output}")
@@ -0,0 +1,119 @@
+"""
+產生指定頁數的合成論文 PDF（純 Python，不需額外套件）。
+內容包含章節標題、段落，以及每頁重複的頁首與致謝等樣板文字，用於模擬真實論文的重複內容。
+"""
+
+import random
+from typing import List
+
+VOCABULARY = (
+    "retrieval augmented generation transformer attention embedding vector index query document "
+    "passage reranker benchmark latency throughput corpus dataset evaluation baseline ablation model "
+    "training inference token context window encoder decoder layer parameter gradient optimization "
+    "precision recall accuracy score ranking hybrid sparse dense lexical semantic table figure equation "
+    "experiment result analysis method framework pipeline architecture multimodal knowledge graph"
+).split()
+
+RUNNING_HEADER = "Proceedings of the Synthetic Conference on Retrieval Systems"
+ACKNOWLEDGEMENT = (
+    "This work was supported in part by the Synthetic Research Foundation. "
+    "The authors thank the anonymous reviewers for their helpful comments."
+)
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+LINE_HEIGHT = 14
+CHARS_PER_LINE = 90
+LINES_PER_PAGE = 48
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _wrap(text: str) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if len(line) + len(word) + 1 > CHARS_PER_LINE:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    if line:
+        lines.append(line)
+    return lines
+
+
+def synthetic_pages(pages: int, seed: int = 0) -> List[List[str]]:
+    """產生每頁的文字行"""
+    rng = random.Random(seed)
+    result = []
+    section = 0
+    for page in range(pages):
+        lines = [RUNNING_HEADER, ""]
+        while len(lines) < LINES_PER_PAGE - 4:
+            if rng.random() < 0.25:
+                section += 1
+                lines += [f"{section} {rng.choice(VOCABULARY).capitalize()} {rng.choice(VOCABULARY).capitalize()}", ""]
+            paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 7)))
+            lines += _wrap(paragraph) + [""]
+        if page == pages - 1:
+            lines += ["Acknowledgements", ""] + _wrap(ACKNOWLEDGEMENT)
+        lines += ["", f"Page {page + 1}"]
+        result.append(lines[:LINES_PER_PAGE + 8])
+    return result
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: int, seed: int = 0) -> str:
+    """寫出合成 PDF 並回傳路徑"""
+    page_lines = synthetic_pages(pages, seed)
+
+    # 物件編號：1 catalog、2 pages、3 font，之後每頁兩個物件（page、content）
+    objects = {}
+    kids = []
+    for i, lines in enumerate(page_lines):
+        page_id, content_id = 4 + 2 * i, 5 + 2 * i
+        kids.append(f"{page_id} 0 R")
+        ops = [f"BT /F1 10 Tf {LINE_HEIGHT} TL 72 {PAGE_HEIGHT - 60} Td"]
+        for line in lines:
+            ops.append(f"({_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n".encode() + objects[obj_id] + b"\nendobj\n"
+
+    xref_at = len(out)
+    count = max(objects) + 1
+    out += f"xref\n0 {count}\n0000000000 65535 f \n".encode()
+    for obj_id in range(1, count):
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode()
+
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+def synthetic_queries(n: int, seed: int = 1) -> List[str]:
+    """產生與合成內容使用相同字彙的問題"""
+    rng = random.Random(seed)
+    return [
+        f"How does the {rng.choice(VOCABULARY)} {rng.choice(VOCABULARY)} affect {rng.choice(VOCABULARY)}?"
+        for _ in range(n)
+    ]
@@ -1,3 +1,4 @@
+import os
 import pathlib
 
 class Config:
@@ -10,24 +11,60 @@ class Config:
     VECTOR_DIR = BASE_DIR / "data/vectors"
     VECTOR_CHUNK_DB = VECTOR_DIR / "chunks"             # chunk 向量資料庫
     VECTOR_QUESTION_DB = VECTOR_DIR / "questions"      # question 向量資料庫
+    SPARSE_INDEX_DIR = VECTOR_DIR / "sparse"           # 每份文件的 BM25 倒排索引
+    DENSE_INDEX_DIR = VECTOR_DIR / "dense"             # 每份文件的向量矩陣（memory-mapped .npy）
+    RERANKER_ONNX_DIR = BASE_DIR / "data/models/onnx"  # 匯出的 ONNX reranker
+    EMBEDDING_CACHE_PATH = VECTOR_DIR / "embedding_cache.sqlite3"  # chunk 向量快取
+    NEAR_DUP_INDEX_PATH = VECTOR_DIR / "near_dup.sqlite3"          # 已向量化 chunk 的 MinHash 簽章（近似重複比對）
+    CHUNK_STORE_DIR = BASE_DIR / "data/chunks"          # 切塊結果（內容雜湊定址的 JSONL＋索引）
     QUESTION_DIR = BASE_DIR / "data/generated_questions" # 原始問題 JSON 存放
 
     # -----------------------------
     # 模型設定
     # -----------------------------
     OLLAMA_HOST = "http://localhost:11434"
+    OLLAMA_MAX_CONNECTIONS = 16                     # 連往 Ollama 的 keep-alive 連線池上限（LLM 與 embedding 各自一組）
+    OLLAMA_KEEPALIVE_EXPIRY = 60                    # 閒置連線保留秒數
 
     EMBEDDING_MODEL = "bge-m3"                      # Ollama embedding 模型
+    EMBEDDING_CACHE_ENABLED = True                  # 相同內容的 chunk 不重複向量化
+    EMBEDDING_CACHE_MAX_ENTRIES = 200_000           # 快取筆數上限，超過時淘汰最久未使用者
+    EMBED_BATCH_SIZE = 32                           # 每次送往 Ollama 的 chunk 數
+    EMBED_CONCURRENCY = 4                           # 同時進行的向量化請求數（依 Ollama 主機負載調整）
     LLM_MODEL = "llama3.2:1b"                       # Ollama LLM 模型
+    LLM_TOKENIZER = "unsloth/Llama-3.2-1B-Instruct" # 與 LLM_MODEL 相同的 HuggingFace tokenizer（計算 context token 數；None 時以字元數估算）
     RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"      # huggingface reranker模型
+    STREAM_METRICS_WINDOW = 500                     # 保留最近幾次串流回答的延遲統計
+    RERANKER_MAX_LENGTH = 512                       # reranker 輸入的最大 token 數
+    RERANKER_BATCH_SIZE = 8                         # reranker 每個小批次的配對數（依長度分桶，只補齊到桶內最長）
+    RERANKER_CACHE_SIZE = 20_000                    # (query, chunk) 分數快取筆數上限
+    RERANKER_BACKEND = "torch"                      # "torch"（fp32）、"int8"（CPU 動態量化）或 "onnx"（需 optimum[onnxruntime]）
+    PRELOAD_RERANKER = True                         # 背景暖機時預先載入 reranker，避免第一個查詢等待模型載入
 
     # -----------------------------
     # 檢索參數
     # -----------------------------
     VECTOR_TOP_K = 50                               # 向量檢索回傳的初始chunk數量
+    SPARSE_TOP_K = 50                               # BM25 倒排索引回傳的chunk數量（與向量結果取聯集）
+    VECTOR_BACKEND = "chroma"                       # 單一文件查詢的向量檢索："chroma"（HNSW）或 "mmap"（memory-mapped 矩陣精確搜尋）
+    DENSE_INDEX_DTYPE = "float32"                   # mmap 向量的儲存格式："float32"、"float16"（省 50%）或 "int8"（每向量縮放，省 75%）
+    DENSE_RESCORE_TOP = 100                         # 量化格式時，前幾名候選以原始 float32 向量重算距離（0 為不重算）
+    DENSE_INDEX_PRIMARY = False                     # mmap 時新文件只存於向量矩陣、不寫入 Chroma（量化格式另存 float32 副本供重算距離）
+    VECTOR_SHARDS = 1                               # chunk 向量庫分片數（依檔名雜湊分配）；調整後執行 python -m modules.vector_shards --migrate
+    SHARD_QUERY_WORKERS = 8                         # 跨文件查詢時並行查詢分片的執行緒數
+    CONTEXT_TOKEN_BUDGET = 1500                     # 送給 LLM 的 context token 上限（依 Reranker 分數放入，超過即截斷）
+    CONTEXT_MIN_PASSAGE_TOKENS = 64                 # 預算剩餘不足此數時不放入截斷的段落
     MID_TOP_M = 20                                  # 混合排序後回傳的chunk數量 (我將其設定為較小的 5 份作為範例)
     FINAL_TOP_M = 5                                 # reranker後最終輸出的chunk數量
 
+    QUERY_CACHE_ENABLED = True                      # 相似問題直接使用快取的檢索結果
+    QUERY_CACHE_THRESHOLD = 0.95                    # 查詢向量 cosine 相似度達此門檻視為同一問題
+    QUERY_CACHE_MAX_ENTRIES = 1000                  # 快取筆數上限（LRU 淘汰）
+    QUERY_CACHE_TTL = 3600                          # 快取存活秒數
+    QUERY_REWRITE_MODE = "off"                      # LLM 改寫查詢："off"、"serial"（改寫完才檢索）或 "speculative"（與原始查詢的檢索同時進行）；改寫時每個問題多一次 LLM 呼叫
+    QUERY_REWRITE_TIMEOUT = 3.0                     # 推測式改寫的等待上限（秒），逾時只用原始查詢的結果
+    QUERY_REWRITE_CACHE_SIZE = 1000                 # 改寫結果快取筆數上限（依模型與問題，LRU 淘汰）
+
     ALPHA = 0.6                                     # 向量相似度權重
     BETA = 0.4                                      # BM25 關鍵詞分數權重 
 
@@ -36,4 +73,32 @@ class Config:
     # -----------------------------
     # UnstructuredPDFLoader 切完超出 CHUNK_SIZE 才會切
     CHUNK_SIZE = 4000                               # 字元數參考，實際依 tokenizer
-    CHUNK_OVERLAP = 200                             # chunk 重疊字元
\ No newline at end of file
+    CHUNK_OVERLAP = 200                             # chunk 重疊字元
+    INCREMENTAL_UPDATE = True                       # 同檔名的新版本只向量化有變動的 chunk，並刪除已消失的 chunk
+    CHUNK_STORE_ENABLED = True                      # 同一檔案以相同參數切過時直接讀回，略過 Unstructured 解析
+    PARSE_PAGE_WINDOW = 20                          # 每次交給 Unstructured 解析的頁數（大型 PDF 分段解析以限制記憶體），0 表示整份一次解析
+    STREAM_INGEST = True                            # 新文件邊解析邊向量化寫入，前面的頁面可先被查詢
+    INGEST_STREAM_GROUP = 128                       # 串流 ingest 每組向量化並寫入的 chunk 數
+    INGEST_STREAM_PREFETCH = 2                      # 等待向量化的 chunk 組數上限（解析超前時暫停）
+    NEAR_DUP_ENABLED = True                         # 以 MinHash-LSH 過濾近似重複的 chunk（文件內丟棄，與既有 chunk 重複時沿用其向量）
+    NEAR_DUP_THRESHOLD = 0.9                        # 估計的 Jaccard 相似度達此門檻視為近似重複
+    NEAR_DUP_SHINGLE = 5                            # 字元 shingle 長度
+    NEAR_DUP_NUM_PERM = 64                          # MinHash 簽章長度（越長估計越準、計算越慢）
+    BULK_INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 批次匯入時解析 PDF 的行程數
+
+    # -----------------------------
+    # 介面參數
+    # -----------------------------
+    GRADIO_CONCURRENCY = 4                          # Gradio 佇列同時處理的請求數（問答）
+    GRADIO_QUEUE_MAX_SIZE = 32                      # 佇列中等待的請求上限，超過時新請求直接被拒絕
+    INGEST_JOB_WORKERS = 1                          # 背景同時處理的上傳文件數（與問答分開，不佔用佇列）
+    INGEST_JOB_MAX_PENDING = 8                      # 等待處理的上傳文件上限，超過時拒絕新的上傳
+    INGEST_JOB_HISTORY = 50                         # 保留已結束工作的筆數（供查詢結果）
+    JOB_POLL_INTERVAL = 2                           # 介面自動更新處理進度的間隔秒數
+    WARMUP_ON_START = True                          # 介面開始服務後於背景載入 NLTK、PDF 解析與模型等重量級套件
+
+    # -----------------------------
+    # 監控指標
+    # -----------------------------
+    METRICS_ENABLED = True                          # 記錄各階段耗時與計數（停用時幾乎無額外成本）
+    METRICS_PORT = 9464                             # Prometheus /metrics 端點埠號，None 表示不啟動
@@ -1,22 +1,28 @@
 import gradio as gr
 import os
 import shutil
+import time
 from typing import List, Tuple
 
 # ----------------------------------------------------
 # 模組匯入
 # ----------------------------------------------------
 try:
-    from modules.splitter import split_documents
-    from modules.embedder import store_vectors
-    from modules.retriever import hybrid_search
-    from modules.qa_chain import generate_answer
-    # from modules.query_transformer import transform_query
+    from modules.ingest_pipeline import ingest_pdf
+    from modules.retriever import hybrid_search_scored, hybrid_search_speculative
+    from modules.qa_chain import generate_answer, generate_answer_stream
+    from modules.manifest import file_sha256, get_manifest
+    from modules.metrics import request_context
+    from modules.jobs import DONE, FINISHED, JobCancelled, JobRejected, get_job_manager
+    from modules.query_transformer import transform_query
     from config import Config
 except ImportError as e:
     print(f"模組匯入錯誤: {e}")
     class DummyConfig:
         PDF_DIR = "data/pdfs"
+        GRADIO_CONCURRENCY = 1
+        GRADIO_QUEUE_MAX_SIZE = None
+        JOB_POLL_INTERVAL = 2
     Config = DummyConfig
 
 
@@ -33,73 +39,144 @@ def get_processed_files():
 
 
 # ----------------------------------------------------
-# A. 文件處理流程
+# A. 文件處理流程（背景工作）
 # ----------------------------------------------------
-def process_pdf_file(pdf_file) -> str:
+def process_pdf_file(pdf_file):
     """
-    上傳後的 PDF 進行切塊與向量化
+    將上傳的 PDF 排入背景工作進行切塊與向量化，立即回傳 (工作 id, 狀態)
     """
     if pdf_file is None:
-        return "錯誤：請先上傳 PDF 檔案。"
+        return None, "錯誤：請先上傳 PDF 檔案。"
 
     pdf_file_name = os.path.basename(pdf_file.name)
+    try:
+        job = get_job_manager().submit(pdf_file_name, _run_ingest_job, pdf_file.name, pdf_file_name)
+    except JobRejected as e:
+        return None, f"錯誤：{e}"
+    return job.id, job.describe()
+
+
+def _run_ingest_job(job, upload_path: str, pdf_file_name: str) -> str:
+    with request_context("ingest", request_id=job.id):
+        return _process_pdf_file(job, upload_path, pdf_file_name)
+
+
+def _process_pdf_file(job, upload_path: str, pdf_file_name: str) -> str:
+    # 儲存上傳檔案到 Config 指定路徑
+    os.makedirs(Config.PDF_DIR, exist_ok=True)
+    target_path = os.path.join(Config.PDF_DIR, pdf_file_name)
+    manifest = get_manifest()
+    is_new = manifest.get(pdf_file_name) is None
+    job.report(0.0, "複製檔案")
+    shutil.copy(upload_path, target_path)
 
     try:
-        # 儲存上傳檔案到 Config 指定路徑
-        os.makedirs(Config.PDF_DIR, exist_ok=True)
-        target_path = os.path.join(Config.PDF_DIR, pdf_file_name)
-        shutil.copy(pdf_file.name, target_path)
-
-        # 切塊
-        chunks = split_documents(target_path)
-        if len(chunks) == 0:
-            return f"警告：'{pdf_file_name}' 未能切出任何內容。"
+        # 內容已向量化（同一份檔案或改名的副本）時，略過解析與向量化
+        existing = manifest.find_by_hash(file_sha256(target_path))
+        if existing:
+            if existing["filename"] != pdf_file_name and not manifest.get(pdf_file_name):
+                manifest.add_alias(pdf_file_name, existing["filename"])
+            return f"檔案 '{pdf_file_name}' 與已處理的 '{existing['filename']}' 內容相同，已略過處理。"
 
-        # 向量化
-        store_vectors(chunks, collection_name="chunks")
+        # 切塊與向量化（新文件邊解析邊寫入；每組寫入後回報進度並檢查是否已取消）
+        job.report(0.0, "解析與切塊")
 
-        return f"檔案 '{pdf_file_name}' 處理完成，共切出 {len(chunks)} 個片段，已儲存至向量資料庫。"
+        def on_progress(fraction, message):
+            job.partial = True  # 已寫入的頁面可供問答
+            job.report(fraction, message)
 
-    except Exception as e:
-        return f"錯誤：處理檔案時發生問題：{e}"
+        chunk_count = ingest_pdf(target_path, progress=on_progress)
+        if chunk_count == 0:
+            return f"警告：'{pdf_file_name}' 未能切出任何內容。"
+
+        return f"檔案 '{pdf_file_name}' 處理完成，共切出 {chunk_count} 個片段，已儲存至向量資料庫。"
+    except JobCancelled:
+        # 新文件取消後不留在問答清單中（已寫入的向量由 store_vectors / store_vectors_stream 移除）
+        if is_new and not manifest.get(pdf_file_name):
+            os.remove(target_path)
+        raise
 
 
-def update_dropdown_after_upload(pdf_file):
+def job_status(job_id: str):
     """
-    重新整理 Dropdown 並自動選中新上傳的檔案
+    查詢工作進度，回傳 (工作 id, 狀態, Dropdown 更新, 停止自動更新的訊號)
+    已寫入部分頁面時即更新 Dropdown 選項；工作結束後清除目前的工作 id，成功時並選中新處理的檔案
     """
-    if pdf_file is None:
-        return gr.Dropdown.update(choices=get_processed_files(), value=None)
+    job = get_job_manager().get(job_id) if job_id else None
+    stop = str(time.time())  # 值改變即觸發取消自動更新
+    if job is None:
+        return None, gr.update(), gr.update(), stop
+    if job.status not in FINISHED:
+        if job.partial:
+            return job.id, job.describe(), gr.Dropdown.update(choices=get_processed_files()), gr.update()
+        return job.id, job.describe(), gr.update(), gr.update()
 
-    pdf_file_name = os.path.basename(pdf_file.name)
-    files = get_processed_files()
+    if job.status == DONE and job.name in get_processed_files():
+        return None, job.describe(), gr.Dropdown.update(choices=get_processed_files(), value=job.name), stop
+    return None, job.describe(), gr.Dropdown.update(choices=get_processed_files()), stop
 
-    return gr.Dropdown.update(choices=files, value=pdf_file_name)
+
+def cancel_job(job_id: str) -> str:
+    if job_id and get_job_manager().cancel(job_id):
+        return get_job_manager().get(job_id).describe()
+    return "目前沒有進行中的處理工作。"
 
 
 # ----------------------------------------------------
 # B. 問答流程
 # ----------------------------------------------------
-def rag_query(history: List[Tuple[str, str]], query: str, pdf_file_name: str) -> str:
+def retrieve(query: str, pdf_file_name: str):
+    """依 Config.QUERY_REWRITE_MODE 檢索；改寫只用於檢索，回答仍針對使用者的原始問題"""
+    if Config.QUERY_REWRITE_MODE == "speculative":
+        return hybrid_search_speculative(query=query, filename=pdf_file_name)
+    if Config.QUERY_REWRITE_MODE == "serial":
+        return hybrid_search_scored(query=transform_query(query), filename=pdf_file_name)
+    return hybrid_search_scored(query=query, filename=pdf_file_name)
+
+
+def _retrieve_for_answer(query: str, pdf_file_name: str):
+    """
+    檢查輸入並檢索，回傳 (檢索結果, 錯誤訊息)；輸入不完整或檢索不到內容時檢索結果為空
+    請求 context 只涵蓋檢索：串流產生階段可能跨執行緒執行，生成耗時另由 qa_chain 記錄
+    """
     if not query:
-        return "請輸入您的問題。"
+        return [], "請輸入您的問題。"
     if not pdf_file_name or pdf_file_name == "請先處理文件":
-        return "請先上傳並處理 PDF 檔案。"
+        return [], "請先上傳並處理 PDF 檔案。"
 
-    try:
-        # transformed_query = transform_query(query)
-        transformed_query = query  # 暫時使用原始 query
-        retrieved_docs = hybrid_search(query=query, filename=pdf_file_name)
+    with request_context("query"):
+        retrieved_docs = retrieve(query, pdf_file_name)
+    if not retrieved_docs:
+        return [], "檢索失敗：未找到與問題相關的內容。"
+    return retrieved_docs, None
 
-        if not retrieved_docs:
-            return "檢索失敗：未找到與問題相關的內容。"
 
-        answer = generate_answer(transformed_query, retrieved_docs)
-        return answer
+def rag_query(history: List[Tuple[str, str]], query: str, pdf_file_name: str) -> str:
+    try:
+        retrieved_docs, error = _retrieve_for_answer(query, pdf_file_name)
+        if error:
+            return error
+        return generate_answer(query, retrieved_docs)
     except Exception as e:
         return f"問答過程中發生錯誤：{e}"
 
 
+def rag_query_stream(history: List[Tuple[str, str]], query: str, pdf_file_name: str):
+    """串流版本的 rag_query，逐步 yield 目前累積的回答"""
+    try:
+        retrieved_docs, error = _retrieve_for_answer(query, pdf_file_name)
+        if error:
+            yield error
+            return
+
+        answer = ""
+        for piece in generate_answer_stream(query, retrieved_docs):
+            answer += piece
+            yield answer.strip()
+    except Exception as e:
+        yield f"問答過程中發生錯誤：{e}"
+
+
 # ----------------------------------------------------
 # C. Gradio 介面
 # ----------------------------------------------------
@@ -122,6 +199,11 @@ with gr.Blocks(title="Paper RAG 論文問答系統") as demo:
                 interactive=False,
                 value="等待上傳文件..."
             )
+            with gr.Row():
+                refresh_button = gr.Button("重新整理進度")
+                cancel_button = gr.Button("取消處理")
+            job_id = gr.State(None)
+            poll_stop = gr.Textbox(visible=False)
 
             # --- 文件選擇區 ---
             gr.Markdown("## 步驟二：選擇問答文件")
@@ -132,15 +214,32 @@ with gr.Blocks(title="Paper RAG 論文問答系統") as demo:
                 interactive=True
             )
 
-            # 綁定按鈕動作：處理後更新 dropdown
-            process_button.click(
+            # 綁定按鈕動作：處理在背景執行，不佔用佇列；完成後更新 dropdown
+            # 自動更新進度只在送出工作後開始，工作結束（或沒有工作）時由 poll_stop 取消，
+            # 閒置的分頁不會定期佔用問答佇列
+            poll = process_button.click(
                 fn=process_pdf_file,
                 inputs=[pdf_upload],
-                outputs=[process_output]
+                outputs=[job_id, process_output],
+                queue=False
             ).then(
-                fn=update_dropdown_after_upload,
-                inputs=[pdf_upload],
-                outputs=[file_dropdown]
+                fn=job_status,
+                inputs=[job_id],
+                outputs=[job_id, process_output, file_dropdown, poll_stop],
+                every=Config.JOB_POLL_INTERVAL
+            )
+            poll_stop.change(fn=None, cancels=[poll])
+            refresh_button.click(
+                fn=job_status,
+                inputs=[job_id],
+                outputs=[job_id, process_output, file_dropdown, poll_stop],
+                queue=False
+            )
+            cancel_button.click(
+                fn=cancel_job,
+                inputs=[job_id],
+                outputs=[process_output],
+                queue=False
             )
 
         with gr.Column(scale=2):
@@ -158,12 +257,16 @@ with gr.Blocks(title="Paper RAG 論文問答系統") as demo:
             # 問答邏輯
             def respond(history: List[Tuple[str, str]], query: str, pdf_file_name: str):
                 history = history + [(query, None)]
-                response = rag_query(history, query, pdf_file_name)
-                history[-1] = (query, response)
-                return history, ""
+                for partial in rag_query_stream(history, query, pdf_file_name):
+                    history[-1] = (query, partial)
+                    yield history, ""
 
             msg.submit(
                 fn=respond,
                 inputs=[chatbot, msg, file_dropdown],
                 outputs=[chatbot, msg]
             )
+
+# 串流輸出與處理中的進度更新皆需要啟用佇列；同時處理 GRADIO_CONCURRENCY 個請求，
+# 排隊超過 GRADIO_QUEUE_MAX_SIZE 時直接拒絕新請求，避免等待時間無限增長
+demo.queue(concurrency_count=Config.GRADIO_CONCURRENCY, max_size=Config.GRADIO_QUEUE_MAX_SIZE)
@@ -10,8 +10,19 @@ except ImportError as e:
     print("請確認 frontend/app.py 已正確定義 Gradio Blocks 或 Interface 並命名為 'demo'")
     sys.exit(1)
 
+from config import Config
+from modules.metrics import start_metrics_server
+from modules.warmup import start_background_warmup
+
 
 if __name__ == "__main__":
+    # 重量級套件（NLTK、Unstructured、Chroma、reranker 模型）延後到介面開始服務後才在背景載入
+    if Config.WARMUP_ON_START:
+        start_background_warmup(wait_for_port=7860)
+
+    if Config.METRICS_ENABLED and Config.METRICS_PORT:
+        start_metrics_server(Config.METRICS_PORT)
+
     print("啟動 Paper RAG Gradio 介面...")
     demo.launch(
         server_name="0.0.0.0",  
@@ -0,0 +1,138 @@
+"""
+批次匯入整個 PDF 資料夾：
+多行程並行解析與切塊，主行程統一向量化與寫入。
+已登記於 ingest 清單的檔案會跳過，中斷後重新執行即可從未完成的檔案繼續。
+文件以檔名識別，不同子資料夾中的同名檔案無法區分，會全部略過並列出，需改名後再匯入。
+
+python -m modules.bulk_ingest --dir data/pdfs --workers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple
+from config import Config
+from modules.embedder import store_vectors
+from modules.manifest import file_sha256, get_manifest
+from modules.splitter import split_documents
+from modules.utils import log
+from modules.vector_shards import open_all_shards
+
+
+def find_pdfs(pdf_dir) -> List[str]:
+    """遞迴列出資料夾內所有 PDF"""
+    paths = []
+    for root, _, files in os.walk(str(pdf_dir)):
+        for name in files:
+            if name.lower().endswith(".pdf"):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def _split_duplicate_names(paths: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+    """區分檔名唯一的檔案與同名的檔案，回傳 (可匯入的路徑, 檔名 → 同名的路徑)"""
+    by_name = defaultdict(list)
+    for path in paths:
+        by_name[os.path.basename(path)].append(path)
+    duplicates = {name: group for name, group in by_name.items() if len(group) > 1}
+    return [p for p in paths if os.path.basename(p) not in duplicates], duplicates
+
+
+def _pending_pdfs(paths: List[str]) -> List[str]:
+    """排除已向量化的檔案；內容相同但改名的副本直接登記為別名，內容已改變的檔案重新處理（增量更新）"""
+    manifest = get_manifest()
+    pending = []
+    for path in paths:
+        name = os.path.basename(path)
+        record = manifest.get(name)
+        if record and not Config.INCREMENTAL_UPDATE:
+            continue
+        file_hash = file_sha256(path)
+        if record:
+            if record.get("file_hash") != file_hash:
+                pending.append(path)
+            continue
+        existing = manifest.find_by_hash(file_hash)
+        if existing:
+            manifest.add_alias(name, existing["filename"])
+            continue
+        pending.append(path)
+    return pending
+
+
+def bulk_ingest(pdf_dir=Config.PDF_DIR, workers: int = Config.BULK_INGEST_WORKERS) -> dict:
+    """並行切塊整個資料夾的 PDF 並寫入向量庫，回傳處理統計"""
+    # 舊資料第一次使用時先建立 ingest 清單，才能正確跳過已處理的檔案
+    manifest = get_manifest()
+    if not manifest.exists:
+        manifest.bootstrap_from_chroma(*open_all_shards())
+
+    paths = find_pdfs(pdf_dir)
+    unique, duplicates = _split_duplicate_names(paths)
+    for name, group in duplicates.items():
+        log(f"[WARN] 檔名 {name} 出現在 {len(group)} 個位置，無法區分，已略過（請改名後再匯入）：{', '.join(group)}")
+    pending = _pending_pdfs(unique)
+    log(f"共 {len(paths)} 份 PDF，其中 {len(unique) - len(pending)} 份已處理、{len(paths) - len(unique)} 份檔名重複，待處理 {len(pending)} 份")
+
+    done, failed, chunk_total = 0, [], 0
+    started = time.perf_counter()
+
+    # 使用 spawn 避免子行程繼承主行程的 SQLite 連線與執行緒
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        queue = iter(pending)
+        in_flight = {}
+
+        def submit_next():
+            path = next(queue, None)
+            if path is not None:
+                in_flight[pool.submit(split_documents, path)] = path
+
+        # 限制同時在途的檔案數，避免切塊結果在記憶體中堆積
+        for _ in range(workers * 2):
+            submit_next()
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = in_flight.pop(future)
+                submit_next()
+                try:
+                    chunks = future.result()
+                    if chunks:
+                        store_vectors(chunks, collection_name="chunks", pdf_path=path)
+                        chunk_total += len(chunks)
+                    else:
+                        log(f"[WARN] {os.path.basename(path)} 未能切出任何內容")
+                    done += 1
+                except Exception as e:
+                    failed.append(path)
+                    log(f"[WARN] 處理 {os.path.basename(path)} 失敗：{e}")
+
+                elapsed = time.perf_counter() - started
+                log(f"批次匯入進度 {done + len(failed)}/{len(pending)}（{done / elapsed:.2f} docs/s）")
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "total": len(paths),
+        "skipped": len(unique) - len(pending),
+        "duplicate_names": duplicates,
+        "ingested": done,
+        "failed": failed,
+        "chunks": chunk_total,
+        "seconds": elapsed,
+        "docs_per_sec": done / elapsed if elapsed > 0 else 0.0,
+    }
+    log(f"批次匯入完成：成功 {done} 份、失敗 {len(failed)} 份，{stats['docs_per_sec']:.2f} docs/s")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批次匯入 PDF 資料夾")
+    parser.add_argument("--dir", default=str(Config.PDF_DIR), help="PDF 資料夾")
+    parser.add_argument("--workers", type=int, default=Config.BULK_INGEST_WORKERS, help="解析用的行程數")
+    args = parser.parse_args()
+    bulk_ingest(args.dir, args.workers)
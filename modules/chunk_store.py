@@ -0,0 +1,249 @@
+"""
+以內容雜湊定址的 chunk 儲存：
+每個不重複的 chunk 內容只寫入一次到 append-only 的 chunks.jsonl，
+SQLite 索引記錄每份文件（檔案雜湊＋切塊參數）的 chunk 順序、id、精簡 metadata 與內容在檔案中的位移。
+同一份 PDF 以相同參數再次切塊時直接由此讀回，不必重新以 Unstructured 解析。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Iterator, List, Optional
+from config import Config
+from modules.embedding_cache import content_hash
+from modules.utils import log
+
+# chunk 只保留下游會用到的 metadata（座標等欄位不寫入）
+METADATA_KEYS = ("filename", "category", "page_number", "source")
+
+
+def slim_metadata(metadata: dict) -> dict:
+    """只保留 METADATA_KEYS 中有值的欄位"""
+    return {k: metadata[k] for k in METADATA_KEYS if metadata.get(k) is not None}
+
+
+def split_params(min_words: int) -> str:
+    """影響切塊結果的參數，參數改變時視為不同的文件紀錄"""
+    params = f"chunk_size={Config.CHUNK_SIZE};overlap={Config.CHUNK_OVERLAP};min_words={min_words}"
+    if Config.NEAR_DUP_ENABLED:
+        params += f";near_dup={Config.NEAR_DUP_THRESHOLD}/{Config.NEAR_DUP_SHINGLE}/{Config.NEAR_DUP_NUM_PERM}"
+    return params
+
+
+class ChunkStore:
+    """append-only 的 chunk 內容檔加上 SQLite 索引"""
+
+    def __init__(self, root=None):
+        self.root = str(root or Config.CHUNK_STORE_DIR)
+        self.data_path = os.path.join(self.root, "chunks.jsonl")
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        # 批次匯入時多個行程會同時寫入，以 BEGIN IMMEDIATE 交易序列化，timeout 讓後到者等待
+        self._conn = sqlite3.connect(
+            os.path.join(self.root, "index.sqlite3"), check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS contents (
+                hash TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_key TEXT PRIMARY KEY,
+                file_hash TEXT NOT NULL,
+                params TEXT NOT NULL,
+                filename TEXT,
+                chunk_count INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                doc_key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (doc_key, seq)
+            );
+            """
+        )
+
+    @staticmethod
+    def document_key(file_hash: str, params: str) -> str:
+        return hashlib.sha256(f"{file_hash}|{params}".encode("utf-8")).hexdigest()[:32]
+
+    def has_document(self, doc_key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM documents WHERE doc_key = ?", (doc_key,)).fetchone()
+        return row is not None
+
+    def open_document(self, doc_key: str, file_hash: str, params: str, filename: str) -> "DocumentWriter":
+        """分批寫入一份文件（只需保留目前這組 chunk），commit() 後才對讀取端可見"""
+        return DocumentWriter(self, doc_key, file_hash, params, filename)
+
+    def put_document(self, doc_key: str, file_hash: str, params: str, filename: str, chunks: List[dict]) -> bool:
+        """一次寫入一份文件的 chunk；已存在時不重寫並回傳 False"""
+        if self.has_document(doc_key):
+            return False
+        writer = self.open_document(doc_key, file_hash, params, filename)
+        try:
+            writer.write(chunks)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def _append_chunks(self, staging_key: str, start_seq: int, chunks: List[dict]) -> int:
+        """附加尚未儲存的內容，並以暫存鍵記錄這組 chunk 的順序；回傳新增的內容筆數"""
+        hashes = [content_hash(c["content"]) for c in chunks]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                known = set()
+                unique = list(dict.fromkeys(hashes))
+                for start in range(0, len(unique), 500):
+                    batch = unique[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    known.update(
+                        h for (h,) in self._conn.execute(f"SELECT hash FROM contents WHERE hash IN ({placeholders})", batch)
+                    )
+
+                # 先附加內容再提交索引；中途失敗只會在檔尾留下沒有索引指向的資料
+                new_rows, lines = [], []
+                with open(self.data_path, "ab") as f:
+                    f.seek(0, os.SEEK_END)
+                    offset = f.tell()
+                    for h, c in zip(hashes, chunks):
+                        if h in known:
+                            continue
+                        known.add(h)
+                        line = json.dumps({"h": h, "c": c["content"]}, ensure_ascii=False, separators=(",", ":"))
+                        data = (line + "\n").encode("utf-8")
+                        new_rows.append((h, offset, len(data)))
+                        lines.append(data)
+                        offset += len(data)
+                    f.write(b"".join(lines))
+
+                self._conn.executemany("INSERT INTO contents (hash, offset, length) VALUES (?, ?, ?)", new_rows)
+                self._conn.executemany(
+                    "INSERT INTO document_chunks (doc_key, seq, hash, record) VALUES (?, ?, ?, ?)",
+                    [
+                        (staging_key, start_seq + i, h, json.dumps(
+                            {k: v for k, v in c.items() if k != "content"}, ensure_ascii=False, separators=(",", ":")
+                        ))
+                        for i, (h, c) in enumerate(zip(hashes, chunks))
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(new_rows)
+
+    def _commit_document(self, staging_key: str, doc_key: str, file_hash: str, params: str,
+                         filename: str, chunk_count: int) -> bool:
+        """在同一個交易內把暫存的 chunk 改掛到 doc_key 並登記文件；其他行程已寫入同一份文件時丟棄暫存並回傳 False"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT 1 FROM documents WHERE doc_key = ?", (doc_key,)).fetchone():
+                    self._conn.execute("DELETE FROM document_chunks WHERE doc_key = ?", (staging_key,))
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute("UPDATE document_chunks SET doc_key = ? WHERE doc_key = ?", (doc_key, staging_key))
+                self._conn.execute(
+                    "INSERT INTO documents (doc_key, file_hash, params, filename, chunk_count, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_key, file_hash, params, filename, chunk_count, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def _discard_chunks(self, staging_key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM document_chunks WHERE doc_key = ?", (staging_key,))
+
+    def iter_chunks(self, doc_key: str) -> Iterator[dict]:
+        """依原始順序逐筆讀回文件的 chunk，只讀取需要的內容位移"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dc.record, c.offset, c.length FROM document_chunks dc "
+                "JOIN contents c ON c.hash = dc.hash WHERE dc.doc_key = ? ORDER BY dc.seq",
+                (doc_key,),
+            ).fetchall()
+        if not rows:
+            return
+        with open(self.data_path, "rb") as f:
+            for record, offset, length in rows:
+                f.seek(offset)
+                chunk = json.loads(record)
+                chunk["content"] = json.loads(f.read(length))["c"]
+                yield chunk
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            contents = self._conn.execute("SELECT COUNT(*) FROM contents").fetchone()[0]
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        return {"documents": documents, "contents": contents, "data_bytes": size}
+
+
+class DocumentWriter:
+    """
+    分批寫入一份文件：每組 chunk 的內容與順序先記在暫存鍵下，commit() 才登記為正式文件。
+    並行寫入同一份文件的行程各自使用不同的暫存鍵，互不干擾；行程異常結束時只留下沒有文件指向的暫存列
+    """
+
+    def __init__(self, store: ChunkStore, doc_key: str, file_hash: str, params: str, filename: str):
+        self.store = store
+        self.doc_key = doc_key
+        self.file_hash = file_hash
+        self.params = params
+        self.filename = filename
+        self.staging_key = f"staging:{uuid.uuid4().hex}"
+        self.chunk_count = 0
+        self.new_contents = 0
+
+    def write(self, chunks: List[dict]):
+        if not chunks:
+            return
+        self.new_contents += self.store._append_chunks(self.staging_key, self.chunk_count, chunks)
+        self.chunk_count += len(chunks)
+
+    def commit(self) -> bool:
+        """登記文件；已由其他行程寫入時回傳 False"""
+        committed = self.store._commit_document(
+            self.staging_key, self.doc_key, self.file_hash, self.params, self.filename, self.chunk_count
+        )
+        if committed:
+            log(f"chunk 儲存：{self.filename} 共 {self.chunk_count} 個 chunk，新增 {self.new_contents} 筆內容")
+        return committed
+
+    def abort(self):
+        """放棄這份文件，刪除已寫入的暫存列（已附加的內容可供之後的文件共用）"""
+        try:
+            self.store._discard_chunks(self.staging_key)
+        except Exception as e:
+            log(f"[WARN] 清除 chunk 儲存暫存紀錄失敗：{e}")
+
+
+_store: Optional[ChunkStore] = None
+_store_lock = threading.Lock()
+
+
+def get_chunk_store() -> ChunkStore:
+    """取得行程共用的 chunk 儲存（路徑於第一次使用時取自 Config）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChunkStore(Config.CHUNK_STORE_DIR)
+    return _store
@@ -0,0 +1,83 @@
+"""
+行程內共用的外部服務用戶端：
+Ollama LLM 與 embedding 用戶端共用 httpx 連線池（keep-alive 重用 TCP 連線），Chroma 每個 collection 只開啟一次。
+Gradio 同時處理多個請求時共用同一組用戶端；httpx.Client 與 chromadb 本機用戶端皆可跨執行緒使用。
+"""
+
+import threading
+from typing import Dict, Tuple
+from config import Config
+
+# langchain Chroma 預設的 collection 名稱
+DEFAULT_COLLECTION = "langchain"
+
+_clients: Dict[Tuple, object] = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(key: Tuple, factory):
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+    return client
+
+
+def _http_client_kwargs() -> dict:
+    """Ollama 用戶端的 httpx 連線池設定"""
+    import httpx
+
+    return {
+        "limits": httpx.Limits(
+            max_connections=Config.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.OLLAMA_MAX_CONNECTIONS,
+            keepalive_expiry=Config.OLLAMA_KEEPALIVE_EXPIRY,
+        )
+    }
+
+
+def get_llm(model: str = None):
+    """共用的 Ollama LLM 用戶端（依模型與主機區分）"""
+    model = model or Config.LLM_MODEL
+
+    def create():
+        from langchain_ollama import OllamaLLM
+
+        return OllamaLLM(model=model, base_url=Config.OLLAMA_HOST, client_kwargs=_http_client_kwargs())
+
+    return _get_or_create(("llm", model, Config.OLLAMA_HOST), create)
+
+
+def get_embeddings(model: str = None):
+    """共用的 Ollama embedding 用戶端（不含快取層）"""
+    model = model or Config.EMBEDDING_MODEL
+
+    def create():
+        from langchain_ollama import OllamaEmbeddings
+
+        return OllamaEmbeddings(model=model, base_url=Config.OLLAMA_HOST, client_kwargs=_http_client_kwargs())
+
+    return _get_or_create(("embeddings", model, Config.OLLAMA_HOST), create)
+
+
+def get_chroma(persist_directory, collection_name: str = DEFAULT_COLLECTION):
+    """
+    共用的 Chroma collection；讀寫皆直接使用 _collection 並自行提供向量，因此不綁定 embedding_function
+    """
+    persist_directory = str(persist_directory)
+
+    def create():
+        from langchain_community.vectorstores import Chroma
+
+        return Chroma(collection_name=collection_name, persist_directory=persist_directory)
+
+    return _get_or_create(("chroma", persist_directory, collection_name), create)
+
+
+def forget_chroma(persist_directory, collection_name: str):
+    """collection 被刪除後移除對應的實例"""
+    with _lock:
+        _clients.pop(("chroma", str(persist_directory), collection_name), None)
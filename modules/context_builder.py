@@ -0,0 +1,161 @@
+"""
+依 token 預算組裝送給 LLM 的 context：
+1. 依 Reranker 分數由高到低放入，超過 Config.CONTEXT_TOKEN_BUDGET 時截斷最後一段並捨棄其餘
+2. 放入的段落中，同一元素相鄰切塊（metadata id 為 "{元素}_{序號}"）合併，去掉切塊時重疊的文字
+token 數以 LLM 對應的 HuggingFace tokenizer 計算，無法載入時以字元數估算。
+"""
+
+import math
+import re
+import threading
+from typing import List, Optional, Tuple, Union
+from config import Config
+from modules.metrics import inc
+from modules.utils import log
+
+_CJK = re.compile(r"[㐀-鿿]")
+# 合併相鄰切塊時，重疊至少要這麼長才視為切塊造成的重疊
+MIN_OVERLAP_CHARS = 20
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def load_tokenizer():
+    """載入 Config.LLM_TOKENIZER（每個行程一次）；未設定或載入失敗時回傳 None"""
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
+        return _tokenizer
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            if Config.LLM_TOKENIZER:
+                try:
+                    from transformers import AutoTokenizer
+
+                    _tokenizer = AutoTokenizer.from_pretrained(Config.LLM_TOKENIZER)
+                except Exception as e:
+                    log(f"[WARN] 無法載入 tokenizer {Config.LLM_TOKENIZER}，改以字元數估算 token：{e}")
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = load_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    # 估算：中日文約一字一 token，其餘約四字元一 token
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """保留前 max_tokens 個 token"""
+    tokenizer = load_tokenizer()
+    if tokenizer is not None:
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        return tokenizer.decode(ids[:max_tokens]) if len(ids) > max_tokens else text
+    # 估算模式下以二分搜尋找出不超過預算的最長前綴
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def _element_position(record: dict) -> Optional[Tuple[str, str, int]]:
+    """由 metadata id（"{元素}_{序號}"）取得 (檔名, 元素, 序號)，格式不符時回傳 None"""
+    meta = record.get("metadata") or {}
+    element, sep, index = str(meta.get("id", "")).rpartition("_")
+    if not sep or not index.isdigit():
+        return None
+    return meta.get("filename"), element, int(index)
+
+
+def _overlap(left: str, right: str) -> int:
+    """left 結尾與 right 開頭重疊的字元數"""
+    for n in range(min(len(left), len(right), Config.CHUNK_OVERLAP), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:n]):
+            return n
+    return 0
+
+
+def merge_adjacent(records: List[dict]) -> List[dict]:
+    """合併同一元素的相鄰切塊並去除重疊文字，合併後的分數取較高者"""
+    by_position = {}
+    for r in records:
+        position = _element_position(r)
+        if position is not None:
+            by_position[position] = r
+
+    merged, consumed = [], set()
+    for r in records:
+        if id(r) in consumed:
+            continue
+        position = _element_position(r)
+        if position is None:
+            merged.append(dict(r))
+            continue
+        filename, element, index = position
+        # 往前找到這一段連續切塊的開頭，再往後串接
+        while (filename, element, index - 1) in by_position:
+            index -= 1
+        run = []
+        while (filename, element, index) in by_position:
+            run.append(by_position[(filename, element, index)])
+            index += 1
+
+        content = run[0]["content"]
+        for nxt in run[1:]:
+            n = _overlap(content, nxt["content"])
+            content += nxt["content"][n:] if n else " " + nxt["content"]
+        consumed.update(id(x) for x in run)
+        merged.append(dict(run[0], content=content, score=max(x.get("score", 0.0) for x in run)))
+    return merged
+
+
+def build_context(retrieved: List[Union[str, dict]], budget: int = None) -> Tuple[str, dict]:
+    """
+    retrieved: hybrid_search_scored 的結果（或純文字列表，視為已依分數排序）
+    回傳 (context 文字, 統計)
+    """
+    if budget is None:
+        budget = Config.CONTEXT_TOKEN_BUDGET
+    records = [
+        r if isinstance(r, dict) else {"content": r, "score": -rank}
+        for rank, r in enumerate(retrieved)
+    ]
+    original_tokens = count_tokens("\n".join(r["content"] for r in records))
+
+    # 每個切塊依自己的分數競爭預算；合併只發生在都被選入的切塊之間，低分的鄰近切塊不會搭高分段落的便車
+    passages = sorted(records, key=lambda r: r.get("score", 0.0), reverse=True)
+    chosen, used = [], 0
+    for p in passages:
+        # 段落間以換行分隔，約一個 token
+        cost = count_tokens(p["content"]) + (1 if chosen else 0)
+        if used + cost <= budget:
+            chosen.append(p)
+            used += cost
+            continue
+        remaining = budget - used - (1 if chosen else 0)
+        if remaining >= Config.CONTEXT_MIN_PASSAGE_TOKENS:
+            chosen.append(dict(p, content=truncate_tokens(p["content"], remaining)))
+        break
+
+    # 合併去除重疊只會讓內容變短，不會超出預算
+    selected = [p["content"] for p in sorted(merge_adjacent(chosen), key=lambda r: r.get("score", 0.0), reverse=True)]
+    context = "\n".join(selected)
+    context_tokens = count_tokens(context)
+    stats = {
+        "original_tokens": original_tokens,
+        "context_tokens": context_tokens,
+        "saved_tokens": max(0, original_tokens - context_tokens),
+        "passages": len(selected),
+    }
+    inc("rag_prompt_context_tokens_total", context_tokens, kind="sent")
+    inc("rag_prompt_context_tokens_total", stats["saved_tokens"], kind="saved")
+    log(f"context 組裝：{len(records)} 段 → {len(selected)} 段，{original_tokens} → {context_tokens} tokens（省下 {stats['saved_tokens']}）")
+    return context, stats
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import Config
+from modules.utils import log
+
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """將 float32 向量轉為儲存格式；int8 為每個向量各自的對稱縮放，回傳 (量化向量, 縮放係數)"""
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"不支援的向量儲存格式：{dtype}（可用：{', '.join(DTYPES)}）")
+
+
+class DenseIndex:
+    """
+    單一文件的精確向量索引：向量存成 .npy 以 memory map 載入（由 OS page cache 按需讀入），
+    id、內容與 metadata 存於旁邊的 JSON。查詢以矩陣乘法計算與 Chroma l2 空間相同的平方歐氏距離
+    向量可存成 float16 或 int8（每個向量一個縮放係數），直接在量化向量上計算內積；
+    只存於矩陣的文件另有 float32 副本（同樣 memmap，只在重算候選距離時讀取）
+    """
+
+    def __init__(self, filename: str, ids: List[str], documents: List[str], metadatas: List[dict],
+                 vectors: np.ndarray, sq_norms: np.ndarray, scales: Optional[np.ndarray] = None,
+                 full_vectors: Optional[np.ndarray] = None):
+        self.filename = filename
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.vectors = vectors          # (n, dim) float32 / float16 / int8，通常為唯讀 memmap
+        self.sq_norms = sq_norms        # (n,) 原始向量的平方長度，查詢時免重算
+        self.scales = scales            # (n,) int8 的縮放係數，其他格式為 None
+        self.full_vectors = full_vectors  # (n, dim) float32 副本（memmap），沒有時為 None
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dtype(self) -> str:
+        return str(self.vectors.dtype)
+
+    def float32_rows(self, rows: Optional[List[int]] = None) -> np.ndarray:
+        """指定列（預設全部）的 float32 向量：有 float32 副本時讀取副本，否則由量化向量還原"""
+        if self.full_vectors is not None:
+            return np.asarray(self.full_vectors if rows is None else self.full_vectors[rows], dtype=np.float32)
+        x = np.asarray(self.vectors if rows is None else self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            x = x * (self.scales if rows is None else self.scales[rows])[:, None]
+        return x
+
+    def distances(self, query_embeddings: List[List[float]], rows: Optional[List[int]] = None) -> np.ndarray:
+        """||q - x||² = ||q||² + ||x||² - 2 q·x；rows 指定時只計算這些列"""
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        x = self.vectors if rows is None else self.vectors[rows]
+        x_norms = self.sq_norms if rows is None else self.sq_norms[rows]
+        dots = q @ x.astype(np.float32, copy=False).T
+        if self.scales is not None:
+            dots *= self.scales if rows is None else self.scales[rows]
+        d = np.sum(q * q, axis=1, keepdims=True) + x_norms[None, :] - 2.0 * dots
+        return np.maximum(d, 0.0)
+
+    def search(self, query_embeddings: List[List[float]], k: int) -> List[List[Tuple[int, float]]]:
+        """每個查詢回傳距離最小的 k 個 (列號, 距離)"""
+        if not len(self):
+            return [[] for _ in query_embeddings]
+        d = self.distances(query_embeddings)
+        k = min(k, d.shape[1])
+        results = []
+        for row in d:
+            top = np.argpartition(row, k - 1)[:k] if k < row.size else np.arange(row.size)
+            top = top[np.argsort(row[top], kind="stable")]
+            results.append([(int(i), float(row[i])) for i in top])
+        return results
+
+
+# -----------------------------
+# 索引檔管理（快取於記憶體）
+# -----------------------------
+_indexes: Dict[str, DenseIndex] = {}
+_lock = threading.Lock()
+_file_locks: Dict[str, threading.Lock] = {}
+
+
+def _file_lock(filename: str) -> threading.Lock:
+    """每份文件一把鎖：向量檔與 sidecar 要成對替換、成對讀取"""
+    with _lock:
+        return _file_locks.setdefault(filename, threading.Lock())
+
+
+def index_paths(filename: str) -> Tuple[str, str]:
+    """文件對應的向量檔與 sidecar 路徑"""
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    base = os.path.join(str(Config.DENSE_INDEX_DIR), digest)
+    return base + ".npy", base + ".json"
+
+
+def full_precision_path(filename: str) -> str:
+    """量化矩陣的 float32 副本路徑（只存於矩陣的文件用於重算距離）"""
+    return index_paths(filename)[0][:-len(".npy")] + ".f32.npy"
+
+
+def save_dense_index(filename: str, ids: List[str], documents: List[str], metadatas: List[dict],
+                     embeddings, dtype: str = None, full_precision: bool = False) -> DenseIndex:
+    """
+    以指定格式（預設 Config.DENSE_INDEX_DTYPE）寫入硬碟（先寫暫存檔再替換），並以 memmap 重新載入
+    full_precision: 量化格式時另存 float32 副本（向量不在 Chroma 中的文件以此重算距離）
+    """
+    vectors = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+    stored, scales = quantize(vectors, dtype or Config.DENSE_INDEX_DTYPE)
+    vector_path, sidecar_path = index_paths(filename)
+    full_path = full_precision_path(filename)
+    write_full = full_precision and stored.dtype != np.float32
+    directory = os.path.dirname(vector_path)
+    os.makedirs(directory, exist_ok=True)
+
+    # 暫存檔名各自唯一：同一文件被並行重建時不會互相覆寫對方寫到一半的檔案
+    temps = {}
+    try:
+        for path, data in ((full_path, vectors if write_full else None), (vector_path, stored)):
+            if data is None:
+                continue
+            fd, temps[path] = tempfile.mkstemp(dir=directory, suffix=".npy.tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, data)
+        fd, temps[sidecar_path] = tempfile.mkstemp(dir=directory, suffix=".json.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({
+                "filename": filename,
+                "ids": ids,
+                "documents": documents,
+                "metadatas": metadatas,
+                "sq_norms": np.sum(vectors * vectors, axis=1).tolist(),
+                "scales": scales.tolist() if scales is not None else None,
+                "full_precision": write_full,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        # 所有檔案在同一把鎖內替換（sidecar 最後），並行的重建不會留下分屬不同版本的檔案
+        with _file_lock(filename):
+            for path, tmp_path in temps.items():
+                os.replace(tmp_path, path)
+            if not write_full and os.path.exists(full_path):
+                os.remove(full_path)
+            with _lock:
+                _indexes.pop(filename, None)
+    finally:
+        for tmp_path in temps.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return load_dense_index(filename)
+
+
+def load_dense_index(filename: str) -> Optional[DenseIndex]:
+    """讀取文件的索引，不存在或不完整時回傳 None"""
+    with _lock:
+        if filename in _indexes:
+            return _indexes[filename]
+    vector_path, sidecar_path = index_paths(filename)
+    # 與 save_dense_index 的替換互斥：不會讀到新舊混雜的檔案，也不會把舊版放回快取
+    with _file_lock(filename):
+        if not (os.path.exists(vector_path) and os.path.exists(sidecar_path)):
+            return None
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(vector_path, mmap_mode="r")
+        full_vectors = np.load(full_precision_path(filename), mmap_mode="r") if meta.get("full_precision") else None
+        if any(x is not None and x.shape[0] != len(meta["ids"]) for x in (vectors, full_vectors)):
+            log(f"[WARN] 向量索引與 sidecar 列數不一致，忽略：{filename}")
+            return None
+        scales = meta.get("scales")
+        index = DenseIndex(
+            filename, meta["ids"], meta["documents"], meta["metadatas"],
+            vectors, np.asarray(meta["sq_norms"], dtype=np.float32),
+            np.asarray(scales, dtype=np.float32) if scales is not None else None,
+            full_vectors,
+        )
+        with _lock:
+            _indexes[filename] = index
+    return index
+
+
+def remove_dense_index(filename: str):
+    """刪除文件的索引（記憶體與硬碟）"""
+    with _file_lock(filename):
+        with _lock:
+            _indexes.pop(filename, None)
+        for path in (*index_paths(filename), full_precision_path(filename)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def build_dense_index(vectorstore, filename: str) -> Optional[DenseIndex]:
+    """由向量庫取出文件的所有向量建立（或覆蓋）索引"""
+    existing = vectorstore._collection.get(
+        where={"filename": filename}, include=["embeddings", "documents", "metadatas"]
+    )
+    if not existing["ids"]:
+        return None
+    index = save_dense_index(
+        filename, existing["ids"], existing["documents"],
+        [m or {} for m in existing["metadatas"]], existing["embeddings"],
+    )
+    log(f"向量索引建立完成：{filename}，共 {len(index)} 個 chunk（{index.dtype}）")
+    return index
+
+
+# -----------------------------
+# 只存於向量矩陣的文件
+# -----------------------------
+def dense_only_enabled() -> bool:
+    """新文件是否只存於向量矩陣、不寫入 Chroma（Config.DENSE_INDEX_PRIMARY，需搭配 mmap 檢索）"""
+    return Config.VECTOR_BACKEND == "mmap" and Config.DENSE_INDEX_PRIMARY
+
+
+class DenseDocumentWriter:
+    """
+    只存於向量矩陣的文件的寫入目標：提供與 Chroma collection 相同的 upsert / update / delete，
+    變更先保留在記憶體，commit() 時一次寫成矩陣檔（量化格式附 float32 副本）
+    """
+
+    def __init__(self, filename: str, base: Optional[DenseIndex] = None):
+        self.filename = filename
+        self.rows: Dict[str, Tuple[np.ndarray, str, dict]] = {}   # chunk id -> (float32 向量, 內容, metadata)
+        if base is not None:
+            for chunk_id, vector, document, metadata in zip(
+                base.ids, base.float32_rows(), base.documents, base.metadatas
+            ):
+                self.rows[chunk_id] = (vector, document, metadata)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def metadatas(self) -> Dict[str, dict]:
+        return {chunk_id: metadata for chunk_id, (_, _, metadata) in self.rows.items()}
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        for chunk_id, vector, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.rows[chunk_id] = (np.asarray(vector, dtype=np.float32), document, metadata)
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        for chunk_id, metadata in zip(ids, metadatas):
+            vector, document, _ = self.rows[chunk_id]
+            self.rows[chunk_id] = (vector, document, metadata)
+
+    def delete(self, ids: List[str]):
+        for chunk_id in ids:
+            self.rows.pop(chunk_id, None)
+
+    def commit(self) -> Optional[DenseIndex]:
+        """寫入矩陣檔；沒有任何 chunk 時刪除該文件的矩陣"""
+        if not self.rows:
+            remove_dense_index(self.filename)
+            return None
+        vectors, documents, metadatas = zip(*self.rows.values())
+        index = save_dense_index(
+            self.filename, list(self.rows), list(documents), list(metadatas), np.stack(vectors), full_precision=True
+        )
+        log(f"向量矩陣寫入完成：{self.filename}，共 {len(index)} 個 chunk（{index.dtype}，不寫入 Chroma）")
+        return index
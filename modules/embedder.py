@@ -1,68 +1,391 @@
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
+import contextvars
+import hashlib
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.clients import get_chroma, get_embeddings
+from modules.metrics import inc, span
 from modules.utils import log
+from modules.dense_index import (
+    DenseDocumentWriter, build_dense_index, dense_only_enabled, load_dense_index, remove_dense_index,
+)
+from modules.embedding_cache import CachedEmbeddings, get_embedding_cache
+from modules.manifest import file_sha256, get_manifest
+from modules.near_dup import get_hasher, get_signature_store
+from modules.query_cache import get_query_cache
+from modules.sparse_index import SparseIndex, build_sparse_index, load_sparse_index, remove_sparse_index, save_sparse_index
+from modules.vector_shards import open_all_shards, open_document_shard
 from config import Config
 
 
 def get_embedder():
-    """回傳 Ollama embedding 模型，從 Config 讀取"""
-    return OllamaEmbeddings(model=Config.EMBEDDING_MODEL)
+    """回傳 Ollama embedding 模型（共用連線池的用戶端）；啟用快取時包上內容雜湊快取（每次呼叫各自統計命中）"""
+    embedder = get_embeddings()
+    if Config.EMBEDDING_CACHE_ENABLED:
+        return CachedEmbeddings(embedder, Config.EMBEDDING_MODEL, get_embedding_cache())
+    return embedder
 
 
-def store_vectors(chunks, collection_name="chunks"):
-    """將 chunks  向量化並存入 Chroma"""
+def make_chunk_id(filename: str, content: str) -> str:
+    """以檔名與內容雜湊產生穩定的 chunk id（同一文件內容已去重，不會衝突）"""
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+    return f"{filename}::{digest}"
+
+
+def _collection(vectorstore):
+    """寫入目標：Chroma 向量庫的 collection，或只存於向量矩陣的文件（介面相同）"""
+    return vectorstore if isinstance(vectorstore, DenseDocumentWriter) else vectorstore._collection
+
+
+def _embed_batch(embedder, texts):
+    with span("embed"):
+        return embedder.embed_documents(texts)
+
+
+def _near_duplicate_vectors(ids, texts):
+    """
+    計算 MinHash 簽章並在簽章索引中找出近似重複的既有 chunk，
+    回傳 (簽章列表, {位置: 沿用的向量})；既有 chunk 已被刪除時不沿用
+    """
+    store, hasher = get_signature_store(), get_hasher()
+    signatures = [hasher.signature(t) for t in texts]
+    matches = {}
+    for i, signature in enumerate(signatures):
+        found = store.find(signature) if signature is not None else None
+        if found is not None:
+            matches[i] = found
+
+    # 依既有 chunk 的檔名到其所屬分片（只存於向量矩陣的文件則到其 float32 向量）取回向量
+    by_file = {}
+    for chunk_id, filename, _ in matches.values():
+        by_file.setdefault(filename, set()).add(chunk_id)
+    vectors = {}
+    manifest = get_manifest()
+    for filename, chunk_ids in by_file.items():
+        if manifest.storage(filename) == "dense":
+            index = load_dense_index(filename)
+            rows = [index.row_of[i] for i in chunk_ids if i in index.row_of] if index is not None else []
+            if rows:
+                vectors.update(zip((index.ids[row] for row in rows), index.float32_rows(rows)))
+            continue
+        stored = open_document_shard(filename)._collection.get(ids=list(chunk_ids), include=["embeddings"])
+        vectors.update(zip(stored["ids"], stored["embeddings"]))
+    reused = {
+        i: np.asarray(vectors[chunk_id], dtype=float).tolist()
+        for i, (chunk_id, _, _) in matches.items() if chunk_id in vectors
+    }
+    return signatures, reused
+
+
+def add_in_batches(vectorstore, embedder, ids, texts, metadatas,
+                   batch_size=Config.EMBED_BATCH_SIZE, max_workers=Config.EMBED_CONCURRENCY,
+                   progress=None, near_dup=False):
+    """
+    分批並行向量化，每批完成即寫入 Chroma（或 DenseDocumentWriter）；progress(done, total) 回報進度
+    near_dup: 與已向量化的 chunk 近似重複者沿用其向量，並登記這批 chunk 的簽章（僅 chunk 向量庫使用）
+    """
+    total = len(texts)
+    signatures, reused = None, {}
+    if near_dup and Config.NEAR_DUP_ENABLED:
+        with span("near_dup"):
+            signatures, reused = _near_duplicate_vectors(ids, texts)
+    if reused:
+        positions = sorted(reused)
+        with span("store"):
+            _collection(vectorstore).upsert(
+                ids=[ids[i] for i in positions],
+                embeddings=[reused[i] for i in positions],
+                documents=[texts[i] for i in positions],
+                metadatas=[metadatas[i] for i in positions],
+            )
+        inc("rag_near_duplicate_total", len(reused), scope="index")
+        log(f"近似重複：{len(reused)} 個 chunk 沿用既有 chunk 的向量，省下 {len(reused)} 次 embedding")
+
+    pending = [i for i in range(total) if i not in reused]
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    done = len(reused)
+    started = time.perf_counter()
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    # 複製目前的 context，讓批次執行緒的耗時記在同一個請求下
+    futures = {
+        pool.submit(contextvars.copy_context().run, _embed_batch, embedder, [texts[i] for i in batch]): batch
+        for batch in batches
+    }
+    try:
+        for future in as_completed(futures):
+            batch = futures[future]
+            vectors = future.result()
+            # 寫入 Chroma 的動作集中在目前執行緒，避免並行寫入
+            with span("store"):
+                _collection(vectorstore).upsert(
+                    ids=[ids[i] for i in batch],
+                    embeddings=vectors,
+                    documents=[texts[i] for i in batch],
+                    metadatas=[metadatas[i] for i in batch],
+                )
+            done += len(batch)
+            if progress:
+                progress(done, total)
+            elapsed = time.perf_counter() - started
+            log(f"向量化進度 {done}/{total}（{done / elapsed:.1f} chunks/s）")
+    finally:
+        # 發生錯誤或被取消時取消尚未開始的批次；進行中的批次不再等待（結果不會寫入向量庫）
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if signatures is not None:
+        by_file = {}
+        for i, signature in enumerate(signatures):
+            by_file.setdefault(metadatas[i].get("filename"), []).append(i)
+        for filename, positions in by_file.items():
+            get_signature_store().add(filename, [ids[i] for i in positions], [signatures[i] for i in positions])
+
+
+def _forget_signatures(filename: str = None, ids=None):
+    """向量被刪除時一併移除其簽章，避免之後沿用不存在的向量"""
+    if not Config.NEAR_DUP_ENABLED:
+        return
+    if filename:
+        get_signature_store().remove_document(filename)
+    if ids:
+        get_signature_store().remove_ids(ids)
+
+
+def _chunk_metadata(c) -> dict:
+    return {
+        "id": c["id"],
+        "page": c["page"],
+        "title": c["title"],
+        "filename": c["metadata"].get("filename"),
+        "category": c["metadata"].get("category"),
+    }
+
+
+def _write_dense_index(vectorstore, filename, collection_name):
+    """
+    寫入後更新該文件的向量矩陣：使用 mmap 向量檢索時由向量庫重建；
+    否則刪除先前建立的矩陣，之後切回 mmap 時才不會讀到過期的內容（第一次查詢時重建）
+    """
+    if collection_name != "chunks":
+        return
+    if Config.VECTOR_BACKEND == "mmap":
+        with span("dense_index"):
+            build_dense_index(vectorstore, filename)
+    else:
+        remove_dense_index(filename)
+
+
+def update_vectors(vectorstore, embedder, chunks, filename, collection_name="chunks", progress=None) -> dict:
+    """
+    以 chunk id（檔名＋內容雜湊）比對新舊版本，只向量化新增的 chunk、刪除消失的 chunk，
+    未變的 chunk 保留原向量（位置改變時只更新 metadata）
+    """
+    texts = [c["content"] for c in chunks]
+    ids = [make_chunk_id(filename, t) for t in texts]
+    metadatas = [_chunk_metadata(c) for c in chunks]
+
+    if isinstance(vectorstore, DenseDocumentWriter):
+        old_meta = vectorstore.metadatas()
+    else:
+        stored = vectorstore._collection.get(where={"filename": filename}, include=["metadatas"])
+        old_meta = dict(zip(stored["ids"], stored["metadatas"]))
+
+    new_pos = {chunk_id: i for i, chunk_id in enumerate(ids)}
+    added = [i for i, chunk_id in enumerate(ids) if chunk_id not in old_meta]
+    removed = [chunk_id for chunk_id in old_meta if chunk_id not in new_pos]
+    moved = [
+        new_pos[chunk_id] for chunk_id, meta in old_meta.items()
+        if chunk_id in new_pos and meta != metadatas[new_pos[chunk_id]]
+    ]
+
+    if moved:
+        with span("store"):
+            _collection(vectorstore).update(ids=[ids[i] for i in moved], metadatas=[metadatas[i] for i in moved])
+    if added:
+        # 先新增再刪除：改版後只有小幅修改的段落可沿用舊版 chunk 的向量
+        add_in_batches(
+            vectorstore, embedder,
+            [ids[i] for i in added], [texts[i] for i in added], [metadatas[i] for i in added],
+            progress=progress, near_dup=collection_name == "chunks",
+        )
+    if removed:
+        with span("store"):
+            _collection(vectorstore).delete(ids=removed)
+        _forget_signatures(ids=removed)
+
+    if collection_name == "chunks":
+        with span("sparse_index"):
+            index = load_sparse_index(filename)
+            if index is None:
+                build_sparse_index(filename, ids, texts)
+            else:
+                # 在副本上修改再替換，避免正在查詢的執行緒讀到修改到一半的索引
+                index = index.copy()
+                index.remove(removed)
+                index.add([ids[i] for i in added], [texts[i] for i in added])
+                save_sparse_index(index)
+
+    stats = {"added": len(added), "removed": len(removed), "unchanged": len(ids) - len(added)}
+    for change, count in stats.items():
+        inc("rag_ingest_update_chunks_total", count, change=change)
+    log(f"增量更新 {filename}：新增 {stats['added']}、刪除 {stats['removed']}、保留 {stats['unchanged']} 個 chunk")
+    return stats
+
+
+def store_vectors(chunks, collection_name="chunks", pdf_path=None, progress=None, update=Config.INCREMENTAL_UPDATE):
+    """
+    將 chunks  向量化並存入 Chroma
+    update: 同檔名但內容已改變時，只對差異的 chunk 做增量更新；False 時維持跳過
+    """
     log(f"建立向量庫：{collection_name}")
 
     if not chunks:
         log("傳入的 chunks 為空，已跳過。")
         return
 
-    # 取得當前要處理的 PDF 檔案名稱
+    # 取得當前要處理的 PDF 檔案名稱與內容雜湊
     current_filename = chunks[0]["metadata"].get("filename")
     log(f"檢查檔案：{current_filename}")
 
-    db_path = (
-        Config.VECTOR_CHUNK_DB
-        if collection_name == "chunks"
-        else Config.VECTOR_QUESTION_DB
-    )
+    pdf_path = pdf_path or chunks[0]["metadata"].get("source")
+    file_hash = file_sha256(pdf_path) if pdf_path and os.path.exists(pdf_path) else None
+
     embedder = get_embedder()
 
-    # 1. 讀取既有向量資料庫
-    vectorstore = Chroma(
-        embedding_function=embedder,
-        persist_directory=str(db_path),
-    )
+    # 1. 讀取既有向量資料庫（chunk 寫入文件所屬的分片）
+    if collection_name == "chunks":
+        vectorstore = open_document_shard(current_filename)
+    else:
+        vectorstore = get_chroma(Config.VECTOR_QUESTION_DB)
 
-    # 2. 讀取現有資料庫中的所有 metadata
-    existing_metadatas = vectorstore.get(include=["metadatas"]).get("metadatas", [])
-    existing_filenames = set(
-        m.get("filename") for m in existing_metadatas if m and m.get("filename")
-    )
+    # 2. 讀取 ingest 清單（舊資料第一次使用時由向量庫建立）
+    manifest = get_manifest(collection_name)
+    if not manifest.exists:
+        manifest.bootstrap_from_chroma(*(open_all_shards() if collection_name == "chunks" else [vectorstore]))
 
-    # 3. 檢查是否已存在該 PDF
-    if current_filename in existing_filenames:
+    # 3. 檢查是否已存在該 PDF（同檔名，或內容相同但改名的副本）
+    record = manifest.get(current_filename)
+    if record and record.get("alias_of") and update and file_hash and record.get("file_hash") != file_hash:
+        # 別名檔換成新內容後不再與原文件相同，改為獨立的文件重新 ingest
+        manifest.remove(current_filename)
+        record = None
+    if record:
+        if update and file_hash and record.get("file_hash") != file_hash:
+            storage = record.get("storage", "chroma")
+            if storage == "dense":
+                # 只存於向量矩陣：以現有矩陣（含 float32 副本）為基礎做增量更新後整份改寫
+                writer = DenseDocumentWriter(current_filename, load_dense_index(current_filename))
+                update_vectors(writer, embedder, chunks, current_filename, collection_name, progress=progress)
+                with span("dense_index"):
+                    writer.commit()
+            else:
+                update_vectors(vectorstore, embedder, chunks, current_filename, collection_name, progress=progress)
+                vectorstore.persist()
+                _write_dense_index(vectorstore, current_filename, collection_name)
+            manifest.record(current_filename, file_hash, len(chunks), storage=storage)
+            get_query_cache().invalidate(current_filename)
+            return vectorstore
+        inc("rag_ingest_skipped_total", reason="same_filename")
         log(f"檔案 {current_filename} 已存在於向量庫中，跳過向量化。")
         return vectorstore
 
+    existing = manifest.find_by_hash(file_hash) if file_hash else None
+    if existing:
+        inc("rag_ingest_skipped_total", reason="same_content")
+        manifest.add_alias(current_filename, existing["filename"])
+        log(f"檔案 {current_filename} 與已向量化的 {existing['filename']} 內容相同，改以別名登記，跳過向量化。")
+        return vectorstore
+
     # ----------------------------------------------------
     # 4. 若未重複，則進行向量化
     texts = [c["content"] for c in chunks]
-    metadatas = [
-        {
-            "id": c["id"],
-            "page": c["page"],
-            "title": c["title"],
-            "filename": c["metadata"].get("filename"),
-            "category": c["metadata"].get("category"),
-        }
-        for c in chunks
-    ]
+    ids = [make_chunk_id(current_filename, t) for t in texts]
+    metadatas = [_chunk_metadata(c) for c in chunks]
+
+    # 5. 分批並行向量化並加入新資料；中途失敗或被取消時移除已寫入的部分，不留下未登記的不完整文件
+    #    只存於向量矩陣的文件先收集在記憶體，全部完成才寫成矩陣檔
+    dense_only = collection_name == "chunks" and dense_only_enabled()
+    target = DenseDocumentWriter(current_filename) if dense_only else vectorstore
+    try:
+        add_in_batches(target, embedder, ids, texts, metadatas, progress=progress,
+                       near_dup=collection_name == "chunks")
+        # 6. 寫入硬碟
+        if dense_only:
+            with span("dense_index"):
+                target.commit()
+        else:
+            vectorstore.persist()
+    except Exception:
+        if not dense_only:
+            vectorstore._collection.delete(where={"filename": current_filename})
+        if collection_name == "chunks":
+            _forget_signatures(current_filename)
+        raise
 
-    # 5. 加入新資料
-    vectorstore.add_texts(texts=texts, metadatas=metadatas)
+    # 7. 建立該文件的 BM25 倒排索引（與 memory-mapped 向量索引）
+    if collection_name == "chunks":
+        with span("sparse_index"):
+            build_sparse_index(current_filename, ids, texts)
+    if not dense_only:
+        _write_dense_index(vectorstore, current_filename, collection_name)
+
+    # 8. 登記至 ingest 清單，並使該文件的查詢快取失效
+    manifest.record(current_filename, file_hash, len(chunks), storage="dense" if dense_only else "chroma")
+    get_query_cache().invalidate(current_filename)
 
-    # 6. 寫入硬碟
-    vectorstore.persist()
     log(f"向量化完成，共 {len(chunks)} 筆資料（檔案：{current_filename}）")
+    if isinstance(embedder, CachedEmbeddings):
+        log(f"Embedding 快取：命中 {embedder.hits} 筆，未命中 {embedder.misses} 筆")
     return vectorstore
+
+
+def store_vectors_stream(chunk_groups, pdf_path, progress=None) -> int:
+    """
+    新文件的串流寫入：每組 chunk 向量化後立即寫入向量庫，前面的頁面在後續頁面處理時即可被查詢（只查向量庫）；
+    BM25 索引逐組累加、全部寫完才存檔，向量索引也只在最後建立一次，之後才登記至 ingest 清單。
+    已登記（增量更新、別名）的文件與只存於向量矩陣的新文件（dense_only_enabled()）請使用 store_vectors
+    chunk_groups: 依序產生的 chunk 列表；progress(已寫入 chunk 數) 於每組寫入後呼叫
+    回傳寫入的 chunk 數
+    """
+    filename = os.path.basename(pdf_path)
+    file_hash = file_sha256(pdf_path)
+    vectorstore = open_document_shard(filename)
+    embedder = get_embedder()
+    sparse = SparseIndex(filename)
+    total = 0
+
+    try:
+        for group in chunk_groups:
+            texts = [c["content"] for c in group]
+            ids = [make_chunk_id(filename, t) for t in texts]
+            add_in_batches(vectorstore, embedder, ids, texts, [_chunk_metadata(c) for c in group], near_dup=True)
+            total += len(group)
+            with span("sparse_index"):
+                sparse.add(ids, texts)
+            get_query_cache().invalidate(filename)
+            log(f"串流寫入 {filename}：已寫入 {total} 個 chunk")
+            if progress:
+                progress(total)
+
+        if total:
+            vectorstore.persist()
+            with span("sparse_index"):
+                save_sparse_index(sparse)
+            _write_dense_index(vectorstore, filename, "chunks")
+    except Exception:
+        # 中途失敗或被取消：移除已寫入的部分，不留下未登記的不完整文件
+        vectorstore._collection.delete(where={"filename": filename})
+        _forget_signatures(filename)
+        remove_sparse_index(filename)
+        remove_dense_index(filename)
+        raise
+
+    if total:
+        manifest = get_manifest()
+        manifest.record(filename, file_hash, total)
+        get_query_cache().invalidate(filename)
+        log(f"向量化完成，共 {total} 筆資料（檔案：{filename}）")
+        if isinstance(embedder, CachedEmbeddings):
+            log(f"Embedding 快取：命中 {embedder.hits} 筆，未命中 {embedder.misses} 筆")
+    return total
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+from config import Config
+from modules.metrics import inc
+from modules.utils import log
+
+
+def content_hash(text: str) -> str:
+    """chunk 內容的 sha256，作為快取鍵"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """以 (embedding 模型, 內容雜湊) 為鍵的磁碟向量快取，超過上限時以 LRU 淘汰"""
+
+    def __init__(self, path=Config.EMBEDDING_CACHE_PATH, max_entries: int = Config.EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        # 目前筆數只在啟動時計算一次，之後隨寫入與淘汰累計，寫入時不必每次 COUNT(*)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """查詢多個雜湊，回傳命中的 {hash: vector}，並更新其最後使用時間"""
+        if not hashes:
+            return {}
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite 參數數量有上限，分批查詢
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        """寫入多筆向量，寫入後若超過上限則淘汰最久未使用的項目"""
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, h, array("f", vec).tobytes(), now) for h, vec in items.items()]
+        with self._lock:
+            # 先只插入新的鍵，rowcount 即為新增筆數；已存在的鍵（其他執行緒剛寫入）再更新
+            added = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            ).rowcount
+            if added < len(rows):
+                self._conn.executemany(
+                    "UPDATE embeddings SET vector = ?, last_used = ? WHERE model = ? AND hash = ?",
+                    [(blob, used, m, h) for m, h, blob, used in rows],
+                )
+            self._count += added
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            ).rowcount
+            self._count -= deleted
+            log(f"Embedding 快取超過上限，淘汰 {deleted} 筆")
+
+    def stats(self) -> dict:
+        """累計命中統計"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+class CachedEmbeddings:
+    """
+    在實際 embedder 前加上內容雜湊快取，只對未命中的文字呼叫模型
+    實作 langchain Embeddings 介面（embed_documents / embed_query），不繼承以免匯入 langchain_core 拖慢啟動
+    """
+
+    def __init__(self, embedder, model: str, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.model = model
+        self.cache = cache
+        # 此實例自身的統計（store_vectors 以此回報單次 ingest 的效果）
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [content_hash(t) for t in texts]
+        found = self.cache.get_many(self.model, hashes)
+
+        # 同一批內重複的文字也只送一次
+        pending: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in found:
+                pending.setdefault(h, t)
+
+        missed = sum(1 for h in hashes if h not in found)
+        with self._stats_lock:
+            self.hits += len(texts) - missed
+            self.misses += missed
+        inc("rag_embedding_cache_total", len(texts) - missed, result="hit")
+        inc("rag_embedding_cache_total", missed, result="miss")
+
+        if pending:
+            vectors = self.embedder.embed_documents(list(pending.values()))
+            new_items = dict(zip(pending.keys(), vectors))
+            self.cache.put_many(self.model, new_items)
+            found.update(new_items)
+
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedder.embed_query(text)
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """取得行程共用的 embedding 快取（路徑於第一次使用時取自 Config）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(Config.EMBEDDING_CACHE_PATH, Config.EMBEDDING_CACHE_MAX_ENTRIES)
+    return _cache
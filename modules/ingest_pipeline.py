@@ -0,0 +1,109 @@
+"""
+單一 PDF 的串流 ingest：解析（每次 Config.PARSE_PAGE_WINDOW 頁）→ 切塊 → 去重 → 分組向量化 → 寫入。
+解析與切塊在背景執行緒進行，以有界佇列交給向量化，記憶體只需容納少數幾組 chunk 與一段頁面的解析結果；
+每組寫入後即可查詢，不必等整份文件處理完。
+"""
+
+import contextvars
+import os
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List
+from config import Config
+from modules.dense_index import dense_only_enabled
+from modules.embedder import store_vectors, store_vectors_stream
+from modules.manifest import file_sha256, get_manifest
+from modules.splitter import iter_document_chunks, split_documents
+from modules.utils import log
+from modules.vector_shards import open_all_shards
+
+_END = object()
+
+
+def prefetch_groups(chunks: Iterable[dict], group_size: int = Config.INGEST_STREAM_GROUP,
+                    depth: int = Config.INGEST_STREAM_PREFETCH) -> Iterator[List[dict]]:
+    """
+    在背景執行緒走訪 chunks，每 group_size 個為一組放入最多 depth 組的佇列；
+    呼叫端向量化目前這組時，下一段頁面同時在解析。呼叫端提前結束時背景執行緒在目前這段解析完後停止
+    """
+    groups: "queue.Queue" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                groups.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            group = []
+            for chunk in chunks:
+                group.append(chunk)
+                if len(group) >= group_size:
+                    if not put(group):
+                        return
+                    group = []
+            if group and not put(group):
+                return
+            put(_END)
+        except BaseException as e:
+            put(e)
+
+    # 複製目前的 context，讓解析耗時記在同一個請求下
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True, name="ingest-parse").start()
+    try:
+        while True:
+            item = groups.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def ingest_pdf(pdf_path: str, progress: Callable[[float, str], None] = None, min_words=3) -> int:
+    """
+    切塊並寫入向量庫，回傳 chunk 數；progress(進度 0~1, 說明)
+    新文件以串流方式處理；已登記的文件（增量更新、略過或別名）需要完整的 chunk 列表比對，沿用 split_documents + store_vectors。
+    只存於向量矩陣的新文件（dense_only_enabled()）整份寫完才能查詢，同樣不走串流
+    """
+    filename = os.path.basename(pdf_path)
+    manifest = get_manifest()
+    if not manifest.exists:
+        manifest.bootstrap_from_chroma(*open_all_shards())
+
+    if (not Config.STREAM_INGEST or dense_only_enabled()
+            or manifest.get(filename) or manifest.find_by_hash(file_sha256(pdf_path))):
+        chunks = split_documents(pdf_path, min_words=min_words)
+        if chunks:
+            store_vectors(
+                chunks,
+                collection_name="chunks",
+                pdf_path=pdf_path,
+                progress=lambda done, total: progress and progress(done / total, f"向量化 {done}/{total}"),
+            )
+        return len(chunks)
+
+    pages = {"done": 0, "total": 0}
+
+    def on_pages(done, total):
+        pages.update(done=done, total=total)
+
+    def on_stored(count):
+        if progress:
+            fraction = pages["done"] / pages["total"] if pages["total"] else 0.0
+            progress(fraction, f"已解析 {pages['done']}/{pages['total'] or '?'} 頁，已寫入 {count} 個 chunk")
+
+    groups = prefetch_groups(iter_document_chunks(pdf_path, min_words=min_words, on_pages=on_pages))
+    try:
+        total = store_vectors_stream(groups, pdf_path, progress=on_stored)
+    finally:
+        groups.close()
+    log(f"串流 ingest 完成：{filename} 共 {total} 個 chunk")
+    return total
@@ -0,0 +1,149 @@
+"""
+背景工作管理：耗時的 ingest 在有上限的執行緒池執行，不佔用 Gradio 處理查詢的 worker。
+每個工作有 id，可查詢進度與結果；取消為協作式，由工作在階段之間與每個向量化批次後呼叫 check_cancelled()。
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from config import Config
+from modules.metrics import inc
+from modules.utils import log
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+STATUS_LABELS = {QUEUED: "等待中", RUNNING: "執行中", DONE: "完成", FAILED: "失敗", CANCELLED: "已取消"}
+
+
+class JobCancelled(Exception):
+    """工作被要求取消時由 check_cancelled() 拋出"""
+
+
+class JobRejected(Exception):
+    """等待中的工作已達上限"""
+
+
+class Job:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.status = QUEUED
+        self.progress = 0.0             # 0~1
+        self.message = "等待執行"
+        self.partial = False            # 已有可使用的部分結果（例如串流 ingest 已寫入的頁面）
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def report(self, progress: float = None, message: str = None):
+        """更新進度；同時檢查是否已被取消"""
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def describe(self) -> str:
+        return f"[{self.id}] {self.name}：{STATUS_LABELS[self.status]} {self.progress:.0%} {self.message}"
+
+
+class JobManager:
+    def __init__(self, max_workers: int = Config.INGEST_JOB_WORKERS,
+                 max_pending: int = Config.INGEST_JOB_MAX_PENDING,
+                 history: int = Config.INGEST_JOB_HISTORY):
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> Job:
+        """
+        排入背景工作；fn 的第一個參數為 Job，可透過 job.report() 回報進度
+        等待中的工作達 max_pending 時拋出 JobRejected
+        """
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if pending >= self.max_pending:
+                inc("rag_jobs_total", status="rejected")
+                raise JobRejected(f"等待中的工作已達上限（{self.max_pending}），請稍後再試")
+            job = Job(name)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        log(f"工作 {job.id} 已排入：{name}")
+        return job
+
+    def _run(self, job: Job, fn: Callable, args, kwargs):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED, "已取消")
+            return
+        job.status = RUNNING
+        job.message = "執行中"
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            self._finish(job, DONE, str(job.result) if job.result is not None else "完成")
+        except JobCancelled:
+            self._finish(job, CANCELLED, "已取消")
+        except Exception as e:
+            job.error = str(e)
+            log(f"[WARN] 工作 {job.id} 失敗：{e}")
+            self._finish(job, FAILED, f"錯誤：{e}")
+
+    def _finish(self, job: Job, status: str, message: str):
+        job.status = status
+        job.message = message
+        job.finished = time.time()
+        inc("rag_jobs_total", status=status)
+        log(f"工作 {job.id} 結束：{status}（{job.name}）")
+
+    def _prune(self):
+        """只保留最近 history 筆已結束的工作"""
+        finished = [job_id for job_id, j in self._jobs.items() if j.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """要求取消；已結束或不存在的工作回傳 False"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return False
+        job._cancel.set()
+        job.message = "取消中" if job.status == RUNNING else job.message
+        log(f"工作 {job_id} 已要求取消")
+        return True
+
+
+_job_manager: Optional[JobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """取得行程共用的工作管理器"""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager()
+    return _job_manager
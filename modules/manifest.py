@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import Config
+from modules.utils import log
+
+
+def file_sha256(path: str) -> str:
+    """以串流方式計算檔案內容雜湊"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IngestManifest:
+    """已向量化文件的清單，以檔名與檔案雜湊提供 O(1) 查詢"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.documents: Dict[str, dict] = {}   # filename -> 紀錄
+        self.by_hash: Dict[str, str] = {}      # file_hash -> 實際存放向量的 filename
+        self._lock = threading.RLock()
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.documents = json.load(f).get("documents", {})
+            self._reindex()
+
+    def _reindex(self):
+        self.by_hash = {
+            rec["file_hash"]: name
+            for name, rec in self.documents.items()
+            if rec.get("file_hash") and not rec.get("alias_of")
+        }
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def get(self, filename: str) -> Optional[dict]:
+        with self._lock:
+            return self.documents.get(filename)
+
+    def find_by_hash(self, file_hash: str) -> Optional[dict]:
+        """依檔案內容找出已向量化的文件（不論檔名）"""
+        with self._lock:
+            name = self.by_hash.get(file_hash)
+            return self.documents.get(name) if name else None
+
+    def resolve(self, filename: str) -> str:
+        """將別名（內容相同但改名的檔案）對應到實際存放向量的檔名"""
+        with self._lock:
+            rec = self.documents.get(filename)
+            return rec.get("alias_of") or filename if rec else filename
+
+    def storage(self, filename: str) -> str:
+        """文件向量的存放位置："chroma"，或 "dense"（只存於向量矩陣，不在 Chroma 中）"""
+        with self._lock:
+            return (self.documents.get(filename) or {}).get("storage", "chroma")
+
+    def dense_documents(self) -> List[str]:
+        """只存於向量矩陣的文件（不含別名）"""
+        with self._lock:
+            return [
+                name for name, rec in self.documents.items()
+                if rec.get("storage") == "dense" and not rec.get("alias_of")
+            ]
+
+    def record(self, filename: str, file_hash: Optional[str], chunk_count: int,
+               embedding_model: str = Config.EMBEDDING_MODEL, storage: str = "chroma"):
+        """登記一份完成向量化的文件；內容改變時移除指向它的別名（別名登記的是舊版內容）"""
+        with self._lock:
+            previous = self.documents.get(filename)
+            if previous and previous.get("file_hash") != file_hash:
+                aliases = [name for name, rec in self.documents.items() if rec.get("alias_of") == filename]
+                for name in aliases:
+                    del self.documents[name]
+                if aliases:
+                    log(f"{filename} 內容已更新，移除指向舊版的別名（需重新匯入）：{', '.join(aliases)}")
+            self.documents[filename] = {
+                "filename": filename,
+                "file_hash": file_hash,
+                "chunk_count": chunk_count,
+                "embedding_model": embedding_model,
+                "storage": storage,
+                "ingested_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._reindex()
+            self._save()
+
+    def add_alias(self, filename: str, canonical: str):
+        """登記改名的副本，查詢時導向原始文件的向量"""
+        with self._lock:
+            target = self.documents[canonical]
+            self.documents[filename] = dict(
+                target,
+                filename=filename,
+                alias_of=canonical,
+                ingested_at=datetime.now().isoformat(timespec="seconds"),
+            )
+            self._save()
+
+    def remove(self, filename: str):
+        with self._lock:
+            if self.documents.pop(filename, None) is not None:
+                self._reindex()
+                self._save()
+
+    def bootstrap_from_chroma(self, *vectorstores):
+        """清單不存在時，由既有向量庫（所有分片）掃描一次建立（僅舊資料遷移時執行）"""
+        with self._lock:
+            if self.exists:
+                return
+            metadatas = [
+                m for vectorstore in vectorstores
+                for m in vectorstore.get(include=["metadatas"]).get("metadatas", [])
+            ]
+            counts: Dict[str, int] = {}
+            for m in metadatas:
+                if m and m.get("filename"):
+                    counts[m["filename"]] = counts.get(m["filename"], 0) + 1
+
+            for name, count in counts.items():
+                pdf_path = os.path.join(Config.PDF_DIR, name)
+                file_hash = file_sha256(pdf_path) if os.path.exists(pdf_path) else None
+                self.documents[name] = {
+                    "filename": name,
+                    "file_hash": file_hash,
+                    "chunk_count": count,
+                    "embedding_model": Config.EMBEDDING_MODEL,
+                    "ingested_at": datetime.now().isoformat(timespec="seconds"),
+                }
+            self._reindex()
+            self._save()
+            log(f"由向量庫建立 ingest 清單，共 {len(counts)} 份文件")
+
+
+_manifests: Dict[str, IngestManifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(collection_name: str = "chunks") -> IngestManifest:
+    """取得 collection 對應的 ingest 清單（行程內共用）"""
+    with _manifests_lock:
+        if collection_name not in _manifests:
+            path = os.path.join(str(Config.VECTOR_DIR), f"{collection_name}_manifest.json")
+            _manifests[collection_name] = IngestManifest(path)
+        return _manifests[collection_name]
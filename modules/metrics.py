@@ -0,0 +1,231 @@
+"""
+各階段耗時與計數的輕量指標：
+span(stage) 記錄耗時直方圖、inc(name) 累加計數器，request_context() 以請求 id 串起同一請求的各階段，
+export_prometheus() 輸出 Prometheus 文字格式。Config.METRICS_ENABLED 為 False 時 span 直接回傳共用的空 context。
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from config import Config
+from modules.utils import current_request_id, log
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NULL_SPAN = nullcontext()
+_request_spans: ContextVar = ContextVar("request_spans", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """固定分桶的直方圖（單位：秒）"""
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """行程內的指標集合"""
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: LabelKey = ()):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if labels not in series:
+                series[labels] = Histogram()
+            series[labels].observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, labels: LabelKey = ()):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0.0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        """以 dict 形式回傳目前的計數與直方圖摘要"""
+        with self._lock:
+            return {
+                "counters": {
+                    name: {_format_labels(k): v for k, v in series.items()}
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: {
+                        _format_labels(k): {"count": h.count, "sum": h.sum}
+                        for k, h in series.items()
+                    }
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def export_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS, h.bucket_counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {h.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+registry = MetricsRegistry()
+registry.help.update({
+    "rag_stage_duration_seconds": "Duration of each pipeline stage",
+    "rag_request_duration_seconds": "End-to-end duration of a request",
+    "rag_generate_ttft_seconds": "Time to first streamed LLM token",
+    "rag_reranker_fallback_total": "Queries that fell back to hybrid scores because the reranker failed",
+    "rag_ingest_skipped_total": "Ingests skipped because the document was already indexed",
+    "rag_ingest_update_chunks_total": "Chunks added, removed or kept by incremental re-ingestion",
+    "rag_prompt_context_tokens_total": "Context tokens sent to the LLM and saved by budgeted packing",
+    "rag_embedding_cache_total": "Embedding cache lookups by result",
+    "rag_query_cache_total": "Query result cache lookups by result",
+    "rag_near_duplicate_total": "Near-duplicate chunks dropped within a document or reusing an indexed vector",
+    "rag_jobs_total": "Background jobs by final status (done, failed, cancelled, rejected)",
+    "rag_query_rewrite_total": "LLM query rewrites by result (llm, memo, timeout, error)",
+})
+
+
+# -----------------------------
+# 對外介面
+# -----------------------------
+@contextmanager
+def _timed_span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe("rag_stage_duration_seconds", elapsed, (("stage", stage),))
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+
+def span(stage: str):
+    """量測一個階段的耗時；停用時回傳共用的空 context，幾乎沒有額外成本"""
+    if not Config.METRICS_ENABLED:
+        return _NULL_SPAN
+    return _timed_span(stage)
+
+
+def inc(name: str, amount: float = 1.0, **labels):
+    """累加計數器"""
+    if Config.METRICS_ENABLED:
+        registry.inc(name, amount, tuple(sorted(labels.items())))
+
+
+def observe(name: str, value: float, **labels):
+    """記錄一筆直方圖數值（秒）"""
+    if Config.METRICS_ENABLED:
+        registry.observe(name, value, tuple(sorted(labels.items())))
+
+
+@contextmanager
+def request_context(kind: str, request_id: Optional[str] = None):
+    """
+    以請求 id 串起同一請求內的 log 與各階段耗時，結束時記錄總耗時並輸出各階段分解
+    kind: 請求類型（例如 query、ingest）
+    """
+    request_id = request_id or uuid.uuid4().hex[:8]
+    id_token = current_request_id.set(request_id)
+    spans_token = _request_spans.set({} if Config.METRICS_ENABLED else None)
+    started = time.perf_counter()
+    try:
+        yield request_id
+    finally:
+        elapsed = time.perf_counter() - started
+        spans = _request_spans.get()
+        if spans is not None:
+            registry.observe("rag_request_duration_seconds", elapsed, (("kind", kind),))
+            breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in spans.items())
+            log(f"{kind} 完成，總耗時 {elapsed * 1000:.0f}ms（{breakdown}）")
+        _request_spans.reset(spans_token)
+        current_request_id.reset(id_token)
+
+
+@contextmanager
+def capture_spans():
+    """收集區塊內各階段的累計耗時（秒，dict），不輸出 log；供基準測試等離線量測使用（需啟用指標）"""
+    spans = {}
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def export_prometheus() -> str:
+    """以 Prometheus 文字格式輸出所有指標"""
+    return registry.export_prometheus()
+
+
+def start_metrics_server(port: int = Config.METRICS_PORT) -> ThreadingHTTPServer:
+    """在背景執行緒提供 /metrics 端點"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = export_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log(f"Prometheus 指標端點：http://0.0.0.0:{port}/metrics")
+    return server
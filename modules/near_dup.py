@@ -0,0 +1,233 @@
+"""
+以 MinHash-LSH 找出近似重複的 chunk（空白、斷字、頁碼不同或重複的圖說與頁首）：
+1. 文件內：切塊時丟棄與前面 chunk 近似重複者（NearDuplicateIndex）
+2. 與既有索引：新 chunk 與已向量化的 chunk 近似重複時沿用其向量，不再呼叫 embedding（SignatureStore）
+相似度為字元 shingle 集合的 Jaccard 估計值，達 Config.NEAR_DUP_THRESHOLD 視為重複。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from config import Config
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_HYPHEN_BREAK = re.compile(r"(\w)-\s*\n\s*(\w)")
+# 只遮蔽頁碼與頁首頁尾：單獨一行的數字（含 "Page 3"、"3 / 12"）與 chunk 開頭、結尾的數字；
+# 內文的數字（實驗結果、表號）仍參與比對，只差數字的段落不視為重複
+_PAGE_LINE = re.compile(r"^[ \t]*(?:page[ \t]+)?\d{1,4}(?:[ \t]*(?:/|of)[ \t]*\d{1,4})?[ \t]*$", re.IGNORECASE | re.MULTILINE)
+_EDGE_NUMBER = re.compile(r"\A\s*\d{1,4}\b|\b\d{1,4}\s*\Z")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """合併行尾斷字、頁碼以 # 取代、統一空白與大小寫"""
+    text = _HYPHEN_BREAK.sub(r"\1\2", text)
+    text = _PAGE_LINE.sub("#", text)
+    text = _EDGE_NUMBER.sub("#", text.strip())
+    return _SPACE.sub(" ", text.lower()).strip()
+
+
+def _bands_for(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """選擇 (band 數, 每 band 列數)：在 LSH 門檻 (1/b)^(1/r) 不高於 threshold 的組合中取最接近者，寧可多驗證候選也不漏掉"""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = Config.NEAR_DUP_NUM_PERM, shingle: int = Config.NEAR_DUP_SHINGLE,
+                 threshold: float = Config.NEAR_DUP_THRESHOLD, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        # a < 2^31、雜湊 < 2^32，a*x+b 不會超出 uint64
+        self.a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.threshold = threshold
+        self.bands, self.rows = _bands_for(threshold, num_perm)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """文字的 MinHash 簽章（uint32），正規化後為空時回傳 None"""
+        text = normalize(text)
+        if not text:
+            return None
+        k = min(self.shingle, len(text))
+        shingles = {text[i:i + k] for i in range(len(text) - k + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        permuted = ((hashes[:, None] * self.a + self.b) % _PRIME) & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> List[int]:
+        """每個 band 的桶號（64-bit 有號整數，可直接存入 SQLite）"""
+        return [
+            int.from_bytes(
+                hashlib.blake2b(signature[i * self.rows:(i + 1) * self.rows].tobytes(), digest_size=8).digest(),
+                "little", signed=True,
+            )
+            for i in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """兩個簽章估計的 Jaccard 相似度"""
+        return float(np.mean(a == b))
+
+
+class NearDuplicateIndex:
+    """記憶體中的 LSH 索引（單份文件內去重）"""
+
+    def __init__(self, hasher: MinHasher = None):
+        self.hasher = hasher or get_hasher()
+        self._buckets: Dict[Tuple[int, int], List[Hashable]] = {}
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+
+    def find(self, signature: np.ndarray) -> Optional[Hashable]:
+        """回傳相似度達門檻且最相近的既有 key"""
+        best, best_sim = None, self.hasher.threshold
+        for band, bucket in enumerate(self.hasher.band_keys(signature)):
+            for key in self._buckets.get((band, bucket), ()):
+                sim = MinHasher.similarity(signature, self._signatures[key])
+                if sim >= best_sim:
+                    best, best_sim = key, sim
+        return best
+
+    def add(self, key: Hashable, signature: np.ndarray):
+        self._signatures[key] = signature
+        for band, bucket in enumerate(self.hasher.band_keys(signature)):
+            self._buckets.setdefault((band, bucket), []).append(key)
+
+
+class SignatureStore:
+    """已向量化 chunk 的 MinHash 簽章與 LSH 桶（SQLite），供新 chunk 找出可沿用向量的近似重複"""
+
+    def __init__(self, path=Config.NEAR_DUP_INDEX_PATH, hasher: MinHasher = None):
+        self.path = str(path)
+        self.hasher = hasher or get_hasher()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS signatures (
+                chunk_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                model TEXT NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_bucket ON buckets (band, bucket);
+            CREATE INDEX IF NOT EXISTS idx_bucket_chunk ON buckets (chunk_id);
+            CREATE INDEX IF NOT EXISTS idx_signature_file ON signatures (filename);
+            """
+        )
+        self._conn.commit()
+
+    def find(self, signature: np.ndarray, model: str = Config.EMBEDDING_MODEL) -> Optional[Tuple[str, str, float]]:
+        """回傳最相近的 (chunk id, 檔名, 相似度)，沒有達門檻者時回傳 None"""
+        keys = self.hasher.band_keys(signature)
+        with self._lock:
+            candidates = {
+                chunk_id for band, bucket in enumerate(keys)
+                for (chunk_id,) in self._conn.execute(
+                    "SELECT chunk_id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)
+                )
+            }
+            if not candidates:
+                return None
+            rows = []
+            candidates = list(candidates)
+            for start in range(0, len(candidates), 500):
+                batch = candidates[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._conn.execute(
+                    f"SELECT chunk_id, filename, signature FROM signatures "
+                    f"WHERE model = ? AND chunk_id IN ({placeholders})",
+                    [model, *batch],
+                ))
+
+        best = None
+        for chunk_id, filename, blob in rows:
+            sim = MinHasher.similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+            if sim >= self.hasher.threshold and (best is None or sim > best[2]):
+                best = (chunk_id, filename, sim)
+        return best
+
+    def add(self, filename: str, ids: List[str], signatures: List[Optional[np.ndarray]],
+            model: str = Config.EMBEDDING_MODEL):
+        rows = [(i, s) for i, s in zip(ids, signatures) if s is not None]
+        if not rows:
+            return
+        with self._lock:
+            self._remove_ids([i for i, _ in rows])
+            self._conn.executemany(
+                "INSERT INTO signatures (chunk_id, filename, model, signature) VALUES (?, ?, ?, ?)",
+                [(i, filename, model, s.tobytes()) for i, s in rows],
+            )
+            self._conn.executemany(
+                "INSERT INTO buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                [(band, bucket, i) for i, s in rows for band, bucket in enumerate(self.hasher.band_keys(s))],
+            )
+            self._conn.commit()
+
+    def _remove_ids(self, ids: List[str]):
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM signatures WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM buckets WHERE chunk_id IN ({placeholders})", batch)
+
+    def remove_ids(self, ids: List[str]):
+        if not ids:
+            return
+        with self._lock:
+            self._remove_ids(list(ids))
+            self._conn.commit()
+
+    def remove_document(self, filename: str):
+        with self._lock:
+            ids = [i for (i,) in self._conn.execute("SELECT chunk_id FROM signatures WHERE filename = ?", (filename,))]
+            self._remove_ids(ids)
+            self._conn.commit()
+
+
+_hasher: Optional[MinHasher] = None
+_store: Optional[SignatureStore] = None
+_lock = threading.Lock()
+
+
+def get_hasher() -> MinHasher:
+    """取得行程共用的 MinHasher（參數取自 Config，排列係數固定，簽章可跨行程比較）"""
+    global _hasher
+    if _hasher is None:
+        with _lock:
+            if _hasher is None:
+                _hasher = MinHasher()
+    return _hasher
+
+
+def get_signature_store() -> SignatureStore:
+    """取得行程共用的簽章索引（路徑於第一次使用時取自 Config，基準測試等可先改到暫存資料夾）"""
+    global _store
+    if _store is None:
+        hasher = get_hasher()
+        with _lock:
+            if _store is None:
+                _store = SignatureStore(Config.NEAR_DUP_INDEX_PATH, hasher=hasher)
+    return _store
@@ -1,7 +1,14 @@
-from langchain_community.llms import Ollama
+import time
+from collections import deque
 from config import Config
+from modules.clients import get_llm
+from modules.context_builder import build_context
+from modules.metrics import observe, span
 from modules.utils import log
 
+# 最近的串流回答統計（首個 token 延遲 / 總耗時，單位秒）
+stream_metrics = deque(maxlen=Config.STREAM_METRICS_WINDOW)
+
 PROMPT_TEMPLATE = """
 You are a rigorous academic assistant.
 Please answer the questions based on the context provided.
@@ -18,12 +25,60 @@ question：
 def generate_answer(user_query, retrieved_docs):
     """
     user_query: 使用者問題
-    retrieved_docs: 已檢索到的文件列表 (list of str)
+    retrieved_docs: hybrid_search_scored 的結果，或已檢索到的文件列表 (list of str)
     """
-    context = "\n".join(retrieved_docs)
+    context, _ = build_context(retrieved_docs)
 
-    llm = Ollama(model=Config.LLM_MODEL)
+    llm = get_llm()
     prompt = PROMPT_TEMPLATE.format(context=context, query=user_query)
-    answer = llm.invoke(prompt)
+    with span("generate"):
+        answer = llm.invoke(prompt)
     log(f"回答完成")
     return answer.strip()
+
+
+def generate_answer_stream(user_query, retrieved_docs):
+    """
+    串流版本的 generate_answer，隨 Ollama 產生逐段 yield 回答文字
+    """
+    context, _ = build_context(retrieved_docs)
+
+    llm = get_llm()
+    prompt = PROMPT_TEMPLATE.format(context=context, query=user_query)
+
+    started = time.perf_counter()
+    ttft = None
+    pieces = 0
+    for piece in llm.stream(prompt):
+        if ttft is None:
+            ttft = time.perf_counter() - started
+            observe("rag_generate_ttft_seconds", ttft)
+            log(f"首個 token 延遲：{ttft:.3f}s")
+        pieces += 1
+        yield piece
+
+    total = time.perf_counter() - started
+    observe("rag_stage_duration_seconds", total, stage="generate")
+    stream_metrics.append({"ttft": ttft if ttft is not None else total, "total": total, "pieces": pieces})
+    log(f"回答完成（串流，共 {pieces} 段，耗時 {total:.2f}s）")
+
+
+def get_stream_metrics() -> dict:
+    """彙總最近串流回答的首個 token 延遲與總耗時"""
+    records = list(stream_metrics)
+    if not records:
+        return {"count": 0}
+
+    def percentile(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    ttfts = [r["ttft"] for r in records]
+    totals = [r["total"] for r in records]
+    return {
+        "count": len(records),
+        "ttft_p50": percentile(ttfts, 0.5),
+        "ttft_p95": percentile(ttfts, 0.95),
+        "total_p50": percentile(totals, 0.5),
+        "total_p95": percentile(totals, 0.95),
+    }
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from config import Config
+from modules.utils import log
+
+
+class SemanticQueryCache:
+    """以 (文件, 查詢向量) 為鍵的檢索結果快取；新查詢與快取查詢的 cosine 相似度達門檻即命中"""
+
+    def __init__(self, threshold: float = Config.QUERY_CACHE_THRESHOLD,
+                 max_entries: int = Config.QUERY_CACHE_MAX_ENTRIES,
+                 ttl: float = Config.QUERY_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()   # LRU 順序
+        self._by_file: Dict[Optional[str], set] = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _drop(self, key: int):
+        entry = self._entries.pop(key)
+        keys = self._by_file.get(entry["filename"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_file[entry["filename"]]
+
+    def get(self, filename: Optional[str], embedding) -> Optional[List[dict]]:
+        """查詢快取，命中時回傳當初的最終結果"""
+        with self._lock:
+            keys = list(self._by_file.get(filename, ()))
+            now = time.time()
+            # 先清除過期項目
+            for key in keys:
+                if now - self._entries[key]["created"] > self.ttl:
+                    self._drop(key)
+            keys = [k for k in keys if k in self._entries]
+            if not keys:
+                self.misses += 1
+                return None
+
+            query = self._normalize(embedding)
+            matrix = np.stack([self._entries[k]["vector"] for k in keys])
+            sims = matrix @ query
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            log(f"查詢快取命中（相似度 {sims[best]:.4f}）：{self._entries[key]['query']}")
+            return list(self._entries[key]["results"])
+
+    def put(self, filename: Optional[str], embedding, query: str, results: List[dict]):
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = {
+                "filename": filename,
+                "vector": self._normalize(embedding),
+                "query": query,
+                "results": list(results),
+                "created": time.time(),
+            }
+            self._by_file.setdefault(filename, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, filename: str):
+        """文件重新 ingest 後清除其快取（未指定文件的跨文件查詢也一併清除）"""
+        with self._lock:
+            for name in (filename, None):
+                for key in list(self._by_file.get(name, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_file.clear()
+
+
+_query_cache: Optional[SemanticQueryCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> SemanticQueryCache:
+    """取得行程共用的查詢快取"""
+    global _query_cache
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = SemanticQueryCache()
+    return _query_cache
@@ -1,6 +1,10 @@
-from langchain_community.llms import Ollama
-from langchain_core.prompts import PromptTemplate
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
 from config import Config
+from modules.clients import get_llm
+from modules.metrics import inc, span
 from modules.utils import log
 
 TRANSFORM_PROMPT = """
@@ -12,14 +16,49 @@ TRANSFORM_PROMPT = """
 {query}
 """
 
+# (模型, 原始問題) → 改寫結果，LRU 淘汰
+_rewrites: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_rewrites_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
 def transform_query(user_query: str) -> str:
+    key = (Config.LLM_MODEL, user_query)
+    with _rewrites_lock:
+        if key in _rewrites:
+            _rewrites.move_to_end(key)
+            inc("rag_query_rewrite_total", result="memo")
+            return _rewrites[key]
+
     try:
-        llm = Ollama(model=Config.LLM_MODEL)
+        from langchain_core.prompts import PromptTemplate
+
+        llm = get_llm()
         prompt = PromptTemplate.from_template(TRANSFORM_PROMPT)
-        reformulated = llm.invoke(prompt.format(query=user_query))
-        cleaned = reformulated.strip()
+        with span("transform_query"):
+            reformulated = llm.invoke(prompt.format(query=user_query))
+        cleaned = reformulated.strip() or user_query
         log(f"Query 改寫：{user_query} → {cleaned}")
-        return cleaned
     except Exception as e:
+        inc("rag_query_rewrite_total", result="error")
         log(f"Query Transform 發生錯誤：{e}")
         return user_query
+
+    inc("rag_query_rewrite_total", result="llm")
+    with _rewrites_lock:
+        _rewrites[key] = cleaned
+        while len(_rewrites) > Config.QUERY_REWRITE_CACHE_SIZE:
+            _rewrites.popitem(last=False)
+    return cleaned
+
+
+def submit_transform_query(user_query: str) -> Future:
+    """在背景執行緒改寫查詢；呼叫端逾時放棄時仍會完成並寫入快取，下次同一問題可直接使用"""
+    global _executor
+    if _executor is None:
+        with _rewrites_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=Config.OLLAMA_MAX_CONNECTIONS, thread_name_prefix="query-rewrite"
+                )
+    return _executor.submit(transform_query, user_query)
@@ -0,0 +1,244 @@
+import argparse
+import os
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+from config import Config
+from modules.utils import log
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def _onnx_available() -> bool:
+    try:
+        import optimum.onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _load_onnx_model(model_name: str):
+    """載入（必要時先匯出）ONNX Runtime 版本的模型，需要安裝 optimum[onnxruntime]"""
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+
+    export_dir = os.path.join(str(Config.RERANKER_ONNX_DIR), model_name.replace("/", "__"))
+    if os.path.exists(os.path.join(export_dir, "model.onnx")):
+        return ORTModelForSequenceClassification.from_pretrained(export_dir)
+
+    log(f"匯出 ONNX 模型至 {export_dir}（僅第一次執行）")
+    model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+    model.save_pretrained(export_dir)
+    return model
+
+
+class Reranker:
+    """常駐記憶體的 cross-encoder reranker，模型只載入一次，供所有查詢共用"""
+
+    def __init__(self, model_name: str = Config.RERANKER_MODEL, max_length: int = Config.RERANKER_MAX_LENGTH,
+                 backend: str = Config.RERANKER_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的 reranker backend：{backend}（可用：{', '.join(BACKENDS)}）")
+
+        # torch / transformers 匯入耗時數秒，延後到實際建立 Reranker 時才載入
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        if backend == "onnx":
+            try:
+                self.model = _load_onnx_model(model_name)
+            except ImportError as e:
+                log(f"[WARN] 無法使用 ONNX Runtime（{e}），改用 int8 量化的 PyTorch 模型")
+                backend = "int8"
+
+        if backend in ("torch", "int8"):
+            self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+            self.model.eval()
+            if backend == "int8":
+                # 動態量化只支援 CPU：Linear 層權重轉 int8，activation 於推論時量化
+                self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self.backend = backend
+        self.device = torch.device("cuda" if backend == "torch" and torch.cuda.is_available() else "cpu")
+        if backend != "onnx":
+            self.model.to(self.device)
+        log(f"載入 Reranker 模型：{model_name} (backend={backend}, device={self.device})")
+
+        # fast tokenizer 不保證執行緒安全，推論時以鎖保護
+        self._lock = threading.Lock()
+
+        # (query 雜湊, chunk id) -> 分數 的 LRU 快取
+        self.batch_size = Config.RERANKER_BATCH_SIZE
+        self.cache_size = Config.RERANKER_CACHE_SIZE
+        self._cache: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _forward(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """依長度排序後分成小批次，每批只補齊到該批最長的長度"""
+        encoded = self.tokenizer(
+            [p[0] for p in pairs],
+            [p[1] for p in pairs],
+            truncation=True,
+            max_length=self.max_length,
+        )
+        order = sorted(range(len(pairs)), key=lambda i: len(encoded["input_ids"][i]))
+        scores = np.zeros(len(pairs), dtype=np.float32)
+
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            batch = self.tokenizer.pad(
+                {key: [encoded[key][i] for i in idx] for key in encoded.keys()},
+                padding=True,
+                return_tensors="pt"
+            ).to(self.device)
+            # 只有一組 pair 時 squeeze 會變成 0 維，統一攤平成一維
+            scores[idx] = self.model(**batch).logits.reshape(-1).detach().cpu().numpy()
+        return scores
+
+    def score(self, pairs: Sequence[Tuple[str, str]], keys: Optional[Sequence[Hashable]] = None) -> np.ndarray:
+        """
+        對多組 (query, passage) 計算相關性分數，回傳與 pairs 等長的陣列
+        keys: 每組配對的快取鍵（例如 (query 雜湊, chunk id)），提供時已評分過的配對不再計算
+        """
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        todo = list(range(len(pairs)))
+        if keys is not None:
+            todo = []
+            with self._cache_lock:
+                for i, key in enumerate(keys):
+                    if key in self._cache:
+                        self._cache.move_to_end(key)
+                        scores[i] = self._cache[key]
+                    else:
+                        todo.append(i)
+                self.cache_hits += len(pairs) - len(todo)
+                self.cache_misses += len(todo)
+
+        if todo:
+            import torch
+
+            with self._lock, torch.no_grad():
+                scores[todo] = self._forward([pairs[i] for i in todo])
+
+            if keys is not None:
+                with self._cache_lock:
+                    for i in todo:
+                        self._cache[keys[i]] = float(scores[i])
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return scores
+
+
+# -----------------------------
+# 行程內共用的單例（每種 backend 一個）
+# -----------------------------
+_rerankers: Dict[str, Reranker] = {}
+_reranker_lock = threading.Lock()
+
+
+def get_reranker(backend: Optional[str] = None) -> Reranker:
+    """取得行程共用的 Reranker，第一次呼叫時才載入模型"""
+    backend = backend or Config.RERANKER_BACKEND
+    if backend not in _rerankers:
+        with _reranker_lock:
+            if backend not in _rerankers:
+                if backend == "onnx" and "int8" in _rerankers and not _onnx_available():
+                    reranker = _rerankers["int8"]
+                else:
+                    reranker = Reranker(backend=backend)
+                # ONNX 無法使用時退回 int8：兩個設定共用同一份已載入的 int8 模型
+                _rerankers[backend] = _rerankers.setdefault(reranker.backend, reranker)
+    return _rerankers[backend]
+
+
+def set_reranker(reranker, backend: Optional[str] = None) -> None:
+    """以自訂實作取代共用的 Reranker（需提供 score(pairs, keys=None)），供基準測試等離線情境使用"""
+    with _reranker_lock:
+        _rerankers[backend or Config.RERANKER_BACKEND] = reranker
+
+
+def preload_reranker() -> None:
+    """啟動時預先載入 Reranker，避免第一個查詢承擔載入時間"""
+    try:
+        get_reranker()
+    except Exception as e:
+        log(f"[WARN] Reranker 預載失敗，將於第一次查詢時重試：{e}")
+
+
+def rerank_scores(query: str, passages: List[str]) -> np.ndarray:
+    """以同一個 query 對多個段落評分"""
+    return get_reranker().score([(query, p) for p in passages])
+
+
+# -----------------------------
+# Backend 一致性與延遲比較
+# -----------------------------
+def compare_backends(pairs: Sequence[Tuple[str, str]], backends: Sequence[str] = BACKENDS, runs: int = 5) -> dict:
+    """以 PyTorch fp32 分數為基準，比較各 backend 的分數差異、排序一致性與延遲"""
+    report = {}
+    baseline = None
+    for backend in ("torch", *[b for b in backends if b != "torch"]):
+        reranker = get_reranker(backend)
+        reranker.score(pairs)  # 暖機
+        latencies = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            scores = reranker.score(pairs)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        entry = {
+            "backend": reranker.backend,
+            "latency_ms_p50": float(np.median(latencies)),
+            "latency_ms_min": float(np.min(latencies)),
+        }
+        if baseline is None:
+            baseline = scores
+        else:
+            k = min(Config.FINAL_TOP_M, len(pairs))
+            top_base = set(np.argsort(-baseline)[:k])
+            top_this = set(np.argsort(-scores)[:k])
+            entry.update({
+                "max_abs_diff": float(np.max(np.abs(scores - baseline))),
+                "pearson": float(np.corrcoef(scores, baseline)[0, 1]) if len(pairs) > 1 else 1.0,
+                f"top{k}_overlap": len(top_base & top_this) / k,
+                "speedup": report["torch"]["latency_ms_p50"] / entry["latency_ms_p50"],
+            })
+        report[backend] = entry
+        log(f"[{backend}] " + ", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                                        for key, value in entry.items() if key != "backend"))
+    return report
+
+
+def _pairs_from_store(query: str, filename: str) -> List[Tuple[str, str]]:
+    """從向量庫（只存於向量矩陣的文件則從其 sidecar）取出指定文件的 chunk 作為比較用配對"""
+    from modules.dense_index import load_dense_index
+    from modules.manifest import get_manifest
+    from modules.vector_shards import open_document_shard
+
+    if get_manifest().storage(filename) == "dense":
+        dense_index = load_dense_index(filename)
+        docs = dense_index.documents[:Config.MID_TOP_M] if dense_index is not None else []
+    else:
+        vectorstore = open_document_shard(filename)
+        docs = vectorstore.get(where={"filename": filename}, limit=Config.MID_TOP_M, include=["documents"])["documents"]
+    return [(query, d) for d in docs]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較 reranker backend 的分數一致性與延遲")
+    parser.add_argument("--query", required=True, help="比較用的問題")
+    parser.add_argument("--filename", required=True, help="已向量化的 PDF 檔名，取其 chunk 作為段落")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    compare_backends(_pairs_from_store(args.query, args.filename), args.backends, args.runs)
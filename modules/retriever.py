@@ -1,14 +1,21 @@
+import hashlib
 import numpy as np
 import re
-import torch
-from rank_bm25 import BM25Okapi
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from typing import List, Tuple
 from config import Config
 from modules.utils import log
 from modules.embedder import get_embedder
+from modules.dense_index import build_dense_index, load_dense_index, save_dense_index
+from modules.embedding_cache import CachedEmbeddings
+from modules.manifest import get_manifest
+from modules.metrics import inc, span
+from modules.query_cache import get_query_cache
+from modules.query_transformer import submit_transform_query
+from modules.reranker import get_reranker
+from modules.sparse_index import build_sparse_index, load_sparse_index, tokenize
+from modules.vector_shards import map_shards, open_document_shard
 
 
 def extract_score(model_output: str) -> float:
@@ -24,112 +31,488 @@ def extract_score(model_output: str) -> float:
     return -9999.0
 
 
-# --- 主檢索函數 ---
-def hybrid_search(query: str, filename: str = None) -> List[str]:
-    """執行混合檢索 (向量 + BM25) 並使用 Reranker 重新排序"""
-    log(f"執行混合檢索：{query} (文件過濾: {filename or '無'})")
+# --- 候選集合 ---
+def _embed_queries(embedder, queries: List[str]) -> List[List[float]]:
+    """一次請求取得所有查詢的向量（查詢不寫入 chunk 向量快取）"""
+    if isinstance(embedder, CachedEmbeddings):
+        embedder = embedder.embedder
+    return embedder.embed_documents(queries)
 
-    embedder = get_embedder()
 
-    # 1. 載入向量資料庫
-    vector_db_chunks = Chroma(
-        persist_directory=str(Config.VECTOR_CHUNK_DB),
-        embedding_function=embedder
+def _vector_search(vector_db, query_embeddings: List[List[float]], filename: str = None) -> List[List[dict]]:
+    """多個查詢一起做向量檢索，回傳每個查詢含 chroma id 與距離的候選 chunk"""
+    results = vector_db._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=Config.VECTOR_TOP_K,
+        where={"filename": filename} if filename else None,
+        include=["documents", "metadatas", "distances"],
     )
+    return [
+        [
+            {"id": i, "content": doc, "metadata": meta or {}, "distance": dist}
+            for i, doc, meta, dist in zip(ids, docs, metas, dists)
+        ]
+        for ids, docs, metas, dists in zip(
+            results["ids"], results["documents"], results["metadatas"], results["distances"]
+        )
+    ]
 
-    # 2. 檔案過濾設定
-    chroma_filter = {"filename": filename} if filename else {}
 
-    # 3. 向量檢索（返回距離分數）
-    v_results = vector_db_chunks.similarity_search_with_score(
-        query,
-        k=Config.VECTOR_TOP_K,
-        filter=chroma_filter
-    )
+def _get_dense_index(vector_db, filename: str):
+    """
+    取得文件的 memory-mapped 向量索引；尚未建立或儲存格式與設定不同時由向量庫（重新）建立。
+    只存於向量矩陣的文件無法由向量庫建立，格式不同時由矩陣本身的 float32 向量改存
+    """
+    index = load_dense_index(filename)
+    if get_manifest().storage(filename) == "dense":
+        if index is None:
+            log(f"[WARN] 文件 {filename} 只存於向量矩陣，但找不到矩陣檔（需重新匯入）")
+        elif index.dtype != Config.DENSE_INDEX_DTYPE:
+            log(f"文件 {filename} 的向量矩陣格式為 {index.dtype}，依設定改存為 {Config.DENSE_INDEX_DTYPE}")
+            index = save_dense_index(
+                filename, index.ids, index.documents, index.metadatas, index.float32_rows(), full_precision=True
+            )
+        return index
+    if index is None:
+        log(f"文件 {filename} 尚無向量索引，由向量庫補建")
+        index = build_dense_index(vector_db, filename)
+    elif index.dtype != Config.DENSE_INDEX_DTYPE:
+        log(f"文件 {filename} 的向量索引格式為 {index.dtype}，依設定改建為 {Config.DENSE_INDEX_DTYPE}")
+        index = build_dense_index(vector_db, filename)
+    return index
 
-    if not v_results:
-        log("向量檢索結果為空，結束。")
-        return []
 
-    combined: List[Tuple[Document, float]] = v_results
-    log(f"向量檢索共獲取 {len(combined)} 筆結果。")
+def _dense_vector_search(dense_index, query_embeddings: List[List[float]], k: int = None) -> List[List[dict]]:
+    """在文件的向量矩陣上做精確搜尋，回傳格式與 _vector_search 相同"""
+    return [
+        [
+            {
+                "id": dense_index.ids[row],
+                "content": dense_index.documents[row],
+                "metadata": dense_index.metadatas[row],
+                "distance": distance,
+            }
+            for row, distance in hits
+        ]
+        for hits in dense_index.search(query_embeddings, k or Config.VECTOR_TOP_K)
+    ]
 
-    # 4. BM25 建立
-    docs_text = [d[0].page_content for d in combined]
-    tokenized_corpus = [t.split() for t in docs_text]
-    bm25 = BM25Okapi(tokenized_corpus)
-    bm25_scores = bm25.get_scores(query.split())
 
-    # 5. 分數正規化處理 ----------------------------------------
+def _needs_rescore(dense_index) -> bool:
+    """量化矩陣找出的候選是否以 float32 原始向量重算距離"""
+    return dense_index.dtype != "float32" and Config.DENSE_RESCORE_TOP > 0
 
-    # --- BM25 Min-Max normalization ---
-    if len(bm25_scores) > 0 and (max(bm25_scores) - min(bm25_scores)) > 1e-6:
-        b_min, b_max = min(bm25_scores), max(bm25_scores)
-        bm25_scores_norm = (bm25_scores - b_min) / (b_max - b_min)
-    else:
-        bm25_scores_norm = np.zeros_like(bm25_scores)
-
-    # --- 向量距離轉相似度並正規化 ---
-    v_scores = np.array([vscore for _, vscore in combined])
-    if len(v_scores) > 0 and (max(v_scores) - min(v_scores)) > 1e-6:
-        # Step 1: 距離越小越相似，先反轉
-        v_scores_sim = (max(v_scores) - v_scores)
-        # Step 2: 再 Min-Max normalize
-        v_scores_norm = (v_scores_sim - v_scores_sim.min()) / (v_scores_sim.max() - v_scores_sim.min())
+
+def _full_precision_vectors(vector_db, dense_index, ids: List[str]) -> dict:
+    """候選的 float32 原始向量：矩陣附有 float32 副本（只存於矩陣的文件）時由副本讀取，否則由向量庫取出"""
+    if dense_index.full_vectors is not None:
+        rows = [dense_index.row_of[i] for i in ids]
+        return dict(zip(ids, dense_index.float32_rows(rows)))
+    stored = vector_db._collection.get(ids=ids, include=["embeddings"])
+    return dict(zip(stored["ids"], np.asarray(stored["embeddings"], dtype=np.float32)))
+
+
+def _rescore_full_precision(vector_db, candidate_lists: List[List[dict]],
+                            query_embeddings: List[List[float]], dense_index) -> List[List[dict]]:
+    """量化索引找出的候選，以原始向量重算距離後取前 VECTOR_TOP_K 筆"""
+    ids = list(dict.fromkeys(c["id"] for candidates in candidate_lists for c in candidates))
+    if not ids:
+        return candidate_lists
+    full = _full_precision_vectors(vector_db, dense_index, ids)
+
+    rescored = []
+    for candidates, q in zip(candidate_lists, query_embeddings):
+        q = np.asarray(q, dtype=np.float32)
+        for c in candidates:
+            if c["id"] in full:
+                c["distance"] = float(np.sum((full[c["id"]] - q) ** 2))
+        rescored.append(sorted(candidates, key=lambda c: c["distance"])[:Config.VECTOR_TOP_K])
+    return rescored
+
+
+def _dense_candidates(vector_db, dense_index, query_embeddings: List[List[float]]) -> List[List[dict]]:
+    """在文件的向量矩陣上檢索；量化格式時多取 DENSE_RESCORE_TOP 筆候選，以原始向量重算距離後取前 VECTOR_TOP_K 筆"""
+    if not _needs_rescore(dense_index):
+        return _dense_vector_search(dense_index, query_embeddings)
+    k = max(Config.VECTOR_TOP_K, Config.DENSE_RESCORE_TOP)
+    candidate_lists = _dense_vector_search(dense_index, query_embeddings, k)
+    return _rescore_full_precision(vector_db, candidate_lists, query_embeddings, dense_index)
+
+
+def _vector_search_all_shards(query_embeddings: List[List[float]]) -> List[List[dict]]:
+    """跨文件查詢：並行查詢每個分片（以及只存於向量矩陣的文件），依距離合併各查詢的 top-k"""
+    shard_results = map_shards(lambda vector_db: _vector_search(vector_db, query_embeddings))
+    for filename in get_manifest().dense_documents():
+        dense_index = load_dense_index(filename)
+        if dense_index is not None:
+            shard_results.append(_dense_candidates(None, dense_index, query_embeddings))
+    if len(shard_results) == 1:
+        return shard_results[0]
+    return [
+        sorted((c for shard in shard_results for c in shard[q]), key=lambda c: c["distance"])[:Config.VECTOR_TOP_K]
+        for q in range(len(query_embeddings))
+    ]
+
+
+def _get_sparse_index(vector_db, filename: str):
+    """取得文件的 BM25 索引；舊版資料沒有索引時，由向量庫內容補建一次"""
+    index = load_sparse_index(filename)
+    if index is None:
+        if get_manifest().storage(filename) == "dense":
+            log(f"文件 {filename} 尚無 BM25 索引，由向量矩陣的 sidecar 補建")
+            dense_index = load_dense_index(filename)
+            if dense_index is None or not len(dense_index):
+                return None
+            return build_sparse_index(filename, dense_index.ids, dense_index.documents)
+        log(f"文件 {filename} 尚無 BM25 索引，由向量庫補建")
+        existing = vector_db._collection.get(where={"filename": filename}, include=["documents"])
+        if not existing["ids"]:
+            return None
+        index = build_sparse_index(filename, existing["ids"], existing["documents"])
+    return index
+
+
+def _add_sparse_candidates(vector_db, candidate_lists: List[List[dict]], hit_lists,
+                           query_embeddings: List[List[float]], dense_index=None) -> List[List[dict]]:
+    """
+    將只被 BM25 命中的 chunk 併入各查詢的候選集合並補算其向量距離（有向量索引時不需查詢向量庫）；
+    量化矩陣的距離與向量檢索的候選一樣以原始向量重算，兩者才可比較
+    """
+    missing_lists = []
+    for candidates, hits in zip(candidate_lists, hit_lists):
+        seen = {c["id"] for c in candidates}
+        missing_lists.append([chunk_id for chunk_id, _ in hits if chunk_id not in seen])
+
+    all_missing = list(dict.fromkeys(i for missing in missing_lists for i in missing))
+    if not all_missing:
+        return candidate_lists
+
+    if dense_index is not None:
+        rows = {i: dense_index.row_of[i] for i in all_missing if i in dense_index.row_of}
+        records = {i: (dense_index.documents[row], dense_index.metadatas[row]) for i, row in rows.items()}
+        vectors = None
+        if rows and _needs_rescore(dense_index):
+            vectors = _full_precision_vectors(vector_db, dense_index, list(rows))
     else:
-        v_scores_norm = np.ones_like(v_scores)
+        extra = vector_db._collection.get(ids=all_missing, include=["documents", "metadatas", "embeddings"])
+        records = {i: (doc, meta or {}) for i, doc, meta in zip(extra["ids"], extra["documents"], extra["metadatas"])}
+        vectors = dict(zip(extra["ids"], np.asarray(extra["embeddings"], dtype=np.float32)))
+
+    for candidates, missing, q in zip(candidate_lists, missing_lists, query_embeddings):
+        missing = [i for i in missing if i in records and (vectors is None or i in vectors)]
+        if not missing:
+            continue
+        # 與 chroma 預設的 l2 空間一致：平方歐氏距離
+        if vectors is None:
+            distances = dense_index.distances([q], [rows[i] for i in missing])[0]
+        else:
+            matrix = np.stack([vectors[i] for i in missing])
+            distances = np.sum((matrix - np.asarray(q, dtype=np.float32)) ** 2, axis=1)
+        for i, distance in zip(missing, distances):
+            doc, meta = records[i]
+            candidates.append({"id": i, "content": doc, "metadata": meta, "distance": float(distance)})
+        log(f"BM25 額外帶入 {len(missing)} 筆向量檢索未涵蓋的結果")
+    return candidate_lists
+
+
+def _bm25_scores(queries: List[str], candidate_lists: List[List[dict]], sparse_index) -> List[np.ndarray]:
+    """計算每個候選 chunk 的 BM25 分數"""
+    scores = []
+    for query, candidates in zip(queries, candidate_lists):
+        if sparse_index is not None:
+            scores.append(np.array(sparse_index.score_ids(query, [c["id"] for c in candidates])))
+        else:
+            # 未指定文件時沒有對應索引，僅在候選集合上計算
+            from rank_bm25 import BM25Okapi
+
+            bm25 = BM25Okapi([tokenize(c["content"]) for c in candidates])
+            scores.append(bm25.get_scores(tokenize(query)))
+    return scores
+
+
+def _fuse_scores(candidate_lists: List[List[dict]], bm25_lists: List[np.ndarray]) -> List[List[Tuple[dict, float]]]:
+    """向量與 BM25 分數各自 Min-Max 正規化後加權，所有查詢以補齊後的矩陣一次計算"""
+    n_queries = len(candidate_lists)
+    width = max(len(c) for c in candidate_lists)
+    mask = np.zeros((n_queries, width), dtype=bool)
+    v = np.zeros((n_queries, width))
+    b = np.zeros((n_queries, width))
+    for row, (candidates, bm25_scores) in enumerate(zip(candidate_lists, bm25_lists)):
+        n = len(candidates)
+        mask[row, :n] = True
+        v[row, :n] = [c["distance"] for c in candidates]
+        b[row, :n] = bm25_scores
+
+    # --- BM25 Min-Max normalization ---
+    b_min = np.where(mask, b, np.inf).min(axis=1, keepdims=True)
+    b_max = np.where(mask, b, -np.inf).max(axis=1, keepdims=True)
+    b_range = b_max - b_min
+    b_ok = b_range > 1e-6
+    b_norm = np.where(b_ok, (b - b_min) / np.where(b_ok, b_range, 1.0), 0.0)
 
-    # -----------------------------------------------------------
+    # --- 向量距離轉相似度並正規化（距離越小越相似，先反轉再 Min-Max）---
+    v_min = np.where(mask, v, np.inf).min(axis=1, keepdims=True)
+    v_max = np.where(mask, v, -np.inf).max(axis=1, keepdims=True)
+    v_range = v_max - v_min
+    v_ok = v_range > 1e-6
+    v_norm = np.where(v_ok, (v_max - v) / np.where(v_ok, v_range, 1.0), 1.0)
 
-    # 6. 混合分數計算
-    scored: List[Tuple[Document, float]] = []
-    for (doc, _), vscore_norm, bscore_norm in zip(combined, v_scores_norm, bm25_scores_norm):
-        score = Config.ALPHA * vscore_norm + Config.BETA * bscore_norm
-        scored.append((doc, score))
+    fused = np.where(mask, Config.ALPHA * v_norm + Config.BETA * b_norm, -np.inf)
 
-    # 排序與初步截斷
-    scored = sorted(scored, key=lambda x: x[1], reverse=True)[:Config.MID_TOP_M]
-    log(f"混合檢索完成，取前 {len(scored)} 筆結果 準備進行 Reranker")
+    scored_lists = []
+    for row, candidates in enumerate(candidate_lists):
+        # 穩定排序：同分時保留原候選順序
+        order = np.argsort(-fused[row, :len(candidates)], kind="stable")[:Config.MID_TOP_M]
+        scored_lists.append([(candidates[i], float(fused[row, i])) for i in order])
+    return scored_lists
 
-    # 7. Reranker 模型排序 --------------------------------------
-    reranked: List[Tuple[Document, float]] = []
-    log("使用 Hugging Face 模型進行 Rerank")
 
+def _rerank(queries: List[str], scored_lists: List[List[Tuple[dict, float]]]) -> Tuple[List[List[Tuple[dict, float]]], bool]:
+    """
+    所有查詢的 (query, passage) 配對一起送進 Reranker，失敗時退回混合分數排序
+    回傳 (各查詢的結果, 是否為退回的結果)
+    """
     try:
-        tokenizer = AutoTokenizer.from_pretrained(Config.RERANKER_MODEL)
-        model = AutoModelForSequenceClassification.from_pretrained(Config.RERANKER_MODEL)
-        model.eval()
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)
-
-        pairs = [(query, doc.page_content) for doc, _ in scored]
-
-        with torch.no_grad():
-            inputs = tokenizer(
-                [p[0] for p in pairs],
-                [p[1] for p in pairs],
-                padding=True,
-                truncation=True,
-                max_length=512,
-                return_tensors="pt"
-            ).to(device)
-            outputs = model(**inputs)
-            scores = outputs.logits.squeeze().detach().cpu().numpy()
-
-        for (doc, _), score in zip(scored, scores):
-            reranked.append((doc, float(score)))
+        pairs, keys = [], []
+        for query, scored in zip(queries, scored_lists):
+            query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+            for cand, _ in scored:
+                pairs.append((query, cand["content"]))
+                keys.append((query_hash, cand["id"]))
+        scores = get_reranker().score(pairs, keys=keys)
+    except Exception as e:
+        inc("rag_reranker_fallback_total")
+        log(f"[WARN] Reranker 失敗，使用混合檢索結果。錯誤：{e}")
+        return [scored[:Config.FINAL_TOP_M] for scored in scored_lists], True
 
+    final_lists = []
+    offset = 0
+    for scored in scored_lists:
+        reranked = [(cand, float(score)) for (cand, _), score in zip(scored, scores[offset:offset + len(scored)])]
+        offset += len(scored)
         reranked = sorted(reranked, key=lambda x: x[1], reverse=True)
-        final_results = reranked[:Config.FINAL_TOP_M]
+        final_lists.append(reranked[:Config.FINAL_TOP_M])
+    return final_lists, False
+
+
+# --- 排序與推測式改寫 ---
+def _cached_results(filename: str, query_embedding: List[float]):
+    cached = get_query_cache().get(filename, query_embedding)
+    inc("rag_query_cache_total", result="miss" if cached is None else "hit")
+    return cached
+
+
+def _await_rewrite(rewrite, started: float):
+    """等待背景改寫，最多到 started 起算 Config.QUERY_REWRITE_TIMEOUT 秒；逾時回傳 None"""
+    remaining = Config.QUERY_REWRITE_TIMEOUT - (time.perf_counter() - started)
+    try:
+        with span("rewrite_wait"):
+            return rewrite.result(timeout=max(0.0, remaining))
+    except FuturesTimeoutError:
+        # 尚未開始的改寫直接取消，不再佔用 LLM；已在執行的無法中斷，完成後寫入改寫快取
+        rewrite.cancel()
+        inc("rag_query_rewrite_total", result="timeout")
+        log(f"[WARN] 查詢改寫超過 {Config.QUERY_REWRITE_TIMEOUT}s，僅使用原始查詢的檢索結果")
+        return None
+
+
+def _merge_candidates(candidates: List[dict], extra: List[dict]) -> List[dict]:
+    """依 chunk id 合併兩組候選，同一 chunk 取與任一查詢較近的距離"""
+    merged = {c["id"]: c for c in candidates}
+    for c in extra:
+        if c["id"] not in merged:
+            merged[c["id"]] = c
+        elif c["distance"] < merged[c["id"]]["distance"]:
+            merged[c["id"]] = dict(merged[c["id"]], distance=c["distance"])
+    added = len(merged) - len(candidates)
+    if added:
+        log(f"改寫後的查詢額外帶入 {added} 筆候選")
+    return list(merged.values())
+
 
+def _index_ready(filename: str) -> bool:
+    """
+    文件已完成 ingest（已登記於清單）；串流 ingest 中的文件只查向量庫，
+    不使用也不由向量庫補建其 BM25 與向量索引（寫完才一次建立）
+    """
+    manifest = get_manifest()
+    return not manifest.exists or manifest.get(filename) is not None
+
+
+def _retrieve_candidates(vector_db_chunks, filename: str, queries: List[str],
+                         query_embeddings: List[List[float]]) -> Tuple[List[List[dict]], object]:
+    """向量檢索（返回距離分數）並併入 BM25 命中，回傳 (各查詢的候選集合, 文件的 BM25 索引)"""
+    indexed = bool(filename) and _index_ready(filename)
+
+    # 3. 向量檢索；未指定文件時並行查詢所有分片
+    with span("vector_search"):
+        dense_index = None
+        if indexed and (Config.VECTOR_BACKEND == "mmap" or get_manifest().storage(filename) == "dense"):
+            dense_index = _get_dense_index(vector_db_chunks, filename)
+        if dense_index is not None:
+            candidate_lists = _dense_candidates(vector_db_chunks, dense_index, query_embeddings)
+        elif filename:
+            candidate_lists = _vector_search(vector_db_chunks, query_embeddings, filename)
+        else:
+            candidate_lists = _vector_search_all_shards(query_embeddings)
+
+    # 4. BM25 倒排索引檢索，與向量結果取聯集
+    with span("bm25"):
+        sparse_index = _get_sparse_index(vector_db_chunks, filename) if indexed else None
+        if sparse_index is not None:
+            hit_lists = [sparse_index.search(q, Config.SPARSE_TOP_K) for q in queries]
+            candidate_lists = _add_sparse_candidates(
+                vector_db_chunks, candidate_lists, hit_lists, query_embeddings, dense_index
+            )
+    return candidate_lists, sparse_index
+
+
+def _rank_candidates(queries: List[str], candidate_lists: List[List[dict]], sparse_index,
+                     bm25_queries: List[str] = None) -> Tuple[List[List[dict]], bool]:
+    """
+    混合分數排序後以 Reranker 重排，回傳 (各查詢的最終結果, Reranker 是否失敗而退回混合分數排序)
+    bm25_queries 指定時以其計算 BM25 分數
+    """
+    results: List[List[dict]] = [[] for _ in queries]
+
+    # 候選為空的查詢直接回傳空結果
+    active = [k for k, candidates in enumerate(candidate_lists) if candidates]
+    for k in range(len(queries)):
+        if k not in active:
+            log(f"檢索結果為空：{queries[k]}")
+    if not active:
+        return results, False
+
+    active_queries = [queries[k] for k in active]
+    active_candidates = [candidate_lists[k] for k in active]
+    log(f"候選集合共 {sum(len(c) for c in active_candidates)} 筆結果。")
+
+    # 5. BM25 分數與混合分數
+    with span("bm25"):
+        bm25_lists = _bm25_scores([(bm25_queries or queries)[k] for k in active], active_candidates, sparse_index)
+    with span("fusion"):
+        scored_lists = _fuse_scores(active_candidates, bm25_lists)
+    log(f"混合檢索完成，每個查詢取前 {Config.MID_TOP_M} 筆結果 準備進行 Reranker")
+
+    # 6. Reranker 模型排序
+    with span("rerank"):
+        final_lists, fallback = _rerank(active_queries, scored_lists)
+    for final_results in final_lists[:1]:
         log(f"Reranker 完成，最終取 {len(final_results)} 筆結果")
-        for i, (doc, score) in enumerate(final_results[:5], 1):
-            preview = doc.page_content.strip().replace("\n", " ")[:100]
+        for i, (cand, score) in enumerate(final_results[:5], 1):
+            preview = cand["content"].strip().replace("\n", " ")[:100]
             log(f"{i}. {preview}... (score={score:.4f})")
 
-    except Exception as e:
-        log(f"[WARN] Reranker 失敗，使用混合檢索結果。錯誤：{e}")
-        final_results = scored[:Config.FINAL_TOP_M]
+    # 7. 輸出最終結果
+    for k, final_results in zip(active, final_lists):
+        results[k] = [
+            {"id": cand["id"], "content": cand["content"], "metadata": cand["metadata"], "score": score}
+            for cand, score in final_results
+        ]
+    return results, fallback
+
+
+# --- 主檢索函數 ---
+def hybrid_search(query: str, filename: str = None) -> List[str]:
+    """執行混合檢索 (向量 + BM25) 並使用 Reranker 重新排序"""
+    return hybrid_search_batch([query], filename)[0]
+
+
+def hybrid_search_batch(queries: List[str], filename: str = None) -> List[List[str]]:
+    """對多個查詢一次執行混合檢索，回傳各查詢的段落文字"""
+    return [[r["content"] for r in records] for records in hybrid_search_scored_batch(queries, filename)]
+
+
+def hybrid_search_scored(query: str, filename: str = None) -> List[dict]:
+    """同 hybrid_search，但回傳含 id、metadata 與 Reranker 分數的結果（供 context 組裝使用）"""
+    return hybrid_search_scored_batch([query], filename)[0]
+
+
+def hybrid_search_scored_batch(queries: List[str], filename: str = None) -> List[List[dict]]:
+    """
+    對多個查詢一次執行混合檢索：查詢向量一次取得、向量檢索一起送出、Reranker 配對合併計算
+    每筆結果為 {"id", "content", "metadata", "score"}，依分數由高到低排列
+    """
+    if not queries:
+        return []
+    log(f"執行混合檢索：{queries[0] if len(queries) == 1 else f'{len(queries)} 個查詢'} (文件過濾: {filename or '無'})")
+
+    # 改名的副本共用原始文件的向量
+    if filename:
+        filename = get_manifest().resolve(filename)
+
+    embedder = get_embedder()
+
+    # 1. 載入向量資料庫（指定文件時只需開啟其所屬分片）
+    vector_db_chunks = open_document_shard(filename) if filename else None
+
+    # 2. 查詢向量（一次請求）
+    with span("query_embed"):
+        query_embeddings = _embed_queries(embedder, list(queries))
+    results: List[List[dict]] = [None] * len(queries)
+
+    # 相似問題直接回傳快取的最終結果
+    pending = list(range(len(queries)))
+    if Config.QUERY_CACHE_ENABLED:
+        for i in list(pending):
+            cached = _cached_results(filename, query_embeddings[i])
+            if cached is not None:
+                results[i] = cached
+                pending.remove(i)
+    if not pending:
+        return results
+
+    pending_queries = [queries[i] for i in pending]
+    pending_embeddings = [query_embeddings[i] for i in pending]
+
+    # 3~4. 向量檢索與 BM25 檢索的候選集合
+    candidate_lists, sparse_index = _retrieve_candidates(vector_db_chunks, filename, pending_queries, pending_embeddings)
+
+    # 5~7. 混合分數、Reranker 與輸出；Reranker 失敗時的退回結果不寫入快取
+    ranked, fallback = _rank_candidates(pending_queries, candidate_lists, sparse_index)
+    for k, records in enumerate(ranked):
+        results[pending[k]] = records
+        if Config.QUERY_CACHE_ENABLED and records and not fallback:
+            get_query_cache().put(filename, pending_embeddings[k], pending_queries[k], records)
+    return results
+
+
+def hybrid_search_speculative(query: str, filename: str = None) -> List[dict]:
+    """
+    推測式查詢改寫：LLM 改寫與原始查詢的檢索同時進行，改寫在 Config.QUERY_REWRITE_TIMEOUT 內完成時
+    再以改寫後的查詢檢索，兩組候選合併後一起計算混合分數並以原始問題做 Reranker；逾時則只用原始查詢的候選
+    查詢快取命中時不改寫
+    """
+    log(f"執行混合檢索（推測式改寫）：{query} (文件過濾: {filename or '無'})")
+
+    if filename:
+        filename = get_manifest().resolve(filename)
+    embedder = get_embedder()
+    vector_db_chunks = open_document_shard(filename) if filename else None
+
+    with span("query_embed"):
+        query_embedding = _embed_queries(embedder, [query])[0]
+    if Config.QUERY_CACHE_ENABLED:
+        cached = _cached_results(filename, query_embedding)
+        if cached is not None:
+            return cached
+
+    started = time.perf_counter()
+    rewrite = submit_transform_query(query)
+    candidate_lists, sparse_index = _retrieve_candidates(vector_db_chunks, filename, [query], [query_embedding])
+    candidates = candidate_lists[0]
+
+    rewritten = _await_rewrite(rewrite, started)
+    if rewritten and rewritten != query:
+        with span("query_embed"):
+            rewritten_embedding = _embed_queries(embedder, [rewritten])[0]
+        extra_lists, _ = _retrieve_candidates(vector_db_chunks, filename, [rewritten], [rewritten_embedding])
+        candidates = _merge_candidates(candidates, extra_lists[0])
 
-    # 8. 輸出最終結果
-    return [r[0].page_content for r in final_results]
+    # BM25 同時比對原始與改寫後的用詞；Reranker 仍以使用者的原始問題評分
+    bm25_query = f"{query} {rewritten}" if rewritten and rewritten != query else query
+    ranked, fallback = _rank_candidates([query], [candidates], sparse_index, bm25_queries=[bm25_query])
+    records = ranked[0]
+    if Config.QUERY_CACHE_ENABLED and records and not fallback:
+        get_query_cache().put(filename, query_embedding, query, records)
+    return records
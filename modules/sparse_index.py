@@ -0,0 +1,181 @@
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import Config
+from modules.utils import log
+
+# 英數字以連續字元為一個 token，中日文逐字切分
+TOKEN_PATTERN = re.compile(r"[㐀-鿿]|[^\W㐀-鿿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """BM25 使用的斷詞：轉小寫後切出英數字詞與單一中文字"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SparseIndex:
+    """單一文件的 BM25 倒排索引，於 ingest 時建立並持久化"""
+
+    def __init__(self, filename: str, k1: float = 1.5, b: float = 0.75):
+        self.filename = filename
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}   # term -> {chunk_id: tf}
+        self.doc_len: Dict[str, int] = {}               # chunk_id -> token 數
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        """加入 chunk；已存在的 id 會先移除再重建"""
+        for chunk_id, text in zip(ids, texts):
+            if chunk_id in self.doc_len:
+                self.remove([chunk_id])
+            tokens = tokenize(text)
+            self.doc_len[chunk_id] = len(tokens)
+            self.total_len += len(tokens)
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def remove(self, ids: Iterable[str]):
+        """自索引移除 chunk"""
+        ids = set(i for i in ids if i in self.doc_len)
+        if not ids:
+            return
+        for chunk_id in ids:
+            self.total_len -= self.doc_len.pop(chunk_id)
+        for term in list(self.postings):
+            plist = self.postings[term]
+            for chunk_id in ids & plist.keys():
+                del plist[chunk_id]
+            if not plist:
+                del self.postings[term]
+
+    def _idf(self, df: int) -> float:
+        n = len(self.doc_len)
+        return math.log((n - df + 0.5) / (df + 0.5) + 1.0)
+
+    def _accumulate(self, query: str, only: Optional[set] = None) -> Dict[str, float]:
+        if not self.doc_len:
+            return {}
+        avgdl = self.total_len / len(self.doc_len) or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self._idf(len(plist))
+            for chunk_id, tf in plist.items():
+                if only is not None and chunk_id not in only:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[chunk_id] / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """回傳 BM25 分數最高的前 k 個 (chunk_id, score)"""
+        scores = self._accumulate(query)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def score_ids(self, query: str, ids: List[str]) -> List[float]:
+        """計算指定 chunk 的 BM25 分數（未命中任何詞者為 0）"""
+        scores = self._accumulate(query, only=set(ids))
+        return [scores.get(i, 0.0) for i in ids]
+
+    def copy(self) -> "SparseIndex":
+        """深層複製（postings 的每個詞表也複製），修改副本不影響正在查詢原索引的執行緒"""
+        index = SparseIndex(self.filename, k1=self.k1, b=self.b)
+        index.postings = {term: dict(plist) for term, plist in self.postings.items()}
+        index.doc_len = dict(self.doc_len)
+        index.total_len = self.total_len
+        return index
+
+    # -----------------------------
+    # 持久化
+    # -----------------------------
+    def to_dict(self) -> dict:
+        return {
+            "filename": self.filename,
+            "k1": self.k1,
+            "b": self.b,
+            "doc_len": self.doc_len,
+            "postings": self.postings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SparseIndex":
+        index = cls(data["filename"], k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.doc_len = data["doc_len"]
+        index.postings = data["postings"]
+        index.total_len = sum(index.doc_len.values())
+        return index
+
+
+# -----------------------------
+# 索引檔管理（快取於記憶體）
+# -----------------------------
+_indexes: Dict[str, SparseIndex] = {}
+_lock = threading.Lock()
+
+
+def index_path(filename: str) -> str:
+    """文件對應的索引檔路徑，存放於向量庫旁的 sparse 目錄"""
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    return os.path.join(str(Config.SPARSE_INDEX_DIR), f"{digest}.json")
+
+
+def save_sparse_index(index: SparseIndex):
+    """寫入硬碟（先寫暫存檔再替換，避免中斷時留下半份索引）"""
+    path = index_path(index.filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 暫存檔名唯一：同一文件並行寫入時不會互相覆寫對方寫到一半的檔案
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with _lock:
+        _indexes[index.filename] = index
+
+
+def load_sparse_index(filename: str) -> Optional[SparseIndex]:
+    """讀取文件的索引，不存在時回傳 None"""
+    with _lock:
+        if filename in _indexes:
+            return _indexes[filename]
+    path = index_path(filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        index = SparseIndex.from_dict(json.load(f))
+    with _lock:
+        _indexes[filename] = index
+    return index
+
+
+def remove_sparse_index(filename: str):
+    """刪除文件的索引（記憶體與硬碟）"""
+    with _lock:
+        _indexes.pop(filename, None)
+    path = index_path(filename)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build_sparse_index(filename: str, ids: List[str], texts: List[str]) -> SparseIndex:
+    """為文件建立（或覆蓋）索引並持久化"""
+    index = SparseIndex(filename)
+    index.add(ids, texts)
+    save_sparse_index(index)
+    log(f"BM25 索引建立完成：{filename}，共 {len(index)} 個 chunk、{len(index.postings)} 個詞")
+    return index
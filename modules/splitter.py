@@ -1,39 +1,196 @@
+import hashlib
 import os
-import json
-import nltk
-from datetime import datetime
-from langchain_community.document_loaders import UnstructuredPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import tempfile
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional
+from modules.chunk_store import get_chunk_store, slim_metadata, split_params
+from modules.manifest import file_sha256
+from modules.near_dup import NearDuplicateIndex
+from modules.metrics import inc, span
 from modules.utils import log
 from config import Config
 
+# nltk、unstructured 等較重的套件延後到第一次使用（或背景暖機）時才載入
+NLTK_MODELS = ["punkt", "punkt_tab", "averaged_perceptron_tagger_eng"]
+_nltk_ready = False
+_nltk_lock = threading.Lock()
+
+
 # -----------------------------
 # NLTK 模型檢查
 # -----------------------------
-for model_name in ["punkt", "punkt_tab", "averaged_perceptron_tagger_eng"]:
-    try:
-        nltk.data.find(model_name)
-    except LookupError:
-        log(f"[INFO] 缺少 {model_name}，正在下載...")
-        nltk.download(model_name)
-
-
-def split_documents(pdf_path: str, min_words=3):
-    """使用 UnstructuredPDFLoader 自動解析 PDF 元素並切塊，並過濾垃圾 chunk。"""
+def ensure_nltk_models():
+    """確認 NLTK 模型存在，缺少時下載；每個行程只檢查一次"""
+    global _nltk_ready
+    if _nltk_ready:
+        return
+    with _nltk_lock:
+        if _nltk_ready:
+            return
+        import nltk
+
+        for model_name in NLTK_MODELS:
+            try:
+                nltk.data.find(model_name)
+            except LookupError:
+                log(f"[INFO] 缺少 {model_name}，正在下載...")
+                nltk.download(model_name)
+        _nltk_ready = True
+
+
+def load_elements(pdf_path: str):
+    """使用 UnstructuredPDFLoader 解析 PDF，回傳元素列表"""
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"找不到 PDF 檔案：{pdf_path}")
 
+    ensure_nltk_models()
+    from langchain_community.document_loaders import UnstructuredPDFLoader
+
     log(f"使用 UnstructuredPDFLoader 讀取 PDF：{pdf_path}")
     loader = UnstructuredPDFLoader(pdf_path, mode="elements")
     docs = loader.load()
     log(f"讀取完成，共 {len(docs)} 個元素")
+    return docs
+
+
+def count_pages(pdf_path: str) -> Optional[int]:
+    """PDF 頁數；pypdf 無法讀取時回傳 None"""
+    try:
+        from pypdf import PdfReader
+
+        return len(PdfReader(pdf_path).pages)
+    except Exception as e:
+        log(f"[WARN] 無法讀取 PDF 頁數：{e}")
+        return None
+
+
+def iter_elements(pdf_path: str, page_window: int = Config.PARSE_PAGE_WINDOW,
+                  on_pages: Callable[[int, int], None] = None) -> Iterator:
+    """
+    逐段解析 PDF：每次只把 page_window 頁交給 Unstructured，解析完即 yield 該段元素，
+    記憶體只需容納一段的版面分析結果；元素的頁碼、來源與檔名為原始 PDF 的值
+    on_pages(已解析頁數, 總頁數) 於每段解析完成時呼叫
+    """
+    total = count_pages(pdf_path) if page_window else None
+    if not total or total <= page_window:
+        with span("parse"):
+            docs = load_elements(pdf_path)
+        if on_pages and total:
+            on_pages(total, total)
+        yield from docs
+        return
+
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(pdf_path)
+    filename = os.path.basename(pdf_path)
+    for start in range(0, total, page_window):
+        end = min(start + page_window, total)
+        writer = PdfWriter()
+        for page in reader.pages[start:end]:
+            writer.add_page(page)
+        fd, window_path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer.write(f)
+            with span("parse"):
+                docs = load_elements(window_path)
+        finally:
+            os.remove(window_path)
+
+        for doc in docs:
+            if doc.metadata.get("page_number") is not None:
+                doc.metadata["page_number"] += start
+            doc.metadata["source"] = pdf_path
+            doc.metadata["filename"] = filename
+        log(f"已解析第 {start + 1}-{end} 頁（共 {total} 頁）")
+        if on_pages:
+            on_pages(end, total)
+        yield from docs
+
+
+def split_documents(pdf_path: str, min_words=3):
+    """使用 UnstructuredPDFLoader 自動解析 PDF 元素並切塊，並過濾垃圾 chunk；同一檔案與參數已切過時直接讀回"""
+    unique_chunks = list(iter_document_chunks(pdf_path, min_words=min_words))
+    log(f"切塊完成：{os.path.basename(pdf_path)} 共 {len(unique_chunks)} 個 chunk")
+    return unique_chunks # 回傳去重後的列表
+
+
+def iter_document_chunks(pdf_path: str, min_words=3, on_pages: Callable[[int, int], None] = None) -> Iterator[dict]:
+    """
+    split_documents 的串流版本：逐段解析、切塊並依序 yield chunk
+    同一檔案與參數已切過時由 chunk 儲存讀回；切好的 chunk 逐組寫入 chunk 儲存，完整走完後才登記為可讀回的文件
+    """
+    store, doc_key = None, None
+    if Config.CHUNK_STORE_ENABLED and os.path.exists(pdf_path):
+        store = get_chunk_store()
+        file_hash = file_sha256(pdf_path)
+        params = split_params(min_words)
+        doc_key = store.document_key(file_hash, params)
+        if store.has_document(doc_key):
+            log(f"chunk 儲存命中，略過解析：{os.path.basename(pdf_path)}")
+            for chunk in store.iter_chunks(doc_key):
+                # 內容相同但檔名或路徑不同時，以目前的檔案為準
+                chunk["metadata"]["filename"] = os.path.basename(pdf_path)
+                chunk["metadata"]["source"] = pdf_path
+                yield chunk
+            return
+
+    # 解析與切塊逐段進行，不同時保留整份文件的元素；chunk 儲存每滿一組就寫入，不保留整份文件的 chunk
+    writer = store.open_document(doc_key, file_hash, params, os.path.basename(pdf_path)) if store is not None else None
+    group = []
+    try:
+        for chunk in iter_split(iter_elements(pdf_path, on_pages=on_pages), min_words=min_words):
+            if writer is not None:
+                group.append(chunk)
+                if len(group) >= Config.INGEST_STREAM_GROUP:
+                    writer = _write_chunk_group(writer, group)
+                    group = []
+            yield chunk
+        if writer is not None:
+            writer = _write_chunk_group(writer, group, commit=True)
+    finally:
+        # 沒有完整走完（呼叫端中斷或解析失敗）時不登記半份文件
+        if writer is not None:
+            writer.abort()
+
+
+def _write_chunk_group(writer, chunks: List[dict], commit: bool = False):
+    """寫入一組 chunk（commit 時一併登記文件）；失敗時放棄寫入 chunk 儲存並回傳 None，不影響切塊本身"""
+    try:
+        writer.write(chunks)
+        if commit:
+            writer.commit()
+            return None
+        return writer
+    except Exception as e:
+        log(f"[WARN] 寫入 chunk 儲存失敗：{e}")
+        writer.abort()
+        return None
+
+
+def split_elements(docs, min_words=3):
+    """將 Unstructured 元素切塊、過濾垃圾 chunk 並去除重複內容"""
+    unique_chunks = list(iter_split(docs, min_words=min_words))
+    log(f"完成切塊、過濾垃圾 chunk 與內容去重，最終保留 {len(unique_chunks)} 個 chunk")
+    return unique_chunks
+
+
+def iter_split(docs: Iterable, min_words=3, seen: set = None) -> Iterator[dict]:
+    """
+    逐一將元素切塊並 yield 過濾、去重後的 chunk；可接受 iter_elements 的產生器
+    seen: 已出現內容的雜湊集合（只存雜湊，不保留內容）
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=Config.CHUNK_SIZE,
         chunk_overlap=Config.CHUNK_OVERLAP
     )
+    seen = set() if seen is None else seen
+    near_dups = NearDuplicateIndex() if Config.NEAR_DUP_ENABLED else None
+    dropped, dropped_chars = 0, 0
 
-    chunks = []
     for idx, doc in enumerate(docs):
         text = doc.page_content.strip()
         if not text:
@@ -52,7 +209,8 @@ def split_documents(pdf_path: str, min_words=3):
             title = text[:50]  # fallback：取前 50 字
 
         # 分塊
-        splits = splitter.split_text(text)
+        with span("split"):
+            splits = splitter.split_text(text)
         for i, c in enumerate(splits):
             content_stripped = c.strip() # 先處理一次內容
             chunk = {
@@ -60,7 +218,7 @@ def split_documents(pdf_path: str, min_words=3):
                 "page": page_num,
                 "title": title[:100],  # 限制長度
                 "content": content_stripped,
-                "metadata": doc.metadata
+                "metadata": slim_metadata(doc.metadata)
             }
 
             # -----------------------------
@@ -71,33 +229,23 @@ def split_documents(pdf_path: str, min_words=3):
             if len(chunk["content"].split()) < min_words:
                 continue
 
-            chunks.append(chunk)
-
-    log(f"完成切塊並過濾垃圾 chunk，共 {len(chunks)} 個有效 chunk")
-
-    #去重
-    unique_chunks = []
-    seen_contents = set()
-    
-    for chunk in chunks:
-        # 使用內容作為去重鍵
-        content_key = chunk["content"]
-        
-        if content_key not in seen_contents:
-            seen_contents.add(content_key)
-            unique_chunks.append(chunk)
-
-    log(f"完成內容去重，最終保留 {len(unique_chunks)} 個 chunk")
-    # -------------------------------------------------------------
-
-    # 儲存 JSON 
-    os.makedirs("data/chunks", exist_ok=True)
-    output_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = os.path.join("data/chunks", f"{output_name}_{timestamp}.json")
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(unique_chunks, f, ensure_ascii=False, indent=2)
-
-    log(f"已保存 JSON：{output_path}")
-    return unique_chunks # 回傳去重後的列表
\ No newline at end of file
+            # 去重：以內容雜湊作為鍵
+            content_key = hashlib.sha1(chunk["content"].encode("utf-8")).digest()
+            if content_key in seen:
+                continue
+            seen.add(content_key)
+
+            # 近似重複（空白、斷字、頁碼不同）：保留第一次出現者
+            if near_dups is not None:
+                signature = near_dups.hasher.signature(chunk["content"])
+                if signature is not None:
+                    if near_dups.find(signature) is not None:
+                        dropped += 1
+                        dropped_chars += len(chunk["content"])
+                        continue
+                    near_dups.add(content_key, signature)
+            yield chunk
+
+    if dropped:
+        inc("rag_near_duplicate_total", dropped, scope="document")
+        log(f"近似重複過濾：略過 {dropped} 個 chunk（{dropped_chars} 字元），省下等量的 embedding 與向量")
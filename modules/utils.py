@@ -1,10 +1,18 @@
 import os
 import json
+from contextvars import ContextVar
 from datetime import datetime
 
+# 目前請求的 id（由 modules.metrics.request_context 設定），讓同一請求的 log 可以串起來
+current_request_id: ContextVar = ContextVar("current_request_id", default=None)
+
 def log(message: str):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] {message}")
+    request_id = current_request_id.get()
+    if request_id:
+        print(f"[{timestamp}] [{request_id}] {message}")
+    else:
+        print(f"[{timestamp}] {message}")
 
 def save_json(data, path):
     with open(path, "w", encoding="utf-8") as f:
@@ -0,0 +1,122 @@
+"""
+chunk 向量庫分片：
+依檔名雜湊將文件分配到 Config.VECTOR_SHARDS 個 Chroma collection，單一文件的查詢只需走訪所屬分片的 HNSW，
+跨文件查詢則並行查詢所有分片後合併 top-k。分片數為 1 時沿用原本的單一 collection。
+
+調整分片數後執行一次，將既有向量（含 embedding，不需重新向量化）搬到新的分片：
+python -m modules.vector_shards --migrate
+"""
+
+import argparse
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from config import Config
+from modules.clients import DEFAULT_COLLECTION, forget_chroma, get_chroma
+from modules.utils import log
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def shard_count() -> int:
+    return max(1, int(Config.VECTOR_SHARDS))
+
+
+def shard_of(filename: str) -> int:
+    """文件所屬的分片（以檔名雜湊取餘數，跨行程穩定）"""
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % shard_count()
+
+
+def shard_collection_name(shard: int) -> str:
+    if shard_count() == 1:
+        return DEFAULT_COLLECTION
+    # 單一分片時沿用 langchain 預設的 collection，舊資料不需搬移
+    return f"{DEFAULT_COLLECTION}_shard_{shard:03d}"
+
+
+def open_shard(shard: int):
+    """開啟分片對應的 Chroma collection（行程內共用）"""
+    return get_chroma(Config.VECTOR_CHUNK_DB, shard_collection_name(shard))
+
+
+def open_document_shard(filename: str):
+    """開啟文件所屬分片"""
+    return open_shard(shard_of(filename))
+
+
+def open_all_shards() -> list:
+    return [open_shard(i) for i in range(shard_count())]
+
+
+def map_shards(fn: Callable) -> list:
+    """對每個分片並行執行 fn(vectorstore)，依分片順序回傳結果"""
+    stores = open_all_shards()
+    if len(stores) == 1:
+        return [fn(stores[0])]
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=Config.SHARD_QUERY_WORKERS, thread_name_prefix="shard")
+    return list(_pool.map(fn, stores))
+
+
+def migrate(batch_size: int = 1000) -> dict:
+    """將向量庫中所有 chunk collection 的資料搬到目前分片數對應的 collection"""
+    client = open_shard(0)._client
+    targets = {shard_collection_name(i): i for i in range(shard_count())}
+    moved = 0
+
+    for collection in client.list_collections():
+        name = collection.name
+        if name != DEFAULT_COLLECTION and not name.startswith(f"{DEFAULT_COLLECTION}_shard_"):
+            continue
+        source = client.get_collection(name)
+        records = source.get(include=["metadatas"])
+
+        by_target = {}
+        for chunk_id, meta in zip(records["ids"], records["metadatas"]):
+            target = shard_collection_name(shard_of((meta or {}).get("filename") or ""))
+            if target != name:
+                by_target.setdefault(target, []).append(chunk_id)
+
+        for target, ids in by_target.items():
+            dest = open_shard(targets[target])._collection
+            for start in range(0, len(ids), batch_size):
+                batch = source.get(
+                    ids=ids[start:start + batch_size], include=["embeddings", "documents", "metadatas"]
+                )
+                dest.upsert(
+                    ids=batch["ids"],
+                    embeddings=batch["embeddings"],
+                    documents=batch["documents"],
+                    metadatas=batch["metadatas"],
+                )
+                source.delete(ids=batch["ids"])
+                moved += len(batch["ids"])
+            log(f"分片搬移：{name} -> {target}，{len(ids)} 個 chunk")
+
+        if name not in targets and source.count() == 0:
+            forget_chroma(Config.VECTOR_CHUNK_DB, name)
+            client.delete_collection(name)
+            log(f"已移除空的舊 collection：{name}")
+
+    log(f"分片搬移完成，共 {shard_count()} 個分片，搬移 {moved} 個 chunk")
+    return {"shards": shard_count(), "moved": moved}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="chunk 向量庫分片工具")
+    parser.add_argument("--migrate", action="store_true", help="依目前的 Config.VECTOR_SHARDS 搬移既有向量")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate()
+    else:
+        for i in range(shard_count()):
+            store = open_shard(i)
+            print(f"{shard_collection_name(i)}: {store._collection.count()} 個 chunk")
@@ -0,0 +1,62 @@
+import importlib
+import socket
+import threading
+import time
+from config import Config
+from modules.utils import log
+
+
+def _wait_for_port(port: int, timeout: float = 60.0):
+    """等待本機埠號開始接受連線（Gradio 伺服器啟動完成）"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def warm_up():
+    """預先載入延後匯入的套件與模型，讓第一個上傳與查詢不必等待"""
+    from modules.clients import get_embeddings, get_llm
+    from modules.context_builder import load_tokenizer
+    from modules.splitter import ensure_nltk_models
+    from modules.reranker import preload_reranker
+    from modules.vector_shards import open_all_shards
+
+    def import_all(*names):
+        return lambda: [importlib.import_module(name) for name in names]
+
+    steps = [
+        ("NLTK 模型", ensure_nltk_models),
+        ("PDF 解析套件", import_all("unstructured.partition.pdf", "langchain_community.document_loaders", "langchain_text_splitters")),
+        ("Ollama / Chroma 用戶端", lambda: (get_llm(), get_embeddings(), open_all_shards())),
+        ("LLM tokenizer", load_tokenizer),
+    ]
+    if Config.PRELOAD_RERANKER:
+        steps.append(("Reranker 模型", preload_reranker))
+
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+            log(f"暖機：{name} 載入完成（{time.perf_counter() - step_started:.1f}s）")
+        except Exception as e:
+            log(f"[WARN] 暖機：{name} 載入失敗，將於第一次使用時重試：{e}")
+    log(f"背景暖機完成，共 {time.perf_counter() - started:.1f}s")
+
+
+def start_background_warmup(wait_for_port: int = None) -> threading.Thread:
+    """在背景執行緒暖機；指定 wait_for_port 時先等介面伺服器開始服務再載入"""
+
+    def run():
+        if wait_for_port and not _wait_for_port(wait_for_port):
+            log(f"[WARN] 等待埠號 {wait_for_port} 逾時，直接開始暖機")
+        warm_up()
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,136 @@
+import threading
+from types import SimpleNamespace
+
+import chromadb
+import numpy as np
+import pytest
+from chromadb.config import Settings
+
+from config import Config
+from modules import dense_index
+from modules.dense_index import DenseDocumentWriter, build_dense_index, load_dense_index, save_dense_index
+from modules.retriever import _add_sparse_candidates
+
+FILENAME = "fixture.pdf"
+K = 10
+
+
+@pytest.fixture
+def dense_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DENSE_INDEX_DIR", tmp_path / "dense")
+    monkeypatch.setattr(dense_index, "_indexes", {})
+    return tmp_path / "dense"
+
+
+@pytest.fixture
+def collection(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 32)).astype(np.float32)
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"), settings=Settings(anonymized_telemetry=False))
+    # search_ef 涵蓋全部向量，讓 HNSW 在這份小資料上回傳精確結果
+    collection = client.create_collection("chunks", metadata={"hnsw:search_ef": 400})
+    ids = [f"chunk-{i}" for i in range(len(vectors))]
+    collection.add(
+        ids=ids,
+        embeddings=vectors.tolist(),
+        documents=[f"內容 {i}" for i in ids],
+        metadatas=[{"filename": FILENAME, "chunk_index": i} for i in range(len(vectors))],
+    )
+    queries = rng.normal(size=(5, 32)).astype(np.float32).tolist()
+    return collection, queries
+
+
+def _chroma_top_k(collection, queries):
+    result = collection.query(query_embeddings=queries, n_results=K, where={"filename": FILENAME})
+    return result["ids"]
+
+
+def _dense_top_k(index, queries):
+    return [[index.ids[row] for row, _ in hits] for hits in index.search(queries, K)]
+
+
+def test_mmap_top_k_matches_chroma(dense_dir, collection):
+    collection, queries = collection
+    index = build_dense_index(SimpleNamespace(_collection=collection), FILENAME)
+    assert index.dtype == "float32"
+    assert _dense_top_k(index, queries) == _chroma_top_k(collection, queries)
+
+    hits = index.search(queries, K)
+    expected = collection.query(query_embeddings=queries, n_results=K, where={"filename": FILENAME})["distances"]
+    np.testing.assert_allclose([[d for _, d in q] for q in hits], expected, rtol=1e-4)
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_top_k_stays_close_to_chroma(dense_dir, collection, monkeypatch, dtype):
+    collection, queries = collection
+    monkeypatch.setattr(Config, "DENSE_INDEX_DTYPE", dtype)
+    index = build_dense_index(SimpleNamespace(_collection=collection), FILENAME)
+    assert index.dtype == dtype
+    overlap = [
+        len(set(dense) & set(chroma)) / K
+        for dense, chroma in zip(_dense_top_k(index, queries), _chroma_top_k(collection, queries))
+    ]
+    assert np.mean(overlap) >= 0.9
+
+
+def test_concurrent_saves_leave_a_consistent_index(dense_dir):
+    rng = np.random.default_rng(1)
+    errors = []
+
+    def save(n):
+        try:
+            save_dense_index(
+                FILENAME, [f"c{i}" for i in range(n)], ["x"] * n, [{}] * n,
+                rng.normal(size=(n, 8)).astype(np.float32),
+            )
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(n,)) for n in range(5, 25)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert not list(dense_dir.glob("*.tmp"))
+    dense_index._indexes.clear()
+    index = load_dense_index(FILENAME)
+    assert index is not None and index.vectors.shape[0] == len(index.ids)
+
+
+def test_dense_only_writer_keeps_a_float32_copy(dense_dir, monkeypatch):
+    monkeypatch.setattr(Config, "DENSE_INDEX_DTYPE", "int8")
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(30, 16)).astype(np.float32)
+    ids = [f"c{i}" for i in range(30)]
+
+    writer = DenseDocumentWriter(FILENAME)
+    writer.upsert(ids=ids, embeddings=vectors, documents=[f"內容 {i}" for i in ids], metadatas=[{"page": 1}] * 30)
+    index = writer.commit()
+    assert index.dtype == "int8"
+    np.testing.assert_array_equal(index.float32_rows([3, 7]), vectors[[3, 7]])
+
+    # 以現有矩陣為基礎更新：保留的 chunk 沿用 float32 原始向量
+    writer = DenseDocumentWriter(FILENAME, index)
+    writer.delete(ids=["c0"])
+    writer.update(ids=["c1"], metadatas=[{"page": 2}])
+    writer.upsert(ids=["new"], embeddings=[vectors[0] * 2], documents=["新內容"], metadatas=[{"page": 3}])
+    updated = writer.commit()
+    assert "c0" not in updated.row_of and len(updated) == 30
+    assert updated.metadatas[updated.row_of["c1"]] == {"page": 2}
+    np.testing.assert_array_equal(updated.float32_rows([updated.row_of["c5"]])[0], vectors[5])
+
+
+def test_bm25_only_candidates_are_rescored_in_float32(dense_dir, monkeypatch):
+    monkeypatch.setattr(Config, "DENSE_INDEX_DTYPE", "int8")
+    monkeypatch.setattr(Config, "DENSE_RESCORE_TOP", 100)
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(20, 16)).astype(np.float32)
+    ids = [f"c{i}" for i in range(20)]
+    index = save_dense_index(FILENAME, ids, ids, [{}] * 20, vectors, full_precision=True)
+    q = rng.normal(size=16).astype(np.float32)
+
+    candidates = _add_sparse_candidates(None, [[]], [[("c4", 1.0), ("c9", 0.5)]], [q.tolist()], index)[0]
+    expected = np.sum((vectors[[4, 9]] - q) ** 2, axis=1)
+    np.testing.assert_allclose([c["distance"] for c in candidates], expected, rtol=1e-5)
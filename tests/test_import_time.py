@@ -0,0 +1,19 @@
+from statistics import median
+
+import pytest
+
+from benchmarks.import_time import BUDGETS, measure
+
+RUNS = 3
+
+
+@pytest.mark.parametrize("module", list(BUDGETS))
+def test_import_stays_within_budget_and_lazy(module):
+    samples = [measure(module) for _ in range(RUNS)]
+    errors = [s["error"] for s in samples if "error" in s]
+    if errors:
+        # 缺少選用相依套件（例如未安裝 gradio）時跳過
+        pytest.skip(errors[0])
+
+    assert not samples[0]["heavy"], f"{module} 匯入時載入了 {samples[0]['heavy']}"
+    assert median(s["seconds"] for s in samples) <= BUDGETS[module]
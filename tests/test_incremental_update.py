@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import chromadb
+import pytest
+from chromadb.config import Settings
+
+from config import Config
+from modules import sparse_index
+from modules.embedder import make_chunk_id, update_vectors
+from modules.sparse_index import SparseIndex, load_sparse_index
+
+FILENAME = "paper.pdf"
+V1 = ["attention is all you need", "recurrent networks are slow", "convolution kernels"]
+V2 = ["convolution kernels", "attention is all you need", "transformers scale well"]
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(t)), float(t.count(" ")), 1.0] for t in texts]
+
+
+def _chunks(texts):
+    return [
+        {"id": i, "page": 1, "title": "", "content": t, "metadata": {"filename": FILENAME, "category": "NarrativeText"}}
+        for i, t in enumerate(texts)
+    ]
+
+
+@pytest.fixture
+def vectorstore(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "NEAR_DUP_ENABLED", False)
+    monkeypatch.setattr(Config, "SPARSE_INDEX_DIR", tmp_path / "sparse")
+    monkeypatch.setattr(sparse_index, "_indexes", {})
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"), settings=Settings(anonymized_telemetry=False))
+    return SimpleNamespace(_collection=client.create_collection("chunks"))
+
+
+def test_update_embeds_only_added_chunks(vectorstore):
+    update_vectors(vectorstore, FakeEmbedder(), _chunks(V1), FILENAME)
+    embedder = FakeEmbedder()
+    stats = update_vectors(vectorstore, embedder, _chunks(V2), FILENAME)
+
+    assert stats == {"added": 1, "removed": 1, "unchanged": 2}
+    assert embedder.embedded == ["transformers scale well"]
+
+    stored = vectorstore._collection.get(where={"filename": FILENAME}, include=["metadatas"])
+    assert set(stored["ids"]) == {make_chunk_id(FILENAME, t) for t in V2}
+    positions = {meta["id"] for meta in stored["metadatas"]}
+    assert positions == {0, 1, 2}
+
+
+def test_update_swaps_in_a_new_sparse_index(vectorstore):
+    update_vectors(vectorstore, FakeEmbedder(), _chunks(V1), FILENAME)
+    before = load_sparse_index(FILENAME)
+    before_postings = {term: dict(plist) for term, plist in before.postings.items()}
+
+    update_vectors(vectorstore, FakeEmbedder(), _chunks(V2), FILENAME)
+    after = load_sparse_index(FILENAME)
+
+    assert after is not before
+    assert set(after.doc_len) == {make_chunk_id(FILENAME, t) for t in V2}
+    assert after.search("transformers", 1)[0][0] == make_chunk_id(FILENAME, "transformers scale well")
+    assert not after.search("recurrent", 1)
+    # 查詢中的舊索引完全不受影響
+    assert before.postings == before_postings
+    assert set(before.doc_len) == {make_chunk_id(FILENAME, t) for t in V1}
+
+
+def test_copy_does_not_share_postings():
+    index = SparseIndex(FILENAME)
+    index.add(["a", "b"], ["alpha beta", "beta gamma"])
+    copy = index.copy()
+    copy.remove(["b"])
+    copy.add(["c"], ["delta"])
+
+    assert set(index.doc_len) == {"a", "b"}
+    assert index.postings["beta"] == {"a": 1, "b": 1}
+    assert "delta" not in index.postings
+    assert index.total_len == 4
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from modules.near_dup import MinHasher, normalize
+from modules.splitter import iter_split
+
+TABLE_2 = (
+    "Table 2 reports the results on the validation set. The model reaches accuracy 85.3 "
+    "with batch size 128 after 200 epochs of training with the cosine schedule."
+)
+TABLE_3 = (
+    "Table 3 reports the results on the validation set. The model reaches accuracy 91.7 "
+    "with batch size 256 after 300 epochs of training with the cosine schedule."
+)
+
+
+def _doc(text):
+    return SimpleNamespace(page_content=text, metadata={"page_number": 1, "category": "NarrativeText"})
+
+
+def test_page_numbers_are_masked():
+    assert normalize("12\nThe encoder maps tokens to vectors.") == normalize("13\nThe encoder maps tokens to vectors.")
+    assert normalize("The encoder maps tokens.\nPage 4 of 10") == normalize("The encoder maps tokens.\nPage 5 of 10")
+
+
+def test_passages_differing_only_in_numbers_are_kept():
+    hasher = MinHasher()
+    similarity = MinHasher.similarity(hasher.signature(TABLE_2), hasher.signature(TABLE_3))
+    assert similarity < hasher.threshold
+
+    chunks = list(iter_split([_doc(TABLE_2), _doc(TABLE_3)]))
+    assert [c["content"] for c in chunks] == [TABLE_2, TABLE_3]
+
+
+def test_reflowed_passage_is_dropped():
+    reflowed = TABLE_2.replace("valida", "valida-\n").replace(" with", "\n with")
+    chunks = list(iter_split([_doc(TABLE_2), _doc(reflowed)]))
+    assert [c["content"] for c in chunks] == [TABLE_2]